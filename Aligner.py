@@ -7,7 +7,15 @@ Created on Fri Jun 14 21:43:19 2024
 
 import subprocess
 import os
+import glob
+import logging
+import soundfile
+import textgrids
+from Instrumentation import timer
 
+logger = logging.getLogger(__name__)
+
+@timer('mfa_alignment')
 def run_mfa_alignment(input_path, model_directory, dictionary_path, output_directory):
     """
     Run MFA alignment using a subprocess call to the MFA virtual environment.
@@ -38,21 +46,77 @@ def run_mfa_alignment(input_path, model_directory, dictionary_path, output_direc
     ]
 
     # Log the command and paths for debugging
-    print(f"Running command: {' '.join(command)}")
-    print(f"input  path: {input_path} - Exists: {os.path.exists(input_path)}")    
-    print(f"Model directory: {model_directory} - Exists: {os.path.exists(model_directory)}")
-    print(f"Dictionary path: {dictionary_path} - Exists: {os.path.exists(dictionary_path)}")
-    print(f"Output directory: {output_directory} - Exists: {os.path.exists(output_directory)}")
+    logger.debug(f"Running command: {' '.join(command)}")
+    logger.debug(f"input  path: {input_path} - Exists: {os.path.exists(input_path)}")    
+    logger.debug(f"Model directory: {model_directory} - Exists: {os.path.exists(model_directory)}")
+    logger.debug(f"Dictionary path: {dictionary_path} - Exists: {os.path.exists(dictionary_path)}")
+    logger.debug(f"Output directory: {output_directory} - Exists: {os.path.exists(output_directory)}")
 
     try:
         result = subprocess.run(command, check=True, capture_output=True, text=True, shell=True)
-        print("MFA alignment completed successfully.")
-        print("Output:", result.stdout)
+        logger.info("MFA alignment completed successfully.")
+        logger.debug(f"Output: {result.stdout}")
     except subprocess.CalledProcessError as e:
-        print(f"Error occurred: {e}")
-        print(f"Command output: {e.output}")
-        print(f"Command stderr: {e.stderr}")
+        logger.error(f"Error occurred: {e}")
+        logger.error(f"Command output: {e.output}")
+        logger.error(f"Command stderr: {e.stderr}")
     except FileNotFoundError as e:
-        print(f"FileNotFoundError: {e}")
+        logger.error(f"FileNotFoundError: {e}")
+
+# Phones of the words in the two RAVDESS statements, as labelled by the english_mfa model
+stub_pronunciations = {
+    "kids": ["kʰ", "ɪ", "d", "z"],
+    "dogs": ["d", "ɑ", "ɡ", "z"],
+    "are": ["ɑ", "ɹ"],
+    "talking": ["tʰ", "ɑ", "k", "ɪ", "ŋ"],
+    "sitting": ["s", "ɪ", "ɾ", "ɪ", "ŋ"],
+    "by": ["b", "aj"],
+    "the": ["ð", "ə"],
+    "door": ["d", "ɔ", "ɹ"],
+}
+
+@timer('stub_alignment')
+def run_stub_alignment(input_path, model_directory, dictionary_path, output_directory, lead_silence=0.1):
+    """
+    Write an evenly spaced TextGrid in place of MFA, for benchmarks and machines without MFA.
+
+    Takes the same arguments as run_mfa_alignment: the statement .txt and .wav in input_path
+    are aligned by spreading the words, and the phones within them, evenly over the audio
+    after a short leading and trailing silence. The model and dictionary are ignored.
+
+    Parameters:
+    input_path (str): The directory holding the statement .txt and the .wav file.
+    model_directory (str): Unused.
+    dictionary_path (str): Unused.
+    output_directory (str): The directory the .TextGrid is written to.
+    lead_silence (float): The silence in seconds before the first and after the last word.
+    """
+    for text_path in glob.glob(os.path.join(input_path, '*.txt')):
+        stem = os.path.splitext(os.path.basename(text_path))[0]
+        with open(text_path, 'r') as txt_file:
+            words = txt_file.read().split()
+        duration = soundfile.info(os.path.join(input_path, stem + '.wav')).duration
+
+        speech_start = min(lead_silence, duration / 4)
+        speech_end = duration - speech_start
+        word_length = (speech_end - speech_start) / len(words)
 
+        word_intervals = [textgrids.Interval('', 0.0, speech_start)]
+        phone_intervals = [textgrids.Interval('', 0.0, speech_start)]
+        for word_index, word in enumerate(words):
+            word_start = speech_start + word_index * word_length
+            word_intervals.append(textgrids.Interval(word, word_start, word_start + word_length))
+            phones = stub_pronunciations.get(word, ["spn"])
+            phone_length = word_length / len(phones)
+            for phone_index, phone in enumerate(phones):
+                phone_start = word_start + phone_index * phone_length
+                phone_intervals.append(textgrids.Interval(phone, phone_start, phone_start + phone_length))
+        word_intervals.append(textgrids.Interval('', speech_end, duration))
+        phone_intervals.append(textgrids.Interval('', speech_end, duration))
 
+        grid = textgrids.TextGrid()
+        grid.xmin, grid.xmax = 0.0, duration
+        grid['words'] = textgrids.Tier(word_intervals, 0.0, duration)
+        grid['phones'] = textgrids.Tier(phone_intervals, 0.0, duration)
+        grid.write(os.path.join(output_directory, stem + '.TextGrid'))
+        logger.info(f"Stub alignment written for {stem}")
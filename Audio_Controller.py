@@ -6,39 +6,69 @@ Created on Thu Jun 13 13:45:46 2024
 """
 import imageio_ffmpeg as ffmpeg
 import numpy as np
-import librosa
-import librosa.display
-from matplotlib import pyplot as plt
 import subprocess
+import logging
+from Instrumentation import timer
+from Mel_Engine import get_mel_engine
+from itertools import count
+
+logger = logging.getLogger(__name__)
 
 
 class AudioController:
     """
     A class to handle audio extraction, conversion, and mel spectrogram generation.
     """
-    def __init__(self, audio_path=None, output_file=None):
+    def __init__(self, audio_path=None, output_file=None, show=True, sr=44100, n_mels=128, hop_length=512, fps=None,
+                 stream=False, block_seconds=1.0):
         """
         Initialize an AudioController instance.
         
+        With stream, the audio is not held in memory: ffmpeg writes the WAV straight from
+        the source, and the audio is decoded again in blocks of block_seconds when the mel
+        segments are first asked for, each block's mel columns being computed as it
+        arrives. Memory then stays bounded however long the recording is.
+        
         Parameters:
         audio_path (str): The path to the audio file.
         output_file (str): The path to save the converted WAV file.
+        show (bool): Whether to display the mel spectrogram.
+        sr (int): The sample rate ffmpeg resamples the audio to, e.g. 16000 for speech.
+        n_mels (int): The number of mel bands.
+        hop_length (int): The hop length, or the one to stay close to when fps is given.
+        fps (float): The video frame rate, to give every frame a whole number of mel columns; None to keep hop_length.
+        stream (bool): Whether to decode the audio and compute the mel spectrogram in blocks.
+        block_seconds (float): The length of each decoded block when streaming.
         """
         if audio_path:
+            self.audio_path = audio_path
+            self.sr = sr
+            self.n_mels = n_mels
+            self.mel_engine = get_mel_engine(sr, n_mels, hop_length, fps=fps)
+            self.hop_length = self.mel_engine.hop_length
+            self.stream = stream
+            self.block_samples = max(int(block_seconds * sr), 1)
+            self.mel = None
+            self.mel_columns = None
+
             self.ffmpeg_exe = ffmpeg.get_ffmpeg_exe()
+            if stream:
+                self.extract_wav(audio_path, output_file)
+                if show:
+                    logger.info("The streamed mel spectrogram is not shown, it is never held whole")
+                return
+
             self.extracted_audio = self.extract_audio(audio_path)
             self.converted_audio = self.to_wav(self.extracted_audio, output_file)
             
-            self.sr = 44100
-            self.n_mels = 128
-            self.hop_length = 512
-            
             self.mel = self.melspectrogram(self.extracted_audio, self.sr, self.n_mels, self.hop_length)
-            self.show_melspectrogram(self.mel, self.sr, self.hop_length)            
+            if show:
+                self.show_melspectrogram(self.mel, self.sr, self.hop_length)            
             
         else:
-            print("unable to handle audio")
+            logger.warning("unable to handle audio")
     
+    @timer('extract_audio')
     def extract_audio(self, filename):
         """
         Extract audio from the given file using FFmpeg.
@@ -55,7 +85,7 @@ class AudioController:
             '-f', 'f32le',
             '-acodec', 'pcm_f32le',
             '-ac', '1',
-            '-ar', '44100',
+            '-ar', str(self.sr),
             '-'
         ]
         
@@ -67,6 +97,82 @@ class AudioController:
         
         return np.frombuffer(out, np.float32)
     
+    def iter_audio_blocks(self, filename, block_samples):
+        """
+        Decode the audio of the given file with FFmpeg, one block at a time.
+        
+        Parameters:
+        filename (str): The path to the file to extract audio from.
+        block_samples (int): The number of samples per block; the last block may be shorter.
+        
+        Yields:
+        np.ndarray: The next float32 block of mono audio at the controller's sample rate.
+        """
+        command = [
+            self.ffmpeg_exe,
+            '-loglevel', 'error',
+            '-i', filename,
+            '-vn',
+            '-f', 'f32le',
+            '-acodec', 'pcm_f32le',
+            '-ac', '1',
+            '-ar', str(self.sr),
+            '-'
+        ]
+        
+        block_bytes = block_samples * 4
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=block_bytes)
+        num_samples = 0
+        try:
+            while True:
+                with timer('audio_decode'):
+                    buffer = process.stdout.read(block_bytes)
+                if not buffer:
+                    break
+                block = np.frombuffer(buffer[:len(buffer) // 4 * 4], np.float32)
+                num_samples += len(block)
+                yield block
+        finally:
+            # The consumer may stop early, leaving ffmpeg blocked on a full pipe
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            err = process.stderr.read().decode('utf-8', 'replace')
+            process.stderr.close()
+            process.wait()
+        
+        if process.returncode != 0 or num_samples == 0:
+            raise RuntimeError(f"iter_audio_blocks - ffmpeg command failed with error: {err.strip()}")
+    
+    @timer('extract_wav')
+    def extract_wav(self, filename, output_file):
+        """
+        Write the audio of the given file to a mono 32bit PCM WAV at the controller's sample rate.
+        
+        Unlike to_wav, ffmpeg reads the source itself, so the audio never passes through memory.
+        
+        Parameters:
+        filename (str): The path to the file to extract audio from.
+        output_file (str): The path to save the WAV file.
+        """
+        command = [
+            self.ffmpeg_exe,
+            '-loglevel', 'error',
+            '-i', filename,
+            '-vn',
+            '-ac', '1',
+            '-ar', str(self.sr),
+            '-acodec', 'pcm_s32le',
+            '-y',
+            output_file
+        ]
+        
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"extract_wav - ffmpeg command failed with error: {result.stderr.decode('utf-8')}")
+        
+        logger.info(f"Audio converted to WAV successfully and saved to {output_file}")
+    
     def to_wav(self, input_data, output_file):
         """
          Convert audio data to WAV format using FFmpeg.
@@ -78,7 +184,7 @@ class AudioController:
         command = [
                 self.ffmpeg_exe,
                 '-f', 'f32le',  # input 32bit float little endian
-                '-ar', '44100',  # input sample rate 44100 Hz
+                '-ar', str(self.sr),  # input sample rate, as extracted
                 '-ac', '1',  # input 1 channel (mono)
                 '-i', '-',  # input file via pipe
                 '-acodec', 'pcm_s32le',  # output 32bit PCM
@@ -89,19 +195,14 @@ class AudioController:
         process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             
         try:
-            chunk_size = 4096  # Define a chunk size for writing
-            for start in range(0, len(input_data), chunk_size):
-                end = start + chunk_size
-                process.stdin.write(input_data[start:end].tobytes())
-            
-            process.stdin.close()
-            
-            out, err = process.communicate()
+            # communicate writes the input and closes stdin while draining stdout/stderr, so
+            # ffmpeg cannot block on a full pipe
+            out, err = process.communicate(input_data.tobytes())
             
             if process.returncode != 0:
                 raise RuntimeError(f"to_wav - ffmpeg command failed with error: {err.decode('utf-8')}")
             
-            print(f"Audio converted to WAV successfully and saved to {output_file}")
+            logger.info(f"Audio converted to WAV successfully and saved to {output_file}")
         
         except Exception as e:
             raise RuntimeError(f"to_wav - an error occurred: {str(e)}")
@@ -117,21 +218,25 @@ class AudioController:
         
 
     
+    @timer('melspectrogram')
     def melspectrogram(self, audio, sr, n_mels, hop_length):
         """
-        Generate a mel spectrogram from the given audio data.
+        Generate a log mel spectrogram from the given audio data.
+        
+        The filterbank and window are cached per configuration by Mel_Engine. The
+        spectrogram is a power spectrogram, so it is converted with power_to_db; the
+        amplitude_to_db used before doubled the dB scale.
         
         Parameters:
         audio (np.ndarray): The input audio data.
         sr (int): The sample rate.
         n_mels (int): The number of mel bands.
-        hop_length (int): The hop length.
+        hop_length (float): The hop length.
         
         Returns:
         np.ndarray: The generated mel spectrogram.
         """
-        mel = librosa.amplitude_to_db(librosa.feature.melspectrogram(y=audio, sr=sr, n_mels=n_mels, hop_length=hop_length))
-        return mel
+        return get_mel_engine(sr, n_mels, hop_length).melspectrogram(audio)
     
     def show_melspectrogram(self, mel, sr, hop_length):
         """
@@ -142,8 +247,12 @@ class AudioController:
         sr (int): The sample rate.
         hop_length (int): The hop length.
         """
+        # Plotting is only needed when showing spectrograms, so matplotlib is loaded here
+        import librosa.display
+        from matplotlib import pyplot as plt
+
         plt.figure(figsize=(14, 4))
-        librosa.display.specshow(mel, sr=sr,hop_length=hop_length, x_axis='time', y_axis='mel')
+        librosa.display.specshow(mel, sr=sr,hop_length=int(round(hop_length)), x_axis='time', y_axis='mel')
         plt.title('Log mel spectrogram')
         plt.colorbar(format='%+02.0f dB')
         plt.tight_layout()
@@ -160,14 +269,75 @@ class AudioController:
         Returns:
         np.ndarray: The mel spectrogram segment for the video frame.
         """        
-        segment_start_sec = video_frame_timestamp_ms / 1000.0
-        segment_end_sec = (video_frame_timestamp_ms + video_frame_duration_ms) / 1000.0       
-
-        mel_frame_start_index = int((segment_start_sec * self.sr) / self.hop_length)
-        mel_frame_end_index = int((segment_end_sec * self.sr) / self.hop_length)
+        mel_frame_start_index, mel_frame_end_index = self.mel_engine.column_range(video_frame_timestamp_ms, video_frame_duration_ms)
+        
+        if self.stream:
+            return self.streamed_mel_segment(mel_frame_start_index, mel_frame_end_index)
         
         mel_segment = self.mel[:, mel_frame_start_index:mel_frame_end_index]      
         
         return  mel_segment
     
+    def streamed_mel_segment(self, start, end):
+        """
+        Return mel columns from the streamed spectrogram, decoding the audio as far as they need.
+        
+        Only the columns from start onwards are kept afterwards, so segments must be asked
+        for in order, as the video frames come.
+        
+        Parameters:
+        start (int): The first column.
+        end (int): The column after the last.
+        
+        Returns:
+        np.ndarray: A copy of the columns, fewer when the audio ends first.
+        """
+        if self.mel_columns is None:
+            self.mel_columns = self.mel_engine.melspectrogram_stream(self.iter_audio_blocks(self.audio_path, self.block_samples))
+            self.mel = np.zeros((self.n_mels, 0), dtype=np.float32)
+            self.mel_start = 0
+        if start < self.mel_start:
+            raise ValueError(f"streamed_mel_segment - column {start} was already released, segments must be asked for in order")
+        
+        while self.mel_start + self.mel.shape[1] < end:
+            with timer('melspectrogram'):
+                columns = next(self.mel_columns, None)
+            if columns is None:
+                break
+            self.mel = np.concatenate([self.mel, columns], axis=1)
+        
+        # Release the columns before this segment
+        drop = min(start - self.mel_start, self.mel.shape[1])
+        self.mel = self.mel[:, drop:]
+        self.mel_start += drop
+        return self.mel[:, start - self.mel_start:end - self.mel_start].copy()
+    
+    def iter_mel_segments(self, video_frame_duration_ms):
+        """
+        Generator yielding the mel spectrogram segment of each video frame, with the frame
+        index and timestamp VideoController.process_video gives the frame, until the audio ends.
+        
+        Parameters:
+        video_frame_duration_ms (float): The duration of a video frame in milliseconds.
+        
+        Yields:
+        tuple: The frame index, the frame timestamp in milliseconds and the frame's mel segment.
+        """
+        for frame_index in count():
+            frame_timestamp_ms = int(frame_index * video_frame_duration_ms)
+            mel_segment = self.retrive_mel_segment(frame_timestamp_ms, video_frame_duration_ms)
+            if mel_segment.shape[1] == 0:
+                return
+            yield frame_index + 1, frame_timestamp_ms, mel_segment
+    
+    def close(self):
+        """
+        Stop the streamed decoding, if any, and release the mel spectrogram.
+        """
+        if self.mel_columns is not None:
+            self.mel_columns.close()
+            self.mel_columns = None
+        if self.stream:
+            self.mel = None
+    
 
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 00:52:09 2026
+
+Data augmentation of training batches, as vectorised TensorFlow ops on whole batches.
+The augmentation runs in the tf.data pipeline after batching and after the cache, so
+every epoch sees different augmentations while the per-sample loading stays unchanged:
+
+- landmarks: horizontal mirroring, with each landmark swapped for its mirror image,
+  scaling, rotation and translation about the face centre, and per-point jitter;
+- mel spectrograms: SpecAugment-style masks of whole frames and of frequency bands;
+- frame dropout, setting a frame's landmarks and mel segment to the padding value.
+
+The geometric transforms act on the landmarks in normalised image coordinates, the
+batch being un-normalised first when dataset statistics are applied. Masks and
+dropped frames take the value padding has after normalisation: zero; padding frames
+are left at zero.
+
+Every random draw is a stateless op seeded with (seed, batch number), so a run is
+reproducible whatever the parallelism of the pipeline.
+
+@author: Jayyy
+"""
+import json
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUGMENTATION = {
+    'seed': 0,
+    'mirror_probability': 0.5,
+    'scale_range': [0.9, 1.1],
+    'rotation_degrees': 10.0,
+    'translation': 0.03,  # In normalised image coordinates
+    'jitter_std': 0.002,
+    'time_masks': 2,
+    'time_mask_frames': 3,
+    'frequency_masks': 2,
+    'frequency_mask_bins': 16,
+    'frame_dropout': 0.05,
+}
+# How far, in the units of the batch, a frame's landmarks may be from those of a frame without a face
+# and still be taken for one: normalising and un-normalising does not give back exact zeros
+NO_FACE_TOLERANCE = 1e-3
+
+
+def load_augmentation_config(path=None):
+    """
+    Load the augmentation settings.
+
+    Parameters:
+    path (str): Optional JSON file overriding some of DEFAULT_AUGMENTATION.
+
+    Returns:
+    dict: The settings.
+    """
+    config = dict(DEFAULT_AUGMENTATION)
+    if path:
+        with open(path, 'r') as json_file:
+            overrides = json.load(json_file)
+        unknown = set(overrides) - set(config)
+        if unknown:
+            raise ValueError(f"load_augmentation_config - unknown settings: {sorted(unknown)}")
+        config.update(overrides)
+    return config
+
+def mirror_permutation(reference_face):
+    """
+    Find the landmark each landmark becomes when the face is mirrored.
+
+    The reference face is reflected about its vertical centre line and every landmark
+    is matched to the nearest landmark of the reflection, one to one. On a roughly
+    frontal face, such as the dataset's mean, this pairs the left and right eye, brow,
+    iris and mouth corner points and leaves those on the centre line in place.
+
+    Parameters:
+    reference_face (np.ndarray): A (num_landmarks, 3) face.
+
+    Returns:
+    np.ndarray: The int32 index of each landmark's mirror image.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    face = np.asarray(reference_face, dtype=np.float64)
+    reflected = face.copy()
+    reflected[:, 0] = 2 * face[:, 0].mean() - face[:, 0]
+    cost = np.linalg.norm(reflected[:, None, :] - face[None, :, :], axis=-1)
+    _, indices = linear_sum_assignment(cost)
+    return indices.astype(np.int32)
+
+def band_mask(seed, batch_size, length, count, max_width):
+    """
+    Draw count bands of up to max_width positions along an axis, per sample.
+
+    Parameters:
+    seed (tf.Tensor): The stateless seed, shape [2].
+    batch_size (tf.Tensor): The number of samples.
+    length (tf.Tensor): The length of the axis.
+    count (int): The number of bands per sample.
+    max_width (int): The widest band.
+
+    Returns:
+    tf.Tensor: A (batch_size, length) float32 mask, 0 inside a band and 1 elsewhere.
+    """
+    width_seed, start_seed = tf.unstack(tf.random.experimental.stateless_split(seed, 2))
+    widths = tf.random.stateless_uniform([batch_size, count], width_seed, 0, max_width + 1, dtype=tf.int32)
+    widths = tf.minimum(widths, length)
+    room = tf.cast(length - widths + 1, tf.float32)
+    starts = tf.cast(tf.random.stateless_uniform([batch_size, count], start_seed) * room, tf.int32)
+    positions = tf.range(length)[None, None, :]
+    inside = (positions >= starts[..., None]) & (positions < (starts + widths)[..., None])
+    return 1.0 - tf.cast(tf.reduce_any(inside, axis=1), tf.float32)
+
+class BatchAugmenter:
+    """
+    Augments batches of (landmarks, mel spectrograms, phonemes) inputs, for tf.data map.
+    """
+    def __init__(self, config=None, parameters=None, mirror_indices=None):
+        """
+        Initialize a BatchAugmenter instance.
+
+        Parameters:
+        config (dict): Settings overriding some of DEFAULT_AUGMENTATION.
+        parameters (dict): The normalisation the batches have had, from Normalization_Stats.affine_parameters;
+            None when the landmarks are not normalised.
+        mirror_indices (np.ndarray): Each landmark's mirror image, from the dataset's mean face when None.
+        """
+        self.config = dict(DEFAULT_AUGMENTATION, **(config or {}))
+        self.parameters = parameters
+        if mirror_indices is None and parameters is not None:
+            mirror_indices = mirror_permutation(parameters['landmark_offset'])
+        if mirror_indices is None and self.config['mirror_probability'] > 0:
+            logger.warning("No mean face to pair the landmarks with, mirroring is disabled")
+        self.mirror_indices = None if mirror_indices is None else tf.constant(mirror_indices, dtype=tf.int32)
+
+    def __call__(self, step, batch):
+        """
+        Augment a batch.
+
+        Parameters:
+        step (tf.Tensor): The batch number, from Dataset.enumerate, which seeds the batch's draws.
+        batch (tuple): ((landmarks, mels, phonemes), labels), the inputs optionally followed by each sample's
+            number of frames.
+
+        Returns:
+        tuple: The batch with augmented landmarks and mel spectrograms.
+        """
+        (landmarks, mels, phonemes, *lengths), labels = batch
+        seed = tf.stack([tf.constant(self.config['seed'], dtype=tf.int64), tf.cast(step, tf.int64)])
+        seeds = tf.unstack(tf.random.experimental.stateless_split(seed, 4))
+
+        # Padding frames stay zeros; without lengths they are the frames already all zeros
+        if lengths:
+            valid = tf.sequence_mask(lengths[0], tf.shape(landmarks)[1], dtype=tf.float32)
+        else:
+            valid = tf.cast(tf.reduce_any(tf.not_equal(landmarks, 0.0), axis=[2, 3]), tf.float32)
+
+        landmarks = self.augment_landmarks(landmarks, seeds[0], self.face_frames(landmarks) * valid)
+        mels = self.mask_mels(mels, seeds[1])
+        landmarks, mels = self.drop_frames(landmarks, mels, seeds[2])
+        return (landmarks * valid[:, :, None, None], mels * valid[:, :, None, None, None], phonemes, *lengths), labels
+
+    def face_frames(self, landmarks):
+        """
+        Find the frames with a face.
+
+        Frames without a face are stored as zeros, which normalisation turns into
+        -landmark_offset * landmark_scale; the comparison is made on the batch as it is.
+
+        Parameters:
+        landmarks (tf.Tensor): (batch, frames, num_landmarks, 3) landmarks, normalised when the augmenter has parameters.
+
+        Returns:
+        tf.Tensor: The (batch, frames) float32 mask of the frames with a face.
+        """
+        no_face = 0.0
+        if self.parameters is not None:
+            no_face = -self.parameters['landmark_offset'] * self.parameters['landmark_scale']
+        return tf.cast(tf.reduce_any(tf.abs(landmarks - no_face) > NO_FACE_TOLERANCE, axis=[2, 3]), tf.float32)
+
+    def augment_landmarks(self, landmarks, seed, face=None):
+        """
+        Mirror, scale, rotate, translate and jitter each sample's landmarks.
+
+        One transform is drawn per sample and applied to all its frames with a face, about
+        the centre of those faces; the jitter is drawn per point. The other frames are
+        returned unchanged.
+
+        Parameters:
+        landmarks (tf.Tensor): (batch, frames, num_landmarks, 3) landmarks.
+        seed (tf.Tensor): The stateless seed, shape [2].
+        face (tf.Tensor): The (batch, frames) float32 mask of the frames to transform, from face_frames when None.
+
+        Returns:
+        tf.Tensor: The augmented landmarks.
+        """
+        config = self.config
+        seeds = tf.unstack(tf.random.experimental.stateless_split(seed, 6))
+        if face is None:
+            face = self.face_frames(landmarks)
+        original = landmarks
+        if self.parameters is not None:
+            landmarks = landmarks / self.parameters['landmark_scale'] + self.parameters['landmark_offset']
+        batch_size = tf.shape(landmarks)[0]
+        xy, z = landmarks[..., :2], landmarks[..., 2:]
+        # The centre leaves out padding and frames without a face
+        weights = tf.broadcast_to(face[:, :, None, None], tf.shape(xy[..., :1]))
+        centre = tf.reduce_sum(xy * weights, axis=[1, 2], keepdims=True) / tf.maximum(
+            tf.reduce_sum(weights, axis=[1, 2], keepdims=True), 1.0)
+
+        if self.mirror_indices is not None and config['mirror_probability'] > 0:
+            flip = tf.random.stateless_uniform([batch_size], seeds[0]) < config['mirror_probability']
+            mirrored_xy = tf.gather(tf.concat([2 * centre[..., :1] - xy[..., :1], xy[..., 1:]], axis=-1),
+                                    self.mirror_indices, axis=2)
+            flip = flip[:, None, None, None]
+            xy = tf.where(flip, mirrored_xy, xy)
+            z = tf.where(flip, tf.gather(z, self.mirror_indices, axis=2), z)
+
+        low, high = config['scale_range']
+        scale = tf.random.stateless_uniform([batch_size, 1, 1, 1], seeds[1], low, high)
+        angle = tf.random.stateless_uniform([batch_size], seeds[2], -1.0, 1.0) * np.deg2rad(config['rotation_degrees'])
+        cos, sin = tf.cos(angle), tf.sin(angle)
+        rotation = tf.reshape(tf.stack([cos, -sin, sin, cos], axis=-1), [-1, 2, 2])
+        shift = tf.random.stateless_uniform([batch_size, 1, 1, 2], seeds[3], -1.0, 1.0) * config['translation']
+        xy = tf.einsum('btnj,bij->btni', xy - centre, rotation) * scale + centre + shift
+        z = z * scale
+
+        landmarks = tf.concat([xy, z], axis=-1)
+        if config['jitter_std'] > 0:
+            landmarks += tf.random.stateless_normal(tf.shape(landmarks), seeds[4], stddev=config['jitter_std'])
+        if self.parameters is not None:
+            landmarks = (landmarks - self.parameters['landmark_offset']) * self.parameters['landmark_scale']
+        return tf.where(face[:, :, None, None] > 0, landmarks, original)
+
+    def mask_mels(self, mels, seed):
+        """
+        Mask whole frames and frequency bands of each sample's mel spectrograms.
+
+        Parameters:
+        mels (tf.Tensor): (batch, frames, num_mels, mel_length, 1) mel segments.
+        seed (tf.Tensor): The stateless seed, shape [2].
+
+        Returns:
+        tf.Tensor: The masked mel segments.
+        """
+        config = self.config
+        time_seed, frequency_seed = tf.unstack(tf.random.experimental.stateless_split(seed, 2))
+        shape = tf.shape(mels)
+        if config['time_masks'] > 0:
+            mask = band_mask(time_seed, shape[0], shape[1], config['time_masks'], config['time_mask_frames'])
+            mels = mels * mask[:, :, None, None, None]
+        if config['frequency_masks'] > 0:
+            mask = band_mask(frequency_seed, shape[0], shape[2], config['frequency_masks'], config['frequency_mask_bins'])
+            mels = mels * mask[:, None, :, None, None]
+        return mels
+
+    def drop_frames(self, landmarks, mels, seed):
+        """
+        Set random frames' landmarks and mel segments to the padding value.
+
+        Parameters:
+        landmarks (tf.Tensor): (batch, frames, num_landmarks, 3) landmarks.
+        mels (tf.Tensor): (batch, frames, num_mels, mel_length, 1) mel segments.
+        seed (tf.Tensor): The stateless seed, shape [2].
+
+        Returns:
+        tuple: The landmarks and mel segments.
+        """
+        if self.config['frame_dropout'] <= 0:
+            return landmarks, mels
+        shape = tf.shape(landmarks)
+        keep = tf.cast(tf.random.stateless_uniform(shape[:2], seed) >= self.config['frame_dropout'], tf.float32)
+        return landmarks * keep[:, :, None, None], mels * keep[:, :, None, None, None]
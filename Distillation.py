@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 00:07:26 2026
+
+Knowledge distillation of the emotion classifier into a smaller student for CPU serving.
+The student, by default a unidirectional GRU behind narrower landmark, Conv1D mel and
+phoneme branches, is built with create_emotion_classifier and trained on the dataset
+pipeline of Interface_Model against both the labels and the teacher's predictions,
+softened by a temperature.
+
+The teacher's log probabilities are computed once per teacher, dataset and split and
+cached as a .npz file, so further students or temperatures do not run the teacher
+again. The report puts the teacher and the student side by side: held-out accuracy,
+how often they agree, parameters, FLOPs, weight size and inference latency.
+
+The held-out split is only unseen by the teacher when --seed is the seed the teacher
+was trained with.
+
+Example:
+    python Distillation.py --hdf5 training_data/merged_data_file.hdf5 --teacher checkpoints/ --seed 0 \
+        --output student.keras --epochs 30 --temperature 4 --alpha 0.3 --report distillation.json
+
+@author: Jayyy
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from Normalization_Stats import affine_parameters, apply_normalization, load_model_stats, save_model_stats
+
+# create_emotion_classifier arguments of the default student
+DEFAULT_STUDENT = {
+    'landmark_units': [64],
+    'mel_branch': 'conv1d',
+    'mel_filters': [16, 32],
+    'mel_dense_units': 64,
+    'phoneme_embedding_dim': 16,
+    'phoneme_units': 32,
+    'rnn_type': 'gru',
+    'rnn_units': [64],
+    'bidirectional': False,
+}
+
+
+def load_student_config(path=None):
+    """
+    Load the student architecture.
+
+    Parameters:
+    path (str): Optional JSON file of create_emotion_classifier arguments.
+
+    Returns:
+    dict: The create_emotion_classifier arguments.
+    """
+    if not path:
+        return dict(DEFAULT_STUDENT)
+    with open(path, 'r') as json_file:
+        config = json.load(json_file)
+    if 'sequence_length' in config:
+        raise ValueError("load_student_config - the student reads the teacher's inputs, its sequence_length cannot change")
+    return config
+
+def predict_log_probs(model, hdf5_path, metadata, stats=None, batch_size=32):
+    """
+    Run a model over samples in order, preprocessed as for training.
+
+    Parameters:
+    model (tf.keras.Model): The classifier.
+    hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+    metadata (list): The (video_name, emotion) samples.
+    stats (dict): The normalisation statistics the model was trained with, None for per-frame normalisation.
+    batch_size (int): The samples per forward pass.
+
+    Returns:
+    tuple: The (samples, num_emotions) float32 log probabilities and the zero-based labels.
+    """
+    from Interface_Model import HDF5Dataset, model_inputs
+
+    dataset = HDF5Dataset(hdf5_path, stats, sequence_lengths=True)
+    parameters = affine_parameters(stats) if stats is not None else None
+    log_probs = []
+    labels = []
+    try:
+        for start in range(0, len(metadata), batch_size):
+            samples = [dataset(video_name, emotion) for video_name, emotion in metadata[start:start + batch_size]]
+            landmarks, mels, phonemes, lengths = (np.stack([inputs[i] for inputs, _ in samples]) for i in range(4))
+            if parameters is not None:
+                landmarks, mels = apply_normalization(landmarks, mels, parameters)
+            probabilities = model(model_inputs(model, landmarks.astype(np.float32), mels.astype(np.float32),
+                                               phonemes.astype(np.int32), lengths), training=False)
+            log_probs.append(np.log(np.clip(np.asarray(probabilities), 1e-7, 1.0)))
+            labels.extend(label for _, label in samples)
+    finally:
+        dataset.close()
+    return np.concatenate(log_probs).astype(np.float32), np.asarray(labels, dtype=np.int32)
+
+def teacher_log_probs(teacher, teacher_path, hdf5_path, metadata, stats, cache_dir, batch_size=32):
+    """
+    Return the teacher's log probabilities of the samples, computed once and cached.
+
+    The cache key covers the teacher's weights, the dataset file, the samples in order
+    and the normalisation, so any change to them computes the predictions again.
+
+    Parameters:
+    teacher (callable): Returns the teacher model; only called when the cache misses.
+    teacher_path (str): The teacher's model file or checkpoint directory.
+    hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+    metadata (list): The (video_name, emotion) samples.
+    stats (dict): The teacher's normalisation statistics.
+    cache_dir (str): The directory of the cached predictions.
+    batch_size (int): The samples per forward pass.
+
+    Returns:
+    np.ndarray: The (samples, num_emotions) log probabilities, in the order of metadata.
+    """
+    from Prediction_Cache import hash_config, hash_model
+
+    status = os.stat(hdf5_path)
+    key = hash_config({
+        'teacher': hash_model(teacher_path),
+        'dataset': [os.path.abspath(hdf5_path), status.st_size, status.st_mtime_ns],
+        'samples': [[video_name, int(emotion)] for video_name, emotion in metadata],
+        'normalization': stats is not None,
+    })
+    path = os.path.join(cache_dir, f"teacher_{key[:16]}.npz")
+    if os.path.exists(path):
+        print(f"Teacher predictions read from {path}")
+        return np.load(path)['log_probs']
+
+    start_time = time.perf_counter()
+    log_probs, _ = predict_log_probs(teacher(), hdf5_path, metadata, stats, batch_size)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(path, log_probs=log_probs, key=key)
+    print(f"Teacher predictions of {len(metadata)} samples computed in {time.perf_counter() - start_time:.1f} s "
+          f"and cached in {path}")
+    return log_probs
+
+def distillation_loss(temperature=4.0, alpha=0.3):
+    """
+    Build the distillation loss of a classifier with a softmax output.
+
+    The labels are the one-hot label followed by the teacher's log probabilities, as
+    create_tf_dataset gives them with soft_targets. The loss is alpha times the cross
+    entropy with the labels plus (1 - alpha) times the KL divergence of the student's
+    temperature-softened distribution from the teacher's, scaled by the temperature
+    squared so its gradients keep their size as the temperature changes.
+
+    Parameters:
+    temperature (float): The softening temperature.
+    alpha (float): The weight of the labels against the teacher.
+
+    Returns:
+    callable: The Keras loss.
+    """
+    import tensorflow as tf
+    from Interface_Model import num_emotions
+
+    def loss(y_true, y_pred):
+        labels, teacher = y_true[:, :num_emotions], y_true[:, num_emotions:]
+        hard_loss = tf.keras.losses.categorical_crossentropy(labels, y_pred)
+        student = tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0))
+        soft_teacher = tf.nn.softmax(teacher / temperature)
+        soft_loss = tf.reduce_sum(soft_teacher * (tf.nn.log_softmax(teacher / temperature)
+                                                  - tf.nn.log_softmax(student / temperature)), axis=-1)
+        return alpha * hard_loss + (1.0 - alpha) * temperature ** 2 * soft_loss
+
+    return loss
+
+def label_accuracy(y_true, y_pred):
+    """
+    Accuracy against the one-hot labels at the start of the distillation targets.
+    """
+    import tensorflow as tf
+    from Interface_Model import num_emotions
+
+    return tf.keras.metrics.categorical_accuracy(y_true[:, :num_emotions], y_pred)
+
+def model_summary(model, accuracy, agreement, latency_batch_sizes, latency_repeats):
+    """
+    Describe a model for the report.
+
+    Parameters:
+    model (tf.keras.Model): The model.
+    accuracy (float): Its held-out accuracy.
+    agreement (float): How often it predicts the teacher's class.
+    latency_batch_sizes (list): The batch sizes to time inference at.
+    latency_repeats (int): The timed calls per batch size.
+
+    Returns:
+    dict: The accuracy, agreement, parameters, FLOPs, weight size and latency per batch size.
+    """
+    from Model_Benchmark import count_flops, time_inference
+
+    return {
+        'accuracy': accuracy,
+        'agreement_with_teacher': agreement,
+        'params': int(model.count_params()),
+        'weights_mb': sum(weight.numpy().nbytes for weight in model.weights) / 2**20,
+        'flops_per_sample': count_flops(model),
+        'latency': time_inference(model, latency_batch_sizes, latency_repeats, warmup=3),
+    }
+
+def distill(hdf5_path, teacher_path, student_config=None, output_path='student.keras', cache_dir='distillation_cache',
+            epochs=30, batch_size=8, temperature=4.0, alpha=0.3, learning_rate=None, seed=0,
+            latency_batch_sizes=(1, 8), latency_repeats=20):
+    """
+    Train a student against a trained teacher and compare the two.
+
+    Parameters:
+    hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+    teacher_path (str): The teacher's model file or checkpoint directory, see Interface_Model.load_trained_model.
+    student_config (dict): The student's create_emotion_classifier arguments, DEFAULT_STUDENT when None.
+    output_path (str): The Keras model file the student is saved to.
+    cache_dir (str): The directory of the cached teacher predictions.
+    epochs (int): The student's training epochs.
+    batch_size (int): The training batch size.
+    temperature (float): The softening temperature, see distillation_loss.
+    alpha (float): The weight of the labels against the teacher.
+    learning_rate (float): The student's Adam learning rate, Keras' default when None.
+    seed (int): The seed of the train/test split, the teacher's to hold out unseen samples.
+    latency_batch_sizes (tuple): The batch sizes to time inference at.
+    latency_repeats (int): The timed calls per batch size.
+
+    Returns:
+    dict: The settings, the teacher's and the student's summaries and the differences between them.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+    from Interface_Model import create_tf_dataset, dataset_metadata, load_trained_model, split_metadata
+
+    student_config = dict(DEFAULT_STUDENT if student_config is None else student_config)
+    tf.keras.utils.set_random_seed(seed)
+
+    # The student learns from the teacher's inputs, so it is normalised as the teacher was
+    stats = load_model_stats(teacher_path)
+    train_metadata, test_metadata = split_metadata(dataset_metadata(hdf5_path), seed=seed)
+    teacher_model = None
+
+    def teacher():
+        nonlocal teacher_model
+        if teacher_model is None:
+            teacher_model = load_trained_model(teacher_path)
+        return teacher_model
+
+    train_targets = teacher_log_probs(teacher, teacher_path, hdf5_path, train_metadata, stats, cache_dir)
+    test_targets = teacher_log_probs(teacher, teacher_path, hdf5_path, test_metadata, stats, cache_dir)
+
+    student = create_emotion_classifier(**student_config, learning_rate=learning_rate)
+    student.compile(optimizer=student.optimizer, loss=distillation_loss(temperature, alpha), metrics=[label_accuracy])
+
+    train_dataset = create_tf_dataset(train_metadata, batch_size, hdf5_path, stats, soft_targets=train_targets)
+    test_dataset = create_tf_dataset(test_metadata, batch_size, hdf5_path, stats, soft_targets=test_targets)
+    start_time = time.perf_counter()
+    student.fit(train_dataset, epochs=epochs, steps_per_epoch=max(len(train_metadata) // batch_size, 1),
+                validation_data=test_dataset, validation_steps=max(len(test_metadata) // batch_size, 1), verbose=2)
+    train_seconds = time.perf_counter() - start_time
+
+    # Saved as a plain classifier, so it loads without the distillation loss
+    student.compile(optimizer=student.optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
+    student.save(output_path)
+    if stats is not None:
+        save_model_stats(output_path, stats)
+
+    student_log_probs, labels = predict_log_probs(student, hdf5_path, test_metadata, stats)
+    teacher_predictions = test_targets.argmax(axis=1)
+    student_predictions = student_log_probs.argmax(axis=1)
+    teacher_summary = model_summary(teacher(), float(np.mean(teacher_predictions == labels)), 1.0,
+                                    latency_batch_sizes, latency_repeats)
+    student_summary = model_summary(student, float(np.mean(student_predictions == labels)),
+                                    float(np.mean(student_predictions == teacher_predictions)),
+                                    latency_batch_sizes, latency_repeats)
+    student_summary['train_seconds'] = train_seconds
+
+    return {
+        'settings': {'hdf5': hdf5_path, 'teacher': teacher_path, 'student_config': student_config, 'output': output_path,
+                     'epochs': epochs, 'batch_size': batch_size, 'temperature': temperature, 'alpha': alpha,
+                     'learning_rate': learning_rate, 'seed': seed, 'train_samples': len(train_metadata),
+                     'test_samples': len(test_metadata)},
+        'teacher': teacher_summary,
+        'student': student_summary,
+        'accuracy_gap': teacher_summary['accuracy'] - student_summary['accuracy'],
+        'params_reduction': teacher_summary['params'] / student_summary['params'],
+        'flops_reduction': teacher_summary['flops_per_sample'] / max(student_summary['flops_per_sample'], 1),
+        'latency_speedup': {batch: teacher_summary['latency'][batch]['p50_ms'] / student_summary['latency'][batch]['p50_ms']
+                            for batch in student_summary['latency']},
+    }
+
+def print_report(report):
+    """
+    Print the teacher and the student side by side.
+
+    Parameters:
+    report (dict): The report from distill.
+    """
+    teacher, student = report['teacher'], report['student']
+    rows = [('held-out accuracy', 'accuracy', '{:.3f}'), ('agreement with teacher', 'agreement_with_teacher', '{:.3f}'),
+            ('parameters', 'params', '{:,}'), ('weights (MB)', 'weights_mb', '{:.2f}'),
+            ('FLOPs per sample', 'flops_per_sample', '{:,}')]
+    print(f"{'':>24} {'teacher':>14} {'student':>14}")
+    for label, key, style in rows:
+        print(f"{label:>24} {style.format(teacher[key]):>14} {style.format(student[key]):>14}")
+    for batch in student['latency']:
+        print(f"{'p50 latency, batch ' + batch + ' (ms)':>24} {teacher['latency'][batch]['p50_ms']:>14.2f} "
+              f"{student['latency'][batch]['p50_ms']:>14.2f}")
+    speedups = ", ".join(f"{speedup:.1f}x at batch {batch}" for batch, speedup in report['latency_speedup'].items())
+    print(f"Accuracy gap {report['accuracy_gap']:+.3f}, {report['params_reduction']:.1f}x fewer parameters, "
+          f"{report['flops_reduction']:.1f}x fewer FLOPs, {speedups} faster")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil the emotion classifier into a smaller student.")
+    parser.add_argument('--hdf5', required=True, help="The merged HDF5 dataset.")
+    parser.add_argument('--teacher', required=True, help="The teacher's saved Keras model or checkpoint directory.")
+    parser.add_argument('--student', help="JSON file of the student's create_emotion_classifier arguments.")
+    parser.add_argument('--output', default='student.keras', help="The Keras model file the student is saved to.")
+    parser.add_argument('--cache-dir', default='distillation_cache', help="The directory of the cached teacher predictions.")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--temperature', type=float, default=4.0, help="The temperature softening both distributions.")
+    parser.add_argument('--alpha', type=float, default=0.3, help="The weight of the labels against the teacher's predictions.")
+    parser.add_argument('--learning-rate', type=float)
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the train/test split; the teacher's, to hold out unseen samples.")
+    parser.add_argument('--latency-batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--latency-repeats', type=int, default=20)
+    parser.add_argument('--report', help="Write the comparison to this JSON file.")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    report = distill(args.hdf5, args.teacher, load_student_config(args.student), args.output, args.cache_dir,
+                     epochs=args.epochs, batch_size=args.batch_size, temperature=args.temperature, alpha=args.alpha,
+                     learning_rate=args.learning_rate, seed=args.seed, latency_batch_sizes=args.latency_batch_sizes,
+                     latency_repeats=args.latency_repeats)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Report written to {args.report}")
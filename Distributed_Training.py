@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:05:17 2026
+
+Helpers for opt-in multi-worker CPU data-parallel training with
+tf.distribute.MultiWorkerMirroredStrategy. The cluster is described by the standard
+TF_CONFIG environment variable, e.g. for the second of two workers:
+
+    TF_CONFIG='{"cluster": {"worker": ["host1:12345", "host2:12345"]},
+                "task": {"type": "worker", "index": 1}}'
+
+Only the chief writes checkpoints, and every worker resumes from them, so on several
+hosts the checkpoint directory has to be on storage they all share.
+
+@author: Jayyy
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import tensorflow as tf
+
+
+def read_tf_config():
+    """
+    Read the cluster configuration from the TF_CONFIG environment variable.
+
+    Returns:
+    dict: The parsed TF_CONFIG, or an empty dict when it is not set.
+    """
+    tf_config = os.environ.get('TF_CONFIG')
+    if not tf_config:
+        return {}
+    return json.loads(tf_config)
+
+def get_worker_info(tf_config=None):
+    """
+    Describe the current worker within the cluster.
+
+    The chief is the task of type 'chief', or worker 0 when the cluster has no chief.
+
+    Parameters:
+    tf_config (dict): The cluster configuration, read from TF_CONFIG when None.
+
+    Returns:
+    dict: The task type, task index, number of workers and whether this task is the chief.
+    """
+    if tf_config is None:
+        tf_config = read_tf_config()
+
+    cluster = tf_config.get('cluster', {})
+    task = tf_config.get('task', {})
+    task_type = task.get('type', 'worker')
+    task_index = int(task.get('index', 0))
+    num_workers = len(cluster.get('chief', [])) + len(cluster.get('worker', []))
+
+    if 'chief' in cluster:
+        is_chief = task_type == 'chief'
+        # The chief takes part in training, so it is counted as input pipeline 0
+        worker_index = 0 if is_chief else task_index + 1
+    else:
+        is_chief = task_type == 'worker' and task_index == 0
+        worker_index = task_index
+
+    return {
+        'task_type': task_type,
+        'task_index': task_index,
+        'worker_index': worker_index,
+        'num_workers': max(num_workers, 1),
+        'is_chief': is_chief,
+    }
+
+def create_strategy(distributed):
+    """
+    Create the distribution strategy for training.
+
+    MultiWorkerMirroredStrategy must be created before any other TensorFlow op runs.
+    Keras 3's fit cannot symbolically build a model from multi-worker batches, so
+    multi-worker runs use tf.keras 2 through the tf_keras package.
+
+    Parameters:
+    distributed (bool): Whether to train with MultiWorkerMirroredStrategy.
+
+    Returns:
+    tf.distribute.Strategy: The multi-worker strategy, or the default strategy.
+    """
+    if not distributed:
+        return tf.distribute.get_strategy()
+
+    if getattr(tf.keras, '__version__', '2').startswith('3.') and get_worker_info()['num_workers'] > 1:
+        raise RuntimeError("create_strategy - multi-worker training needs tf.keras 2: "
+                           "install tf_keras and set TF_USE_LEGACY_KERAS=1 before starting the workers")
+
+    # Ring all-reduce is the CPU collective implementation
+    communication_options = tf.distribute.experimental.CommunicationOptions(
+        implementation=tf.distribute.experimental.CommunicationImplementation.RING
+    )
+    return tf.distribute.MultiWorkerMirroredStrategy(communication_options=communication_options)
+
+def shard_metadata(metadata, worker_info):
+    """
+    Select this worker's share of the metadata.
+
+    The generator-based dataset cannot be auto-sharded by file, so every worker keeps
+    an interleaved slice of the (identically ordered) metadata instead.
+
+    Parameters:
+    metadata (list): The (video_name, emotion) metadata, in the same order on every worker.
+    worker_info (dict): The worker description from get_worker_info.
+
+    Returns:
+    list: The metadata for this worker.
+    """
+    return metadata[worker_info['worker_index']::worker_info['num_workers']]
+
+def disable_auto_shard(dataset):
+    """
+    Turn off tf.data auto-sharding for a dataset that has already been sharded by metadata.
+
+    Parameters:
+    dataset (tf.data.Dataset): The dataset.
+
+    Returns:
+    tf.data.Dataset: The dataset with auto-sharding disabled.
+    """
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options)
+
+def check_same_epoch(strategy, epoch):
+    """
+    Check that every worker resumes from the same epoch.
+
+    Each worker restores the latest checkpoint it can see. A worker without access to the
+    chief's checkpoint directory would start from another epoch, run a different number
+    of steps and leave the others waiting in the collectives, so every worker raises instead.
+
+    Parameters:
+    strategy (tf.distribute.Strategy): The training strategy.
+    epoch (int): The epoch this worker resumes from.
+    """
+    if strategy.num_replicas_in_sync == 1:
+        return
+    # Only SUM and MEAN reductions exist: the epochs are all equal when n * sum(e^2) == sum(e)^2
+    sums = strategy.run(lambda: tf.constant([1, epoch, epoch * epoch], dtype=tf.int64))
+    count, total, total_squares = (int(value) for value in strategy.reduce(tf.distribute.ReduceOp.SUM, sums, axis=None))
+    if count * total_squares != total * total:
+        raise RuntimeError(f"check_same_epoch - this worker resumes from epoch {epoch}, others from another: "
+                           "the checkpoint directory has to be on storage shared by every worker")
+
+def worker_directory(directory, worker_info):
+    """
+    Return the directory a worker should write to.
+
+    Every worker has to take part in saving, but only the chief's output is kept;
+    the other workers write to a temporary directory that is removed afterwards.
+
+    Parameters:
+    directory (str): The chief's output directory.
+    worker_info (dict): The worker description from get_worker_info.
+
+    Returns:
+    str: The directory to write to.
+    """
+    if worker_info['is_chief']:
+        return directory
+    return tempfile.mkdtemp(prefix=f"worker_{worker_info['worker_index']}_")
+
+class ChiefCheckpoint(tf.keras.callbacks.Callback):
+    """
+    A callback saving a training checkpoint at the end of every epoch, kept on the chief only.
+    
+    Every worker has to take part in saving, so the other workers save to a temporary
+    directory that is emptied straight after each save.
+    """
+    def __init__(self, checkpoint_dir, worker_info, max_to_keep=3):
+        """
+        Initialize a ChiefCheckpoint instance.
+
+        Parameters:
+        checkpoint_dir (str): The directory the chief saves checkpoints to.
+        worker_info (dict): The worker description from get_worker_info.
+        max_to_keep (int): The number of checkpoints to keep.
+        """
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.worker_info = worker_info
+        self.max_to_keep = max_to_keep
+        self.manager = None
+
+    def _get_manager(self):
+        # Created once and reused: a new tf.train.Checkpoint creates variables, which
+        # under MultiWorkerMirroredStrategy must happen on every worker at the same time
+        if self.manager is None:
+            checkpoint = tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer)
+            directory = worker_directory(self.checkpoint_dir, self.worker_info)
+            self.manager = tf.train.CheckpointManager(checkpoint, directory, max_to_keep=self.max_to_keep)
+        return self.manager
+
+    def restore(self, strategy=None):
+        """
+        Restore the latest checkpoint of the chief, if any.
+
+        Every worker reads the chief's checkpoint directory, which therefore has to be
+        shared between hosts; with a strategy, the workers check they resume from the same epoch.
+
+        Parameters:
+        strategy (tf.distribute.Strategy): The training strategy, see check_same_epoch.
+
+        Returns:
+        int: The number of epochs completed by the restored checkpoint, 0 when there is none.
+        """
+        latest = tf.train.latest_checkpoint(self.checkpoint_dir)
+        # Checkpoints are numbered by epoch, e.g. ckpt-12
+        epoch = int(latest.rsplit('-', 1)[-1]) if latest else 0
+        if strategy is not None:
+            check_same_epoch(strategy, epoch)
+        if latest:
+            tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer).restore(latest)
+            print(f"Restored checkpoint {latest}")
+        return epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        manager = self._get_manager()
+        path = manager.save(checkpoint_number=epoch + 1)
+        if self.worker_info['is_chief']:
+            print(f"Saved checkpoint {path}")
+        else:
+            shutil.rmtree(manager.directory, ignore_errors=True)
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """
+    A callback measuring the training throughput of this worker in samples per second.
+    """
+    def __init__(self, per_worker_batch_size, worker_info, report_path=None):
+        """
+        Initialize a ThroughputCallback instance.
+
+        Parameters:
+        per_worker_batch_size (int): The number of samples each worker processes per step.
+        worker_info (dict): The worker description from get_worker_info.
+        report_path (str): Optional path of a JSON file the measurements are written to.
+        """
+        super().__init__()
+        self.per_worker_batch_size = per_worker_batch_size
+        self.worker_info = worker_info
+        self.report_path = report_path
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+        self.epoch_start_time = time.perf_counter()
+        self.last_batch_end_time = self.epoch_start_time
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        self.last_batch_end_time = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        # Validation runs before on_epoch_end, so only time up to the last training step
+        elapsed = self.last_batch_end_time - self.epoch_start_time
+        samples = self.steps * self.per_worker_batch_size
+        samples_per_sec = samples / elapsed if elapsed > 0 else 0.0
+        self.epochs.append({'steps': self.steps, 'samples': samples, 'seconds': elapsed, 'samples_per_sec': samples_per_sec})
+        print(f"Worker {self.worker_info['worker_index']}: {samples_per_sec:.2f} samples/s")
+        self.write_report()
+
+    def summary(self, skip_first=True):
+        """
+        Summarise the measured epochs.
+
+        Parameters:
+        skip_first (bool): Whether to leave out the first epoch, which includes tracing and warmup.
+
+        Returns:
+        dict: The worker description, the per-epoch measurements and the mean samples per second.
+        """
+        measured = self.epochs[1:] if skip_first and len(self.epochs) > 1 else self.epochs
+        total_samples = sum(epoch['samples'] for epoch in measured)
+        total_seconds = sum(epoch['seconds'] for epoch in measured)
+        return {
+            'worker': self.worker_info,
+            'per_worker_batch_size': self.per_worker_batch_size,
+            'epochs': self.epochs,
+            'samples_per_sec': total_samples / total_seconds if total_seconds > 0 else 0.0,
+        }
+
+    def write_report(self):
+        """
+        Write the throughput summary to the report path, if one was given.
+        """
+        if not self.report_path:
+            return
+        report_dir = os.path.dirname(self.report_path)
+        if report_dir:
+            os.makedirs(report_dir, exist_ok=True)
+        with open(self.report_path, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=2)
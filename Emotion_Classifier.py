@@ -6,7 +6,10 @@ This script defines a Bi-LSTM model for emotion classification based on landmark
 
 @author: Jayyy
 """
-from tensorflow.keras import layers, models, Input
+import numpy as np
+import keras
+import tensorflow as tf
+from tensorflow.keras import layers, models, optimizers, Input
 
 
 
@@ -18,49 +21,208 @@ mel_length = 64
 num_phonemes = 91  # Number of unique phonemes
 num_emotions = 8  # Number of emotion classes
 
-def create_emotion_classifier():
+@keras.saving.register_keras_serializable(package='Emotion_Classifier')
+class SequenceMask(layers.Layer):
+    """
+    The mask of the frames within each sample's length, for sequences of any length.
+    """
+    def call(self, lengths, frames):
+        """
+        Parameters:
+        lengths (tf.Tensor): (batch,) number of frames of each sample.
+        frames (tf.Tensor): A (batch, frames, ...) tensor giving the padded length.
+
+        Returns:
+        tf.Tensor: The (batch, frames) boolean mask.
+        """
+        return tf.sequence_mask(lengths, tf.shape(frames)[1])
+
+def _recurrent_layer(rnn_type, units, return_sequences, bidirectional):
+    """
+    Build a single recurrent layer, optionally wrapped as bidirectional.
+    
+    Parameters:
+    rnn_type (str): Either 'lstm' or 'gru'.
+    units (int): The number of recurrent units.
+    return_sequences (bool): Whether the layer returns the full sequence.
+    bidirectional (bool): Whether to wrap the layer in a Bidirectional wrapper.
+    
+    Returns:
+    tf.keras.layers.Layer: The recurrent layer.
+    """
+    if rnn_type == 'lstm':
+        layer = layers.LSTM(units, return_sequences=return_sequences)
+    elif rnn_type == 'gru':
+        layer = layers.GRU(units, return_sequences=return_sequences)
+    else:
+        raise ValueError(f"Unknown rnn_type: {rnn_type}")
+    
+    if bidirectional:
+        layer = layers.Bidirectional(layer)
+    return layer
+
+def _mel_branch(mel_input, mel_branch, mel_filters, mel_dense_units, sequence_length=sequence_length):
+    """
+    Build the per-frame mel spectrogram branch.
+    
+    Parameters:
+    mel_input (tf.Tensor): The mel input of shape (sequence_length, num_mels, mel_length, 1).
+    mel_branch (str): 'conv2d' (the original per-frame 2D CNN), 'conv1d' (mel bins as channels,
+                      convolved over time) or 'dense' (time-averaged mel bins into a dense layer).
+    mel_filters (tuple): The number of filters of each convolution layer.
+    mel_dense_units (int): The width of the dense layer closing the branch.
+    sequence_length (int): The number of frames in each sequence.
+    
+    Returns:
+    tf.Tensor: The per-frame mel features.
+    """
+    if mel_branch == 'conv2d':
+        x_mel = mel_input
+        for filters in mel_filters:
+            x_mel = layers.TimeDistributed(layers.Conv2D(filters, (3, 3), activation='relu'))(x_mel)
+            x_mel = layers.TimeDistributed(layers.MaxPooling2D((2, 2)))(x_mel)
+        x_mel = layers.TimeDistributed(layers.Flatten())(x_mel)
+    elif mel_branch == 'conv1d':
+        x_mel = layers.Reshape((sequence_length, num_mels, mel_length))(mel_input)
+        x_mel = layers.TimeDistributed(layers.Permute((2, 1)))(x_mel)
+        for filters in mel_filters:
+            x_mel = layers.TimeDistributed(layers.Conv1D(filters, 3, activation='relu'))(x_mel)
+            x_mel = layers.TimeDistributed(layers.MaxPooling1D(2))(x_mel)
+        x_mel = layers.TimeDistributed(layers.GlobalAveragePooling1D())(x_mel)
+    elif mel_branch == 'dense':
+        x_mel = layers.Reshape((sequence_length, num_mels, mel_length))(mel_input)
+        x_mel = layers.TimeDistributed(layers.GlobalAveragePooling1D(data_format='channels_first'))(x_mel)
+    else:
+        raise ValueError(f"Unknown mel_branch: {mel_branch}")
+    
+    x_mel = layers.TimeDistributed(layers.Dense(mel_dense_units, activation='relu'))(x_mel)
+    return x_mel
+
+def _variable_mel_branch(mel_input, mel_branch, mel_filters, mel_dense_units):
+    """
+    Build the mel spectrogram branch of _mel_branch for sequences of any length.
+    
+    TimeDistributed mishandles an unknown number of frames, so the per-frame layers
+    work on the frame axis directly instead: a Conv3D with a kernel one frame long is
+    the per-frame Conv2D, a Conv2D one frame high the per-frame Conv1D.
+    
+    Parameters:
+    mel_input (tf.Tensor): The mel input of shape (None, num_mels, mel_length, 1).
+    mel_branch (str): The mel branch variant, see _mel_branch.
+    mel_filters (tuple): The number of filters of each convolution layer.
+    mel_dense_units (int): The width of the dense layer closing the branch.
+    
+    Returns:
+    tf.Tensor: The per-frame mel features.
+    """
+    if mel_branch == 'conv2d':
+        x_mel = mel_input
+        for filters in mel_filters:
+            x_mel = layers.Conv3D(filters, (1, 3, 3), activation='relu')(x_mel)
+            x_mel = layers.MaxPooling3D((1, 2, 2))(x_mel)
+        x_mel = layers.Reshape((-1, int(np.prod(x_mel.shape[2:]))))(x_mel)
+    elif mel_branch in ('conv1d', 'dense'):
+        # (frames, mel_length, num_mels): the mel bins are the channels
+        x_mel = layers.Reshape((-1, num_mels, mel_length))(mel_input)
+        x_mel = layers.Permute((1, 3, 2))(x_mel)
+        if mel_branch == 'conv1d':
+            for filters in mel_filters:
+                x_mel = layers.Conv2D(filters, (1, 3), activation='relu')(x_mel)
+                x_mel = layers.MaxPooling2D((1, 2))(x_mel)
+        x_mel = layers.AveragePooling2D((1, x_mel.shape[2]))(x_mel)
+        x_mel = layers.Reshape((-1, x_mel.shape[-1]))(x_mel)
+    else:
+        raise ValueError(f"Unknown mel_branch: {mel_branch}")
+    
+    x_mel = layers.Dense(mel_dense_units, activation='relu')(x_mel)
+    return x_mel
+
+def create_emotion_classifier(landmark_units=(128, 64), mel_branch='conv2d', mel_filters=(32, 64),
+                              mel_dense_units=128, phoneme_embedding_dim=64, phoneme_units=64,
+                              rnn_type='lstm', rnn_units=(128, 128), bidirectional=True,
+                              sequence_length=sequence_length, learning_rate=None):
     """
     Create a Bi-LSTM model for emotion classification.
     
+    The defaults build the original architecture; the parameters allow variants to be
+    built for benchmarking and experimentation.
+    
+    With sequence_length None the model takes sequences of any length and a fourth input,
+    'lengths', the number of frames of each sample; the recurrent layers skip the frames
+    of a batch past each sample's length.
+    
+    Parameters:
+    landmark_units (tuple): The widths of the per-frame dense layers of the landmarks branch.
+    mel_branch (str): The mel branch variant, one of 'conv2d', 'conv1d' or 'dense'.
+    mel_filters (tuple): The number of filters of each mel convolution layer.
+    mel_dense_units (int): The width of the dense layer closing the mel branch.
+    phoneme_embedding_dim (int): The size of the phoneme embedding.
+    phoneme_units (int): The width of the per-frame dense layer of the phonemes branch.
+    rnn_type (str): The recurrent layer type, 'lstm' or 'gru'.
+    rnn_units (tuple): The number of units of each stacked recurrent layer.
+    bidirectional (bool): Whether the recurrent layers are bidirectional.
+    sequence_length (int): The number of frames in each sequence, None for variable-length sequences.
+    learning_rate (float): The Adam learning rate, Keras' default when None.
+    
     Returns:
     model (tf.keras.Model): The compiled Keras model.
     """
+    variable_length = sequence_length is None
+
     # Landmarks branch
     landmark_input = Input(shape=(sequence_length, num_landmarks, 3), name='landmarks')
-    x_landmark = layers.TimeDistributed(layers.Flatten())(landmark_input)
-    x_landmark = layers.TimeDistributed(layers.Dense(128, activation='relu'))(x_landmark)
-    x_landmark = layers.TimeDistributed(layers.Dense(64, activation='relu'))(x_landmark)
+    if variable_length:
+        # Dense layers act on the last axis, frame by frame
+        x_landmark = layers.Reshape((-1, num_landmarks * 3))(landmark_input)
+        for units in landmark_units:
+            x_landmark = layers.Dense(units, activation='relu')(x_landmark)
+    else:
+        x_landmark = layers.TimeDistributed(layers.Flatten())(landmark_input)
+        for units in landmark_units:
+            x_landmark = layers.TimeDistributed(layers.Dense(units, activation='relu'))(x_landmark)
 
     # Mel spectrograms branch
     mel_input = Input(shape=(sequence_length, num_mels, mel_length, 1), name='mel_spectrogram')  # Add a channel dimension
-    x_mel = layers.TimeDistributed(layers.Conv2D(32, (3, 3), activation='relu'))(mel_input)
-    x_mel = layers.TimeDistributed(layers.MaxPooling2D((2, 2)))(x_mel)
-    x_mel = layers.TimeDistributed(layers.Conv2D(64, (3, 3), activation='relu'))(x_mel)
-    x_mel = layers.TimeDistributed(layers.MaxPooling2D((2, 2)))(x_mel)
-    x_mel = layers.TimeDistributed(layers.Flatten())(x_mel)
-    x_mel = layers.TimeDistributed(layers.Dense(128, activation='relu'))(x_mel)
+    if variable_length:
+        x_mel = _variable_mel_branch(mel_input, mel_branch, mel_filters, mel_dense_units)
+    else:
+        x_mel = _mel_branch(mel_input, mel_branch, mel_filters, mel_dense_units, sequence_length)
 
     # Phonemes branch
     phoneme_input = Input(shape=(sequence_length, 1), name='phonemes')
-    x_phoneme = layers.TimeDistributed(layers.Embedding(input_dim=num_phonemes, output_dim=64))(phoneme_input)
-    x_phoneme = layers.TimeDistributed(layers.Flatten())(x_phoneme)
-    x_phoneme = layers.TimeDistributed(layers.Dense(64, activation='relu'))(x_phoneme)
+    if variable_length:
+        x_phoneme = layers.Embedding(input_dim=num_phonemes, output_dim=phoneme_embedding_dim)(phoneme_input)
+        x_phoneme = layers.Reshape((-1, phoneme_embedding_dim))(x_phoneme)
+        x_phoneme = layers.Dense(phoneme_units, activation='relu')(x_phoneme)
+    else:
+        x_phoneme = layers.TimeDistributed(layers.Embedding(input_dim=num_phonemes, output_dim=phoneme_embedding_dim))(phoneme_input)
+        x_phoneme = layers.TimeDistributed(layers.Flatten())(x_phoneme)
+        x_phoneme = layers.TimeDistributed(layers.Dense(phoneme_units, activation='relu'))(x_phoneme)
 
     # Concatenate branches
     x = layers.Concatenate()([x_landmark, x_mel, x_phoneme])
 
-    # Bi-LSTM layers
-    x = layers.Bidirectional(layers.LSTM(128, return_sequences=True))(x)
-    x = layers.Bidirectional(layers.LSTM(128))(x)
+    inputs = [landmark_input, mel_input, phoneme_input]
+    mask = None
+    if variable_length:
+        length_input = Input(shape=(), dtype='int32', name='lengths')
+        inputs.append(length_input)
+        mask = SequenceMask()(length_input, x)
+
+    # Recurrent layers, Bi-LSTM by default
+    for i, units in enumerate(rnn_units):
+        return_sequences = i < len(rnn_units) - 1
+        x = _recurrent_layer(rnn_type, units, return_sequences, bidirectional)(x, mask=mask)
 
     # Dense output layer
     output = layers.Dense(num_emotions, activation='softmax', name='emotion_output')(x)
 
     # Define model
-    model = models.Model(inputs=[landmark_input, mel_input, phoneme_input], outputs=output)
+    model = models.Model(inputs=inputs, outputs=output)
 
     # Compile model
-    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    optimizer = 'adam' if learning_rate is None else optimizers.Adam(learning_rate)
+    model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
 
     return model
 
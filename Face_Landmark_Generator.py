@@ -2,27 +2,44 @@
 """
 Created on Wed Jun 12 21:22:09 2024
 
+A landmarker is reused between videos through a LandmarkerPool, which loads the
+model once per worker thread or process instead of once per video.
+
 @author: Jayyy
 """
 
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
-from mediapipe import solutions
+import contextlib
+import logging
+import multiprocessing.util
+import threading
+import time
+
+import cv2
 import numpy as np
+from Instrumentation import timer, count, observe
+
+logger = logging.getLogger(__name__)
+
+# The image run between two videos to make the landmarker drop the previous video's face
+BLANK_IMAGE = np.zeros((16, 16, 3), dtype=np.uint8)
 
 class FaceLandMarkGenerator:
     """
     A class to generate and draw facial landmarks using Mediapipe.
     """
-    def __init__(self, model_path):
+    def __init__(self, model_path, crop_face=False, roi_margin=0.3):
         """
         Initialize a FaceLandMarkGenerator instance.
         
         Parameters:
         model_path (str): The path to the facial landmark model.
+        crop_face (bool): Whether to run the landmarker on a crop around the face found in the previous frame.
+        roi_margin (float): The margin added around the previous face, as a fraction of its size.
         """
+        # MediaPipe is imported when a generator is created rather than with the module
+        import mediapipe as mp
+        self.mp = mp
+
         self.BaseOptions = mp.tasks.BaseOptions
         self.FaceLandmarker = mp.tasks.vision.FaceLandmarker
         self.FaceLandmarkerOptions = mp.tasks.vision.FaceLandmarkerOptions
@@ -35,9 +52,43 @@ class FaceLandMarkGenerator:
         
         self.landmarker = self.FaceLandmarker.create_from_options(self.options)       
 
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.mp_drawing_styles = mp.solutions.drawing_styles
-        self.mp_face_mesh = mp.solutions.face_mesh
+        self.crop_face = crop_face
+        self.roi_margin = roi_margin
+        self.roi = None
+        self.renderer = None
+        # VIDEO mode needs increasing timestamps for the landmarker's whole life, so each
+        # video's timestamps are shifted past those of the videos before it
+        self.timestamp_offset_ms = 0
+        self.last_timestamp_ms = -1
+
+    def reset(self):
+        """
+        Prepare the landmarker for a new video.
+        
+        In VIDEO mode the landmarker tracks the face from the previous frame. A blank
+        image makes it lose the previous video's face, so the new video's first frame is
+        detected from scratch, as by a newly loaded landmarker.
+        """
+        if self.last_timestamp_ms < 0:
+            return
+        blank_image = self.mp.Image(image_format=self.mp.ImageFormat.SRGB, data=BLANK_IMAGE)
+        self.landmarker.detect_for_video(blank_image, self.last_timestamp_ms + 1)
+        self.last_timestamp_ms += 1
+        # The new video's timestamps start at 0
+        self.timestamp_offset_ms = self.last_timestamp_ms + 1
+        self.roi = None
+
+    def close(self):
+        """
+        Close the landmarker, releasing MediaPipe's native resources.
+        """
+        self.landmarker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
     
     def draw_landmarks(self, frame, face_landmarks_list):
         """
@@ -47,49 +98,194 @@ class FaceLandMarkGenerator:
         frame (np.ndarray): The video frame to draw landmarks on.
         face_landmarks_list (list): List of facial landmarks to draw.
         """
+        from Landmark_Renderer import LandmarkRenderer
+        from Training_Frame import landmarks_array
+
+        if self.renderer is None:
+            self.renderer = LandmarkRenderer()
         for face_landmarks in face_landmarks_list:
-            face_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-            face_landmarks_proto.landmark.extend([
-                landmark_pb2.NormalizedLandmark(x=landmark.x, y=landmark.y, z=landmark.z) for landmark in face_landmarks
-            ])
-            
-            # Draw tesselation, contours, and irises on the frame
-            solutions.drawing_utils.draw_landmarks(
-                image=frame,
-                landmark_list=face_landmarks_proto,
-                connections=mp.solutions.face_mesh.FACEMESH_TESSELATION,
-                landmark_drawing_spec=None,
-                connection_drawing_spec=mp.solutions.drawing_styles.get_default_face_mesh_tesselation_style()
-            )
-            solutions.drawing_utils.draw_landmarks(
-                image=frame,
-                landmark_list= face_landmarks_proto,
-                connections=mp.solutions.face_mesh.FACEMESH_CONTOURS,
-                landmark_drawing_spec=None,
-                connection_drawing_spec=mp.solutions.drawing_styles.get_default_face_mesh_contours_style()
-            )
-            solutions.drawing_utils.draw_landmarks(
-                image=frame,
-                landmark_list=face_landmarks_proto,
-                connections=mp.solutions.face_mesh.FACEMESH_IRISES,
-                landmark_drawing_spec=None,
-                connection_drawing_spec=mp.solutions.drawing_styles.get_default_face_mesh_iris_connections_style()
-            )
+            self.renderer.draw_landmarks(frame, landmarks_array(face_landmarks))
     
-    def find_landmarks(self, frame, frame_timestamp_ms):
+    @timer('find_landmarks')
+    def find_landmarks(self, frame, frame_timestamp_ms, rgb=False):
         """
         Find facial landmarks in the given frame.
         
+        With crop_face, the landmarker runs on the region around the face found in the
+        previous frame, and the landmarks are mapped back to normalised coordinates of
+        the full frame. The full frame is used when there is no previous face or the
+        crop loses it.
+        
         Parameters:
         frame (np.ndarray): The video frame to analyze.
         frame_timestamp_ms (int): The timestamp of the frame in milliseconds.
+        rgb (bool): Whether the frame is RGB; OpenCV frames are BGR and converted.
         
         Returns:
         list: List of detected facial landmarks.
         """
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
-        face_landmarker_result = self.landmarker.detect_for_video(mp_image, frame_timestamp_ms)
-        face_landmarks_list = face_landmarker_result.face_landmarks
+        if self.crop_face and self.roi is not None:
+            face_landmarks_list = self.find_landmarks_in_roi(frame, frame_timestamp_ms, rgb)
+            if face_landmarks_list:
+                return face_landmarks_list
+            count('face_roi_misses')
+            # MediaPipe needs increasing timestamps, and the frames are far more than 1 ms apart
+            frame_timestamp_ms += 1
+
+        face_landmarks_list = self.detect(frame, frame_timestamp_ms, rgb)
+        self.update_roi(face_landmarks_list, frame.shape[1], frame.shape[0])
+        return face_landmarks_list
+
+    def detect(self, image, frame_timestamp_ms, rgb):
+        """
+        Run the landmarker on an image, converting it to RGB first when needed.
+        
+        Parameters:
+        image (np.ndarray): The image.
+        frame_timestamp_ms (int): The timestamp of the frame in milliseconds.
+        rgb (bool): Whether the image is already RGB.
+        
+        Returns:
+        list: List of detected facial landmarks, normalised to the image.
+        """
+        image = np.ascontiguousarray(image) if rgb else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        mp_image = self.mp.Image(image_format=self.mp.ImageFormat.SRGB, data=image)
+        timestamp_ms = frame_timestamp_ms + self.timestamp_offset_ms
+        face_landmarker_result = self.landmarker.detect_for_video(mp_image, timestamp_ms)
+        self.last_timestamp_ms = timestamp_ms
+        return face_landmarker_result.face_landmarks
+
+    def find_landmarks_in_roi(self, frame, frame_timestamp_ms, rgb):
+        """
+        Find facial landmarks in the tracked region of the frame.
+        
+        Parameters:
+        frame (np.ndarray): The video frame to analyze.
+        frame_timestamp_ms (int): The timestamp of the frame in milliseconds.
+        rgb (bool): Whether the frame is RGB.
+        
+        Returns:
+        list: List of detected facial landmarks, normalised to the full frame.
+        """
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0, x1, y1 = self.roi
+        face_landmarks_list = self.detect(frame[y0:y1, x0:x1], frame_timestamp_ms, rgb)
+
+        crop_width, crop_height = x1 - x0, y1 - y0
+        for face_landmarks in face_landmarks_list:
+            for landmark in face_landmarks:
+                landmark.x = (x0 + landmark.x * crop_width) / frame_width
+                landmark.y = (y0 + landmark.y * crop_height) / frame_height
+                # z uses the same scale as x
+                landmark.z = landmark.z * crop_width / frame_width
+        self.update_roi(face_landmarks_list, frame_width, frame_height)
         return face_landmarks_list
 
-        
\ No newline at end of file
+    def update_roi(self, face_landmarks_list, frame_width, frame_height):
+        """
+        Track a square region around the first face, with a margin, for the next frames.
+        
+        The region only moves once the face gets within half the margin of its edge:
+        in VIDEO mode the landmarker tracks the face from the previous frame's landmarks,
+        which a crop moving every frame would throw off.
+        
+        Parameters:
+        face_landmarks_list (list): The landmarks found, normalised to the full frame.
+        frame_width (int): The frame width in pixels.
+        frame_height (int): The frame height in pixels.
+        """
+        if not face_landmarks_list:
+            self.roi = None
+            return
+        points = np.array([[landmark.x * frame_width, landmark.y * frame_height] for landmark in face_landmarks_list[0]])
+        (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
+        face_size = max(right - left, bottom - top)
+
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            slack = face_size * self.roi_margin / 2
+            inside = (left - x0 >= slack or x0 == 0) and (top - y0 >= slack or y0 == 0) and \
+                     (x1 - right >= slack or x1 == frame_width) and (y1 - bottom >= slack or y1 == frame_height)
+            if inside:
+                return
+
+        half_side = face_size * (0.5 + self.roi_margin)
+        centre_x, centre_y = (left + right) / 2, (top + bottom) / 2
+        self.roi = (max(int(centre_x - half_side), 0), max(int(centre_y - half_side), 0),
+                    min(int(np.ceil(centre_x + half_side)), frame_width), min(int(np.ceil(centre_y + half_side)), frame_height))
+        count('face_roi_updates')
+
+class LandmarkerPool:
+    """
+    Keeps landmarkers loaded between videos, so the model is loaded once per worker rather than once per video.
+    
+    A landmarker is lent to one video at a time and reset before the next; videos
+    processed at the same time, by the landmark stage's worker threads, each get their own.
+    """
+    def __init__(self):
+        """
+        Initialize an empty LandmarkerPool instance.
+        """
+        self.lock = threading.Lock()
+        # (model_path, crop_face, roi_margin) -> the landmarkers not lent out
+        self.idle = {}
+        self.loads = 0
+        self.reuses = 0
+        self.setup_seconds = 0.0
+
+    @contextlib.contextmanager
+    def acquire(self, model_path, crop_face=False, roi_margin=0.3):
+        """
+        Lend a landmarker for one video, loading one when none is idle.
+        
+        The time taken to load or reset it is recorded in the 'landmarker_setup' timer.
+        
+        Parameters:
+        model_path (str): The path to the facial landmark model.
+        crop_face (bool): Whether to run the landmarker on a crop around the previous frame's face.
+        roi_margin (float): The margin added around the previous face, as a fraction of its size.
+        
+        Yields:
+        FaceLandMarkGenerator: The landmarker, given back to the pool when the block exits.
+        """
+        key = (model_path, crop_face, roi_margin)
+        start_time = time.perf_counter()
+        with self.lock:
+            idle = self.idle.get(key)
+            landmark_gen = idle.pop() if idle else None
+        if landmark_gen is None:
+            landmark_gen = FaceLandMarkGenerator(model_path, crop_face=crop_face, roi_margin=roi_margin)
+            reused = False
+        else:
+            landmark_gen.reset()
+            reused = True
+        setup_seconds = time.perf_counter() - start_time
+
+        with self.lock:
+            self.reuses += reused
+            self.loads += not reused
+            self.setup_seconds += setup_seconds
+        observe('landmarker_setup', setup_seconds)
+        count('landmarker_reuses' if reused else 'landmarker_loads')
+        logger.debug(f"{'Reset' if reused else 'Loaded'} a landmarker in {setup_seconds * 1000:.1f} ms")
+
+        try:
+            yield landmark_gen
+        finally:
+            with self.lock:
+                self.idle.setdefault(key, []).append(landmark_gen)
+
+    def close(self):
+        """
+        Close the idle landmarkers. Those lent out are kept when given back, for a later close.
+        """
+        with self.lock:
+            landmarkers = [landmark_gen for idle in self.idle.values() for landmark_gen in idle]
+            self.idle = {}
+        for landmark_gen in landmarkers:
+            landmark_gen.close()
+
+# The process-wide default pool, closed when the process exits; multiprocessing runs its
+# finalizers in worker processes too, where atexit handlers are skipped
+landmarker_pool = LandmarkerPool()
+multiprocessing.util.Finalize(landmarker_pool, landmarker_pool.close, exitpriority=10)
@@ -2,13 +2,30 @@
 """
 Created on Thu Jul  4 15:37:36 2024
 
+Merge the per-video HDF5 files: ExternalLinks to them, a full copy, or virtual
+datasets concatenating every video's frames without copying them.
+
+Example:
+    python HDF5_Merger.py --base-directory training_data/per_video --output training_data/virtual.hdf5
+
 @author: Jayyy
 """
 
+import argparse
 import h5py
+import json
+import numpy as np
 import os
 import glob
+import logging
+import time
+from Instrumentation import timer
+from Storage_Controller import dataset_options, load_storage_config, stream_chunks
+from Storage_Controller_Model import VIRTUAL_LAYOUT, is_frame_stream
+
+logger = logging.getLogger(__name__)
 
+@timer('merge_link')
 def create_master_hdf5(base_directory, master_file):
     """
     Create a master HDF5 file with ExternalLink, linking to individual HDF5 files in subdirectories.
@@ -29,40 +46,329 @@ def create_master_hdf5(base_directory, master_file):
                     video_name = os.path.splitext(os.path.basename(file))[0]
                     hf_out[video_name] = h5py.ExternalLink(file, '/')
 
-def copy_data_to_new_hdf5(master_file, new_file):
+@timer('merge_copy')
+def copy_data_to_new_hdf5(master_file, new_file, storage_config=None):
     """
     Copy data from a master HDF5 file to a new HDF5 file.
     
     Parameters:
     master_file (str): The path to the master HDF5 file.
     new_file (str): The path to the new HDF5 file to create.
+    storage_config (dict): The compression settings and file format of the copy, read from STORAGE_CONFIG_PATH when None.
     """
-    with h5py.File(master_file, 'r') as hf_master, h5py.File(new_file, 'w') as hf_new:
+    storage_config = storage_config if storage_config is not None else load_storage_config()
+    options = dataset_options(storage_config)
+    with h5py.File(master_file, 'r') as hf_master, h5py.File(new_file, 'w', libver=storage_config['libver']) as hf_new:
         for video_key in hf_master.keys():
-            print(f"Processing video: {video_key}")
+            logger.debug(f"Processing video: {video_key}")
             video_group = hf_master[video_key]
             new_video_group = hf_new.create_group(video_key)
             
             for emotion_key in video_group.keys():
-                print(f"  Processing emotion: {emotion_key}")
+                logger.debug(f"  Processing emotion: {emotion_key}")
                 emotion_group = video_group[emotion_key]
                 new_emotion_group = new_video_group.create_group(emotion_key)
+                if is_frame_stream(emotion_group):
+                    copy_frame_stream(emotion_group, new_emotion_group, options, storage_config['chunk_frames'])
+                    continue
                 
                 for frame_key in emotion_group.keys():
-                    print(f"    Processing frame: {frame_key}")
+                    logger.debug(f"    Processing frame: {frame_key}")
                     frame_group = emotion_group[frame_key]
                     new_frame_group = new_emotion_group.create_group(frame_key)
                     
                     for data_key in frame_group.keys():
-                        print(f"      Found data: {data_key}")
+                        logger.debug(f"      Found data: {data_key}")
                         data = frame_group[data_key]
                         if isinstance(data, h5py.Dataset):
-                            print(f"      Copying dataset: {data_key}")
+                            logger.debug(f"      Copying dataset: {data_key}")
                             # Check if the dataset is scalar
                             if data.shape == ():
                                 new_frame_group.create_dataset(data_key, data=data[()])
                             else:
-                                new_frame_group.create_dataset(data_key, data=data[:])
+                                new_frame_group.create_dataset(data_key, data=data[:], **options)
                         else:
-                            print(f"      Skipping non-dataset {data_key} in {frame_key}")
+                            logger.debug(f"      Skipping non-dataset {data_key} in {frame_key}")
+
+def copy_frame_stream(emotion_group, new_emotion_group, options, chunk_frames):
+    """
+    Copy an emotion group written by Storage_Controller.FrameStream.
+    
+    Parameters:
+    emotion_group (h5py.Group): The group to copy.
+    new_emotion_group (h5py.Group): The empty group to copy it to.
+    options (dict): The compression arguments of the landmarks and mel datasets, see dataset_options.
+    chunk_frames (int): The frames per chunk of the compressed datasets.
+    """
+    new_emotion_group.attrs.update(emotion_group.attrs)
+    num_frames = emotion_group['frame_index'].shape[0]
+    for data_key, data in emotion_group.items():
+        logger.debug(f"    Copying dataset: {data_key}")
+        if data_key not in ('landmarks', 'mel') or not options or data.size == 0:
+            new_emotion_group.create_dataset(data_key, data=data[()])
+            continue
+        # Chunks of chunk_frames frames, mel columns scaled by the video's columns per frame
+        axis = 1 if data_key == 'mel' else 0
+        length = chunk_frames * max(data.shape[1] // max(num_frames, 1), 1) if data_key == 'mel' else chunk_frames
+        new_emotion_group.create_dataset(data_key, data=data[()], chunks=stream_chunks(data.shape, axis, length), **options)
+
+class VirtualMapping:
+    """
+    Collects the mappings of a virtual dataset onto source datasets.
+    
+    h5py.VirtualLayout builds selection objects in Python for every mapping, which
+    dominates the build with one mapping per frame; this sets them on the dataset
+    creation property list directly and reuses the dataspaces.
+    """
+    def __init__(self, shape, dtype, fillvalue=None):
+        """
+        Initialize a VirtualMapping instance.
+        
+        Parameters:
+        shape (tuple): The shape of the virtual dataset.
+        dtype (str): The data type of the virtual dataset and its sources.
+        fillvalue: The value of the elements no source maps onto.
+        """
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.space = h5py.h5s.create_simple(shape)
+        self.dcpl = h5py.h5p.create(h5py.h5p.DATASET_CREATE)
+        if fillvalue is not None:
+            self.dcpl.set_fill_value(np.array(fillvalue, dtype=self.dtype))
+        self.source_spaces = {}
+
+    def add(self, file_name, dataset_name, source_shape, start, count):
+        """
+        Map a whole source dataset onto a block of the virtual dataset.
+        
+        Parameters:
+        file_name (str): The source file, relative to the virtual file or absolute.
+        dataset_name (str): The path of the source dataset in its file.
+        source_shape (tuple): The shape of the source dataset.
+        start (tuple): The first element of the block.
+        count (tuple): The shape of the block.
+        """
+        source_space = self.source_spaces.get(source_shape)
+        if source_space is None:
+            source_space = h5py.h5s.create(h5py.h5s.SCALAR) if source_shape == () else h5py.h5s.create_simple(source_shape)
+            self.source_spaces[source_shape] = source_space
+        self.space.select_hyperslab(start, count)
+        self.dcpl.set_virtual(self.space, file_name.encode(), dataset_name.encode(), source_space)
+
+    def create(self, file, name):
+        """
+        Create the virtual dataset.
+        
+        Parameters:
+        file (h5py.File): The file to create it in.
+        name (str): The dataset name.
+        """
+        self.space.select_all()
+        h5py.h5d.create(file.id, name.encode(), h5py.h5t.py_create(self.dtype, logical=True), self.space, dcpl=self.dcpl)
+
+def scan_video_file(path):
+    """
+    Read the shapes of a per-video HDF5 file without reading its data.
+    
+    Parameters:
+    path (str): The per-video HDF5 file.
+    
+    Returns:
+    dict: The emotion, layout, frame keys, mel widths, landmark and mel shapes, and the file's mtime and size.
+    """
+    stat = os.stat(path)
+    with h5py.File(path, 'r') as file:
+        emotion = list(file.keys())[0]  # Since there is only one emotion
+        emotion_group = file[emotion]
+        if is_frame_stream(emotion_group):
+            return {
+                'emotion': emotion,
+                'layout': 'stream',
+                'frame_keys': emotion_group['frame_index'][:].tolist(),
+                'mel_widths': np.diff(emotion_group['mel_offsets'][:]).tolist(),
+                'landmark_shape': list(emotion_group['landmarks'].shape[1:]),
+                'num_mels': emotion_group['mel'].shape[0],
+                'detected': True,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+            }
+
+        frame_keys = sorted(emotion_group.keys(), key=int)
+        mel_widths = []
+        landmark_shape = None
+        num_mels = None
+        detected = True
+        for frame_key in frame_keys:
+            frame_group = emotion_group[frame_key]
+            mel_shape = frame_group['mel'].shape
+            if landmark_shape is None:
+                landmark_shape = frame_group['landmarks'].shape
+                num_mels = mel_shape[0]
+            elif frame_group['landmarks'].shape != landmark_shape or mel_shape[0] != num_mels:
+                raise ValueError(f"scan_video_file - frame {frame_key} of {path} does not match the shapes of the first frame")
+            mel_widths.append(mel_shape[1])
+            detected = detected and 'detected' in frame_group
+    return {
+        'emotion': emotion,
+        'layout': 'frames',
+        'frame_keys': [int(frame_key) for frame_key in frame_keys],
+        'mel_widths': mel_widths,
+        'landmark_shape': list(landmark_shape) if landmark_shape else None,
+        'num_mels': num_mels,
+        'detected': detected,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+    }
+
+def previous_scans(virtual_file):
+    """
+    Read the per-video scans stored in a virtual dataset file by create_virtual_hdf5.
+    
+    Parameters:
+    virtual_file (str): The virtual dataset file, which may not exist.
+    
+    Returns:
+    dict: Absolute source path -> scan, empty when the file does not exist or is not a virtual dataset.
+    """
+    if not os.path.exists(virtual_file):
+        return {}
+    try:
+        with h5py.File(virtual_file, 'r') as file:
+            if file.attrs.get('layout') != VIRTUAL_LAYOUT:
+                return {}
+            return json.loads(file['sources'][()])
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"Could not read the sources of {virtual_file}, rescanning every video: {e}")
+        return {}
+
+@timer('merge_virtual')
+def create_virtual_hdf5(base_directory, virtual_file):
+    """
+    Create an HDF5 file of virtual datasets presenting every video's frames as single concatenated arrays.
+    
+    Nothing is copied: /landmarks (N, 478, 3), /phonemes (N,), /detected (N,) and /mel
+    (128, total columns) map onto the per-video files, with one mapping per video for
+    files written by FrameStream and one per frame for files holding a group per frame.
+    Video i spans frames frame_offsets[i]:frame_offsets[i + 1] and frame j spans mel
+    columns mel_offsets[j]:mel_offsets[j + 1], so a slice across videos is one indexing
+    operation. Source paths are stored relative to the virtual file, and only videos whose
+    file changed since the last build are rescanned, so the view is cheap to rebuild after
+    new videos are extracted.
+    
+    Parameters:
+    base_directory (str): The base directory containing subdirectories with HDF5 files.
+    virtual_file (str): The path to the virtual dataset file to create or rebuild.
+    
+    Returns:
+    dict: The number of videos and frames, and how many videos were rescanned.
+    """
+    scans = previous_scans(virtual_file)
+    virtual_directory = os.path.dirname(os.path.abspath(virtual_file))
+
+    videos = []
+    rescanned = 0
+    for video in sorted(os.listdir(base_directory)):
+        directory = os.path.join(base_directory, video)
+        if not os.path.isdir(directory):
+            continue
+        for file in sorted(glob.glob(os.path.join(directory, '*.hdf5'))):
+            path = os.path.abspath(file)
+            stat = os.stat(path)
+            scan = scans.get(path)
+            if scan is None or scan['mtime_ns'] != stat.st_mtime_ns or scan['size'] != stat.st_size:
+                try:
+                    scan = scan_video_file(path)
+                except (OSError, KeyError, IndexError, ValueError) as e:
+                    logger.warning(f"Skipping {path}: {e}")
+                    continue
+                rescanned += 1
+            if not scan['frame_keys']:
+                logger.warning(f"Skipping {path}: no frames")
+                continue
+            videos.append((os.path.splitext(os.path.basename(file))[0], path, scan))
+
+    if not videos:
+        raise ValueError(f"create_virtual_hdf5 - no per-video HDF5 files found under {base_directory}")
+    landmark_shape = tuple(videos[0][2]['landmark_shape'])
+    num_mels = videos[0][2]['num_mels']
+    for video_name, path, scan in videos:
+        if tuple(scan['landmark_shape']) != landmark_shape or scan['num_mels'] != num_mels:
+            raise ValueError(f"create_virtual_hdf5 - the frames of {path} do not match the shapes of {videos[0][1]}")
+
+    frame_counts = [len(scan['frame_keys']) for _, _, scan in videos]
+    frame_offsets = np.concatenate([[0], np.cumsum(frame_counts)]).astype(np.int64)
+    mel_widths = np.concatenate([scan['mel_widths'] for _, _, scan in videos]).astype(np.int64)
+    mel_offsets = np.concatenate([[0], np.cumsum(mel_widths)]).astype(np.int64)
+    num_frames = int(frame_offsets[-1])
+
+    num_columns = int(mel_offsets[-1])
+    landmarks = VirtualMapping((num_frames,) + landmark_shape, 'f8')
+    mel = VirtualMapping((num_mels, num_columns), 'f8')
+    phonemes = VirtualMapping((num_frames,), 'i4')
+    # Frames of files written before detection flags were stored count as detected
+    detected = VirtualMapping((num_frames,), '?', fillvalue=True)
+
+    for index, (video_name, path, scan) in enumerate(videos):
+        source_path = os.path.relpath(path, virtual_directory)
+        frame = int(frame_offsets[index])
+        if scan.get('layout') == 'stream':
+            num_video_frames = len(scan['frame_keys'])
+            video_columns = int(mel_offsets[frame + num_video_frames] - mel_offsets[frame])
+            prefix = f"{scan['emotion']}/"
+            landmarks.add(source_path, prefix + 'landmarks', (num_video_frames,) + landmark_shape,
+                          (frame,) + (0,) * len(landmark_shape), (num_video_frames,) + landmark_shape)
+            mel.add(source_path, prefix + 'mel', (num_mels, video_columns), (0, int(mel_offsets[frame])), (num_mels, video_columns))
+            phonemes.add(source_path, prefix + 'phonemes', (num_video_frames,), (frame,), (num_video_frames,))
+            detected.add(source_path, prefix + 'detected', (num_video_frames,), (frame,), (num_video_frames,))
+            continue
+        for frame_key, width in zip(scan['frame_keys'], scan['mel_widths']):
+            prefix = f"{scan['emotion']}/{frame_key}/"
+            landmarks.add(source_path, prefix + 'landmarks', landmark_shape, (frame,) + (0,) * len(landmark_shape), (1,) + landmark_shape)
+            mel.add(source_path, prefix + 'mel', (num_mels, width), (0, int(mel_offsets[frame])), (num_mels, width))
+            phonemes.add(source_path, prefix + 'phoneme', (), (frame,), (1,))
+            if scan['detected']:
+                detected.add(source_path, prefix + 'detected', (), (frame,), (1,))
+            frame += 1
+
+    # Built next to the old view and swapped in, so readers never see a half-written file
+    temporary_file = virtual_file + '.tmp'
+    with h5py.File(temporary_file, 'w', libver='latest') as hf_out:
+        hf_out.attrs['layout'] = VIRTUAL_LAYOUT
+        landmarks.create(hf_out, 'landmarks')
+        mel.create(hf_out, 'mel')
+        phonemes.create(hf_out, 'phonemes')
+        detected.create(hf_out, 'detected')
+        hf_out.create_dataset('video_names', data=[video_name for video_name, _, _ in videos], dtype=h5py.string_dtype())
+        hf_out.create_dataset('emotions', data=[scan['emotion'] for _, _, scan in videos], dtype=h5py.string_dtype())
+        hf_out.create_dataset('frame_offsets', data=frame_offsets)
+        hf_out.create_dataset('mel_offsets', data=mel_offsets)
+        hf_out.create_dataset('frame_index', data=np.concatenate([scan['frame_keys'] for _, _, scan in videos]).astype(np.int32))
+        hf_out.create_dataset('sources', data=json.dumps({path: scan for _, path, scan in videos}), dtype=h5py.string_dtype())
+    os.replace(temporary_file, virtual_file)
+
+    logger.info(f"Virtual dataset {virtual_file}: {len(videos)} videos, {num_frames} frames, {rescanned} rescanned")
+    return {'videos': len(videos), 'frames': num_frames, 'rescanned': rescanned}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-video HDF5 files into one dataset.")
+    parser.add_argument('--base-directory', required=True, help="The directory holding one subdirectory per video.")
+    parser.add_argument('--output', required=True, help="The merged HDF5 file to create.")
+    parser.add_argument('--mode', choices=['virtual', 'link', 'copy'], default='virtual',
+                        help="Virtual datasets mapped onto the per-video files, ExternalLinks to them, or a full copy.")
+    parser.add_argument('--storage-config', help="The compression settings of a copy, storage_config.json when not given.")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
 
+    start_time = time.perf_counter()
+    if args.mode == 'virtual':
+        summary = create_virtual_hdf5(args.base_directory, args.output)
+        print(f"{summary['videos']} videos, {summary['frames']} frames, {summary['rescanned']} rescanned")
+    elif args.mode == 'link':
+        create_master_hdf5(args.base_directory, args.output)
+    else:
+        master_file = args.output + '.master'
+        create_master_hdf5(args.base_directory, master_file)
+        copy_data_to_new_hdf5(master_file, args.output, load_storage_config(args.storage_config))
+        os.remove(master_file)
+    print(f"Wrote {args.output} in {time.perf_counter() - start_time:.2f} s")
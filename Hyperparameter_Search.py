@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 23:18:52 2026
+
+Hyperparameter search for the emotion classifier. Configurations are drawn from a
+search space, as a grid or at random, and trained in parallel worker processes, each
+limited to its share of the CPU threads. Successive halving stops the weaker trials
+early: every trial is trained for a few epochs, the best 1/eta continue for eta times
+as many, and so on up to the full budget.
+
+The merged dataset is read and preprocessed once into memory-mapped NumPy arrays at the
+longest sequence length searched, normalised with the statistics of the training split.
+Every trial reads batches from these arrays, sharing the pages of the OS cache, and a
+shorter sequence length is a slice of them. The leaderboard lists each trial's
+validation accuracy, training time and single-sample inference latency, marking the
+trials no other trial beats on all three.
+
+Example:
+    python Hyperparameter_Search.py --hdf5 training_data/merged_data_file.hdf5 --cache-dir search_cache \
+        --strategy random --trials 16 --parallel 4 --min-epochs 2 --max-epochs 18 --output leaderboard.json
+
+@author: Jayyy
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+# Parameter -> values tried; the parameters other than batch_size are create_emotion_classifier's
+DEFAULT_SPACE = {
+    'sequence_length': [20, 30, 45],
+    'batch_size': [8, 16],
+    'learning_rate': [1e-3, 3e-4],
+    'rnn_type': ['lstm', 'gru'],
+    'rnn_units': [[64, 64], [128, 128]],
+    'landmark_units': [[64, 32], [128, 64]],
+}
+TRAINING_PARAMETERS = ('batch_size',)
+CACHE_ARRAYS = ('landmarks', 'mels', 'phonemes', 'labels')
+
+
+def load_space(path=None):
+    """
+    Load the search space.
+
+    Parameters:
+    path (str): Optional JSON file mapping parameter names to the values to try.
+
+    Returns:
+    dict: Parameter -> list of values.
+    """
+    if not path:
+        return dict(DEFAULT_SPACE)
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+def grid_configs(space):
+    """
+    List every combination of the space's values.
+
+    Parameters:
+    space (dict): Parameter -> list of values.
+
+    Returns:
+    list: The configurations, as dicts.
+    """
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def random_configs(space, num_trials, seed=0):
+    """
+    Draw distinct configurations at random from the space's values.
+
+    Parameters:
+    space (dict): Parameter -> list of values.
+    num_trials (int): The number of configurations, fewer when the grid is smaller.
+    seed (int): The random seed.
+
+    Returns:
+    list: The configurations, as dicts.
+    """
+    grid = grid_configs(space)
+    return random.Random(seed).sample(grid, min(num_trials, len(grid)))
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    """
+    Return the epochs trained by the end of each successive halving rung.
+
+    Parameters:
+    min_epochs (int): The epochs of the first rung.
+    max_epochs (int): The epochs of the last rung.
+    eta (int): The factor the budget grows by, and the number of trials shrinks by, at each rung.
+
+    Returns:
+    list: The increasing epoch budgets, ending at max_epochs.
+    """
+    budgets = []
+    epochs = min_epochs
+    while epochs < max_epochs and eta > 1:
+        budgets.append(epochs)
+        epochs *= eta
+    return budgets + [max_epochs]
+
+def _cache_manifest(hdf5_path, sequence_length, seed, test_size, normalization):
+    status = os.stat(hdf5_path)
+    return {'source': os.path.abspath(hdf5_path), 'size': status.st_size, 'mtime_ns': status.st_mtime_ns,
+            'sequence_length': sequence_length, 'seed': seed, 'test_size': test_size, 'normalization': normalization}
+
+def build_shared_dataset(hdf5_path, cache_dir, sequence_length, seed=0, test_size=0.2, normalization='dataset',
+                         stats_workers=1):
+    """
+    Preprocess the merged dataset once into memory-mapped arrays for every trial to read.
+
+    The samples are stored training split first, padded to sequence_length and already
+    normalised, so a trial only slices and batches them. An existing cache is reused when
+    it was built from the same file and split with at least this sequence length.
+
+    Parameters:
+    hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+    cache_dir (str): The directory holding the arrays.
+    sequence_length (int): The longest sequence length searched.
+    seed (int): The seed of the train/test split.
+    test_size (float): The proportion of the samples held out for validation.
+    normalization (str): 'dataset' or 'per-frame', as in Interface_Model.train.
+    stats_workers (int): The worker processes computing the normalisation statistics.
+
+    Returns:
+    dict: The cache manifest, with the number of training and validation samples.
+    """
+    from Interface_Model import dataset_metadata, preprocess_sample, split_metadata
+    from Normalization_Stats import affine_parameters, apply_normalization, load_or_compute_stats
+    from Storage_Controller_Model import open_dataset
+
+    manifest = _cache_manifest(hdf5_path, sequence_length, seed, test_size, normalization)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as json_file:
+            cached = json.load(json_file)
+        if cached['sequence_length'] >= sequence_length and all(
+                cached[key] == manifest[key] for key in manifest if key != 'sequence_length'):
+            print(f"Reusing the shared dataset in {cache_dir}")
+            return cached
+        shutil.rmtree(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    train_metadata, test_metadata = split_metadata(dataset_metadata(hdf5_path), test_size, seed)
+    stats = load_or_compute_stats(hdf5_path, train_metadata, stats_workers) if normalization == 'dataset' else None
+    # Storing the statistics rewrites the dataset, so its size and time are taken afterwards
+    manifest = _cache_manifest(hdf5_path, sequence_length, seed, test_size, normalization)
+    parameters = affine_parameters(stats) if stats is not None else None
+
+    start_time = time.perf_counter()
+    samples = train_metadata + test_metadata
+    arrays = None
+    with open_dataset(hdf5_path) as reader:
+        for index, (video_name, emotion) in enumerate(samples):
+            landmarks, mels, phonemes = preprocess_sample(*reader.read(video_name, emotion), stats, length=sequence_length)
+            if parameters is not None:
+                landmarks, mels = apply_normalization(landmarks, mels, parameters)
+            sample = {'landmarks': landmarks, 'mels': mels, 'phonemes': phonemes, 'labels': np.int32(int(emotion) - 1)}
+            if arrays is None:
+                arrays = {name: np.lib.format.open_memmap(os.path.join(cache_dir, name + '.npy'), mode='w+',
+                                                          dtype=np.int32 if name in ('phonemes', 'labels') else np.float32,
+                                                          shape=(len(samples),) + np.shape(value))
+                          for name, value in sample.items()}
+            for name, value in sample.items():
+                arrays[name][index] = value
+    for array in arrays.values():
+        array.flush()
+
+    manifest.update({'num_train': len(train_metadata), 'num_test': len(test_metadata),
+                     'build_seconds': time.perf_counter() - start_time})
+    with open(manifest_path, 'w') as json_file:
+        json.dump(manifest, json_file, indent=2)
+    print(f"Shared dataset of {len(samples)} samples written to {cache_dir} in {manifest['build_seconds']:.1f} s")
+    return manifest
+
+class SharedDataset:
+    """
+    The memory-mapped arrays written by build_shared_dataset, opened read-only.
+    """
+    def __init__(self, cache_dir):
+        """
+        Initialize a SharedDataset instance.
+
+        Parameters:
+        cache_dir (str): The directory holding the arrays.
+        """
+        with open(os.path.join(cache_dir, 'manifest.json'), 'r') as json_file:
+            self.manifest = json.load(json_file)
+        self.arrays = {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r') for name in CACHE_ARRAYS}
+        self.train_indices = np.arange(self.manifest['num_train'])
+        self.test_indices = np.arange(self.manifest['num_train'], self.manifest['num_train'] + self.manifest['num_test'])
+
+    def batch(self, indices, sequence_length):
+        """
+        Read a batch of samples, truncated to a sequence length.
+
+        Parameters:
+        indices (np.ndarray): The sample indices.
+        sequence_length (int): The number of frames to keep.
+
+        Returns:
+        tuple: ((landmarks, mels, phonemes), labels) as NumPy arrays.
+        """
+        # Sorted indices read the memory-mapped files in order
+        indices = np.sort(indices)
+        landmarks, mels, phonemes = (self.arrays[name][indices, :sequence_length] for name in ('landmarks', 'mels', 'phonemes'))
+        return (landmarks, mels, phonemes), self.arrays['labels'][indices]
+
+    def tf_dataset(self, indices, batch_size, sequence_length, shuffle_seed=None):
+        """
+        Create a TensorFlow dataset of batches read from the arrays.
+
+        Parameters:
+        indices (np.ndarray): The samples.
+        batch_size (int): The batch size.
+        sequence_length (int): The number of frames to keep.
+        shuffle_seed (int): Shuffle the samples with this seed, each pass differently, and
+            repeat for ever; None for a single pass in order.
+
+        Returns:
+        tf.data.Dataset: The dataset of ((landmarks, mels, phonemes), one-hot labels).
+        """
+        import tensorflow as tf
+        from Interface_Model import num_emotions
+
+        rng = np.random.default_rng(shuffle_seed)
+
+        def generator():
+            order = rng.permutation(indices) if shuffle_seed is not None else indices
+            for start in range(0, len(order), batch_size):
+                yield self.batch(order[start:start + batch_size], sequence_length)
+
+        shapes = {name: self.arrays[name].shape[2:] for name in ('landmarks', 'mels', 'phonemes')}
+        output_signature = (
+            (
+                tf.TensorSpec(shape=(None, sequence_length) + shapes['landmarks'], dtype=tf.float32),
+                tf.TensorSpec(shape=(None, sequence_length) + shapes['mels'], dtype=tf.float32),
+                tf.TensorSpec(shape=(None, sequence_length) + shapes['phonemes'], dtype=tf.int32)
+            ),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32)
+        )
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=output_signature)
+        dataset = dataset.map(lambda x, y: (x, tf.one_hot(y, num_emotions)))
+        if shuffle_seed is not None:
+            dataset = dataset.repeat()
+        else:
+            dataset = dataset.apply(tf.data.experimental.assert_cardinality(math.ceil(len(indices) / batch_size)))
+        return dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
+
+def split_config(config):
+    """
+    Split a trial configuration into training settings and create_emotion_classifier arguments.
+
+    Parameters:
+    config (dict): The configuration.
+
+    Returns:
+    tuple: The training settings and the model arguments.
+    """
+    training = {name: config[name] for name in TRAINING_PARAMETERS if name in config}
+    model_arguments = {name: value for name, value in config.items() if name not in TRAINING_PARAMETERS}
+    return training, model_arguments
+
+def _limit_threads(threads):
+    # Read by TensorFlow and the BLAS libraries when they load, so set before the trial imports them
+    for variable in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+
+def measure_latency(model, dataset, sequence_length, repeats=20, warmup=3):
+    """
+    Time single-sample inference on a validation sample.
+
+    Parameters:
+    model (tf.keras.Model): The trained model.
+    dataset (SharedDataset): The shared dataset.
+    sequence_length (int): The model's sequence length.
+    repeats (int): The number of timed calls.
+    warmup (int): The number of untimed calls, which include tracing.
+
+    Returns:
+    dict: The latency summary in milliseconds, see Model_Benchmark.summarise_times.
+    """
+    import tensorflow as tf
+    from Model_Benchmark import summarise_times
+
+    @tf.function(reduce_retracing=True)
+    def infer(landmarks, mels, phonemes):
+        return model([landmarks, mels, phonemes], training=False)
+
+    indices = dataset.test_indices if len(dataset.test_indices) else dataset.train_indices
+    inputs = [tf.constant(x) for x in dataset.batch(indices[:1], sequence_length)[0]]
+    for _ in range(warmup):
+        infer(*inputs).numpy()
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        infer(*inputs).numpy()
+        times.append(time.perf_counter() - start_time)
+    return summarise_times(times)
+
+def run_trial(trial, cache_dir, trial_dir, epochs, initial_epoch=0, threads=0, seed=0):
+    """
+    Train a trial up to a number of epochs, continuing from its last rung, and evaluate it.
+
+    Runs in a worker process. The model, with its optimizer state, is saved in the trial
+    directory so the next rung carries on from it.
+
+    Parameters:
+    trial (dict): The trial id and configuration.
+    cache_dir (str): The shared dataset directory.
+    trial_dir (str): The trial's directory.
+    epochs (int): The epochs trained by the end of this rung.
+    initial_epoch (int): The epochs already trained.
+    threads (int): TensorFlow intra/inter op threads, 0 for the default.
+    seed (int): The base random seed, offset by the trial id.
+
+    Returns:
+    dict: The trial's validation accuracy and loss, training seconds, latency and parameter count.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+    from Interface_Model import sequence_length as default_sequence_length
+
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    tf.keras.utils.set_random_seed(seed + trial['id'])
+
+    training, model_arguments = split_config(trial['config'])
+    batch_size = training.get('batch_size', 8)
+    sequence_length = model_arguments.get('sequence_length', default_sequence_length)
+    dataset = SharedDataset(cache_dir)
+
+    model_path = os.path.join(trial_dir, 'model.keras')
+    if initial_epoch:
+        model = tf.keras.models.load_model(model_path)
+    else:
+        os.makedirs(trial_dir, exist_ok=True)
+        model = create_emotion_classifier(**model_arguments)
+
+    train_dataset = dataset.tf_dataset(dataset.train_indices, batch_size, sequence_length, shuffle_seed=seed + trial['id'])
+    steps_per_epoch = max(len(dataset.train_indices) // batch_size, 1)
+    start_time = time.perf_counter()
+    model.fit(train_dataset, initial_epoch=initial_epoch, epochs=epochs, steps_per_epoch=steps_per_epoch, shuffle=False,
+              verbose=0)
+    train_seconds = time.perf_counter() - start_time
+    model.save(model_path)
+
+    loss, accuracy = model.evaluate(dataset.tf_dataset(dataset.test_indices, batch_size, sequence_length), verbose=0)
+    return {
+        'val_accuracy': float(accuracy),
+        'val_loss': float(loss),
+        'epochs': epochs,
+        'train_seconds': train_seconds,
+        'latency': measure_latency(model, dataset, sequence_length),
+        'params': int(model.count_params()),
+    }
+
+def successive_halving(configs, cache_dir, work_dir, min_epochs=1, max_epochs=9, eta=3, parallel=1, threads=0, seed=0):
+    """
+    Run the trials rung by rung, keeping the best 1/eta of them for the next rung.
+
+    Parameters:
+    configs (list): The trial configurations.
+    cache_dir (str): The shared dataset directory, see build_shared_dataset.
+    work_dir (str): The directory the trials save their models in.
+    min_epochs (int): The epochs of the first rung.
+    max_epochs (int): The epochs of the last rung; every trial runs this long when eta is 1.
+    eta (int): The halving factor.
+    parallel (int): The number of trials trained at once.
+    threads (int): TensorFlow threads per trial, 0 to split the CPUs between the parallel trials.
+    seed (int): The base random seed.
+
+    Returns:
+    list: Each trial's id, configuration, last result and the rung it stopped at.
+    """
+    threads = threads or max((os.cpu_count() or 1) // parallel, 1)
+    trials = [{'id': index, 'config': config, 'epochs': 0, 'train_seconds': 0.0, 'result': None, 'rung': 0}
+              for index, config in enumerate(configs)]
+    alive = list(trials)
+    budgets = rung_budgets(min_epochs, max_epochs, eta)
+    context = multiprocessing.get_context('spawn')
+
+    for rung, epochs in enumerate(budgets):
+        print(f"Rung {rung}: {len(alive)} trials to {epochs} epochs, {parallel} at a time with {threads} threads each")
+        # A fresh process per trial and rung, so TensorFlow state does not build up
+        with concurrent.futures.ProcessPoolExecutor(max_workers=parallel, mp_context=context, max_tasks_per_child=1,
+                                                    initializer=_limit_threads, initargs=(threads,)) as executor:
+            futures = {executor.submit(run_trial, {'id': trial['id'], 'config': trial['config']}, cache_dir,
+                                       os.path.join(work_dir, f"trial_{trial['id']:03d}"), epochs, trial['epochs'],
+                                       threads, seed): trial
+                       for trial in alive}
+            for future in concurrent.futures.as_completed(futures):
+                trial = futures[future]
+                trial['rung'] = rung
+                try:
+                    result = future.result()
+                except Exception as e:
+                    trial['error'] = repr(e)[:500]
+                    print(f"  Trial {trial['id']} failed: {trial['error']}")
+                    continue
+                trial['epochs'] = epochs
+                trial['train_seconds'] += result['train_seconds']
+                trial['result'] = result
+                print(f"  Trial {trial['id']}: accuracy {result['val_accuracy']:.3f} after {epochs} epochs, "
+                      f"{trial['train_seconds']:.1f} s, latency {result['latency']['p50_ms']:.1f} ms - {trial['config']}")
+
+        alive = [trial for trial in alive if 'error' not in trial]
+        if rung < len(budgets) - 1:
+            alive.sort(key=lambda trial: trial['result']['val_accuracy'], reverse=True)
+            alive = alive[:max(math.ceil(len(alive) / eta), 1)]
+    return trials
+
+def leaderboard(trials):
+    """
+    Rank the trials, those trained longest first, then by validation accuracy.
+
+    A trial is on the Pareto front when no other trial trained as long is at least as
+    accurate, as fast to train and as fast at inference, and better on one of them.
+
+    Parameters:
+    trials (list): The trials from successive_halving.
+
+    Returns:
+    list: One row per trial that produced a result.
+    """
+    rows = []
+    for trial in trials:
+        if trial['result'] is None:
+            continue
+        rows.append({
+            'trial': trial['id'],
+            'config': trial['config'],
+            'epochs': trial['epochs'],
+            'val_accuracy': trial['result']['val_accuracy'],
+            'val_loss': trial['result']['val_loss'],
+            'train_seconds': trial['train_seconds'],
+            'seconds_per_epoch': trial['train_seconds'] / trial['epochs'],
+            'latency_p50_ms': trial['result']['latency']['p50_ms'],
+            'params': trial['result']['params'],
+        })
+
+    def dominates(a, b):
+        at_least = (a['val_accuracy'] >= b['val_accuracy'] and a['seconds_per_epoch'] <= b['seconds_per_epoch']
+                    and a['latency_p50_ms'] <= b['latency_p50_ms'])
+        better = (a['val_accuracy'] > b['val_accuracy'] or a['seconds_per_epoch'] < b['seconds_per_epoch']
+                  or a['latency_p50_ms'] < b['latency_p50_ms'])
+        return at_least and better
+
+    for row in rows:
+        peers = [other for other in rows if other['epochs'] == row['epochs'] and other is not row]
+        row['pareto'] = not any(dominates(other, row) for other in peers)
+    rows.sort(key=lambda row: (-row['epochs'], -row['val_accuracy']))
+    return rows
+
+def print_leaderboard(rows):
+    """
+    Print the leaderboard as a table.
+
+    Parameters:
+    rows (list): The rows from leaderboard.
+    """
+    print(f"{'trial':>5} {'epochs':>6} {'accuracy':>8} {'train s':>8} {'s/epoch':>8} {'latency ms':>10} {'params':>9}  config")
+    for row in rows:
+        print(f"{row['trial']:>5} {row['epochs']:>6} {row['val_accuracy']:>8.3f} {row['train_seconds']:>8.1f} "
+              f"{row['seconds_per_epoch']:>8.2f} {row['latency_p50_ms']:>10.2f} {row['params']:>9}"
+              f"{' *' if row['pareto'] else '  '} {row['config']}")
+    print("* on the Pareto front of accuracy, training time and latency")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the emotion classifier's hyperparameters.")
+    parser.add_argument('--hdf5', required=True, help="The merged HDF5 dataset.")
+    parser.add_argument('--cache-dir', default='search_cache', help="The directory of the shared preprocessed dataset.")
+    parser.add_argument('--work-dir', default='search_trials', help="The directory the trials save their models in.")
+    parser.add_argument('--space', help="JSON file mapping parameter names to the values to try.")
+    parser.add_argument('--strategy', choices=['grid', 'random'], default='random')
+    parser.add_argument('--trials', type=int, default=16, help="The number of random configurations.")
+    parser.add_argument('--min-epochs', type=int, default=1, help="The epochs of the first successive halving rung.")
+    parser.add_argument('--max-epochs', type=int, default=9, help="The epochs of the last rung.")
+    parser.add_argument('--eta', type=int, default=3, help="The halving factor, 1 to train every trial for --max-epochs.")
+    parser.add_argument('--parallel', type=int, default=2, help="The number of trials trained at once.")
+    parser.add_argument('--threads', type=int, default=0, help="TensorFlow threads per trial, 0 to split the CPUs between them.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the train/test split, the sampling and the trials.")
+    parser.add_argument('--normalization', choices=['dataset', 'per-frame'], default='dataset')
+    parser.add_argument('--stats-workers', type=int, default=1, help="Processes computing the normalisation statistics.")
+    parser.add_argument('--output', help="Write the leaderboard to this JSON file.")
+    args = parser.parse_args()
+
+    from Interface_Model import sequence_length
+
+    space = load_space(args.space)
+    configs = grid_configs(space) if args.strategy == 'grid' else random_configs(space, args.trials, args.seed)
+    longest = max(space.get('sequence_length', [sequence_length]))
+    manifest = build_shared_dataset(args.hdf5, args.cache_dir, longest, seed=args.seed, normalization=args.normalization,
+                                    stats_workers=args.stats_workers)
+
+    start_time = time.perf_counter()
+    trials = successive_halving(configs, args.cache_dir, args.work_dir, args.min_epochs, args.max_epochs, args.eta,
+                                args.parallel, args.threads, args.seed)
+    rows = leaderboard(trials)
+    print(f"{len(configs)} trials in {time.perf_counter() - start_time:.1f} s")
+    print_leaderboard(rows)
+
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump({'space': space, 'strategy': args.strategy, 'dataset': manifest, 'leaderboard': rows,
+                       'failures': [{'trial': trial['id'], 'config': trial['config'], 'error': trial['error']}
+                                    for trial in trials if 'error' in trial]}, json_file, indent=2)
+        print(f"Leaderboard written to {args.output}")
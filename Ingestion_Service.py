@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:40:12 2026
+
+A small local HTTP service that accepts RAVDESS videos as they arrive and runs the
+extraction pipeline (VideoController, AudioController, FaceLandMarkGenerator and
+HDF5_Container, via Interface.process_video_file) on a bounded pool of worker processes.
+
+Jobs wait in a bounded queue; when it is full, submissions are rejected with
+503 Service Unavailable and a Retry-After header so clients back off. An uploaded
+video is deleted once its job finishes, and finished jobs are forgotten after
+--job-retention-s or beyond --max-finished-jobs, so a long-running service stays bounded.
+
+A worker that dies (killed, or crashed in native code) breaks the whole pool: the pool is
+replaced, and each job that was running on it is run again alone, so only the job whose
+worker died is failed.
+
+Endpoints:
+    POST /jobs                   JSON body {"path": "/data/01-01-03-01-02-01-12.mp4"}
+    POST /jobs?filename=NAME     raw video bytes as the body, saved to the upload directory
+    GET  /jobs                   all jobs
+    GET  /jobs/<id>              a single job's status
+    GET  /metrics                queue depth, running jobs and throughput
+    GET  /health
+
+Example:
+    python Ingestion_Service.py --port 8765 --workers 2 --queue-size 16 --output-dir extracted/
+    curl -X POST localhost:8765/jobs -d '{"path": "/data/01-01-03-01-02-01-12.mp4"}'
+
+@author: Jayyy
+"""
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# RAVDESS file names, e.g. 01-01-03-01-02-01-12.mp4: the emotion and statement are read from them
+RAVDESS_NAME = re.compile(r'^\d{2}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}\.[A-Za-z0-9]+$')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def run_extraction_job(video_path, output_dir, landmark_model_path, model_directory, dictionary_path):
+    """
+    Worker process entry point running the extraction pipeline for one video.
+
+    Parameters:
+    video_path (str): The path to the video.
+    output_dir (str): The directory the per-video outputs are written under.
+    landmark_model_path (str): The path to the facial landmark model.
+    model_directory (str): The path to the MFA acoustic model.
+    dictionary_path (str): The path to the MFA pronunciation dictionary.
+
+    Returns:
+    str: The path to the video's HDF5 file.
+    """
+    # Imported in the worker so the service process itself stays light
+    from Interface import process_video_file
+    return process_video_file(video_path, output_dir, landmark_model_path, model_directory, dictionary_path)
+
+
+class IngestionService:
+    """
+    A bounded job queue feeding a pool of extraction worker processes.
+    """
+    def __init__(self, output_dir, landmark_model_path, model_directory, dictionary_path,
+                 workers=2, queue_size=16, throughput_window_s=300, job_retention_s=3600, max_finished_jobs=1000):
+        """
+        Initialize an IngestionService instance.
+
+        Parameters:
+        output_dir (str): The directory the per-video outputs are written under.
+        landmark_model_path (str): The path to the facial landmark model.
+        model_directory (str): The path to the MFA acoustic model.
+        dictionary_path (str): The path to the MFA pronunciation dictionary.
+        workers (int): The number of worker processes.
+        queue_size (int): The maximum number of jobs waiting to be processed.
+        throughput_window_s (float): The window over which throughput is measured, in seconds.
+        job_retention_s (float): How long finished jobs are kept for status requests, in seconds.
+        max_finished_jobs (int): The most finished jobs kept, the oldest being forgotten first.
+        """
+        self.output_dir = output_dir
+        self.pipeline_args = (landmark_model_path, model_directory, dictionary_path)
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.throughput_window_s = throughput_window_s
+        self.job_retention_s = job_retention_s
+        self.max_finished_jobs = max_finished_jobs
+
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.completed_times = collections.deque()
+        self.running = 0
+        self.pool_restarts = 0
+        self.started_at = time.time()
+
+        self.pool = self._create_pool(workers)
+        # Jobs that were running on a broken pool are run again one at a time
+        self.retry_lock = threading.Lock()
+        self.dispatchers = []
+        self.stopping = threading.Event()
+
+    @staticmethod
+    def _create_pool(workers):
+        # Spawned workers avoid forking the service's threads and any MediaPipe state
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def start(self):
+        """
+        Start one dispatcher thread per worker, so at most `workers` jobs are in flight.
+        """
+        for index in range(self.workers):
+            dispatcher = threading.Thread(target=self._dispatch, name=f"dispatcher-{index}", daemon=True)
+            dispatcher.start()
+            self.dispatchers.append(dispatcher)
+
+    def stop(self):
+        """
+        Stop taking jobs from the queue and shut the worker pool down once running jobs finish.
+        """
+        self.stopping.set()
+        for dispatcher in self.dispatchers:
+            dispatcher.join()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, video_path, upload_dir=None):
+        """
+        Queue a video for extraction.
+
+        Parameters:
+        video_path (str): The path to the video.
+        upload_dir (str): The directory an uploaded video was saved in, deleted once the job finishes.
+
+        Returns:
+        dict: The queued job, or None when the queue is full.
+        """
+        job = {
+            'id': uuid.uuid4().hex,
+            'video_path': video_path,
+            'status': QUEUED,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'hdf5_path': None,
+            'error': None,
+            'upload_dir': upload_dir,
+        }
+        with self.lock:
+            try:
+                self.queue.put_nowait(job['id'])
+            except queue.Full:
+                return None
+            self.jobs[job['id']] = job
+            self._prune_jobs(job['submitted_at'])
+            return dict(job)
+
+    def _prune_jobs(self, now):
+        """
+        Forget the finished jobs older than the retention period, and the oldest beyond
+        max_finished_jobs. Called with the lock held.
+
+        Parameters:
+        now (float): The current time.
+        """
+        finished = sorted((job for job in self.jobs.values() if job['status'] in (DONE, FAILED)),
+                          key=lambda job: job['finished_at'])
+        excess = len(finished) - self.max_finished_jobs
+        for index, job in enumerate(finished):
+            if index < excess or now - job['finished_at'] > self.job_retention_s:
+                del self.jobs[job['id']]
+
+    def get_job(self, job_id):
+        """
+        Return a copy of a job, or None if it is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self):
+        """
+        Return a copy of every job, oldest first.
+        """
+        with self.lock:
+            return sorted((dict(job) for job in self.jobs.values()), key=lambda job: job['submitted_at'])
+
+    def _dispatch(self):
+        while not self.stopping.is_set():
+            try:
+                job_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                job = self.jobs[job_id]
+                job['status'] = RUNNING
+                job['started_at'] = time.time()
+                self.running += 1
+
+            try:
+                hdf5_path, error = self._run(job), None
+            except Exception as e:
+                hdf5_path, error = None, repr(e)
+
+            with self.lock:
+                job['finished_at'] = time.time()
+                job['hdf5_path'] = hdf5_path
+                job['error'] = error
+                job['status'] = FAILED if error else DONE
+                self.running -= 1
+                self.completed_times.append(job['finished_at'])
+                self._prune_jobs(job['finished_at'])
+            if job['upload_dir']:
+                # The extracted features are in the output directory, the uploaded video is no longer needed
+                shutil.rmtree(job['upload_dir'], ignore_errors=True)
+            self.queue.task_done()
+            if error:
+                logger.warning("Job %s failed: %s (%s)", job_id, job['video_path'], error)
+            else:
+                logger.info("Job %s done: %s", job_id, job['video_path'])
+
+    def _run(self, job):
+        """
+        Run a job on the worker pool, replacing the pool if a worker dies.
+
+        Every job running on a pool is lost when one of its workers dies, and which one
+        died is not known; each is run again on a pool of its own, one at a time, so only
+        a job whose own worker dies is failed.
+
+        Parameters:
+        job (dict): The job.
+
+        Returns:
+        str: The path to the video's HDF5 file.
+        """
+        args = (run_extraction_job, job['video_path'], self.output_dir, *self.pipeline_args)
+        pool = self.pool
+        try:
+            return pool.submit(*args).result()
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+        with self.retry_lock:
+            logger.info("Job %s running again alone after its worker pool broke", job['id'])
+            with self._create_pool(1) as retry_pool:
+                return retry_pool.submit(*args).result()
+
+    def _restart_pool(self, broken_pool):
+        """
+        Replace a broken worker pool, once however many dispatchers saw it break.
+
+        Parameters:
+        broken_pool (ProcessPoolExecutor): The pool a job failed on.
+        """
+        with self.lock:
+            if self.pool is not broken_pool:
+                return
+            broken_pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._create_pool(self.workers)
+            self.pool_restarts += 1
+            restarts = self.pool_restarts
+        logger.warning("A worker process died, worker pool restarted (%d restarts)", restarts)
+
+    def metrics(self):
+        """
+        Return the queue depth, running jobs and throughput of the service.
+
+        Returns:
+        dict: The service metrics.
+        """
+        now = time.time()
+        with self.lock:
+            while self.completed_times and now - self.completed_times[0] > self.throughput_window_s:
+                self.completed_times.popleft()
+            statuses = collections.Counter(job['status'] for job in self.jobs.values())
+            durations = [job['finished_at'] - job['started_at'] for job in self.jobs.values() if job['status'] == DONE]
+            window = min(self.throughput_window_s, now - self.started_at)
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'workers': self.workers,
+                'running': self.running,
+                'worker_pool_restarts': self.pool_restarts,
+                'jobs': {status: statuses.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+                'throughput_window_s': window,
+                'throughput_jobs_per_min': 60.0 * len(self.completed_times) / window if window > 0 else 0.0,
+                'mean_job_seconds': sum(durations) / len(durations) if durations else None,
+                'uptime_s': now - self.started_at,
+            }
+
+
+class IngestionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler exposing an IngestionService. The service and upload settings are set on the server.
+    """
+    def _send_json(self, status, body, headers=None):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif path == '/metrics':
+            self._send_json(200, service.metrics())
+        elif path == '/jobs':
+            self._send_json(200, service.list_jobs())
+        elif path.startswith('/jobs/'):
+            job = service.get_job(path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, {'error': 'unknown job'})
+            else:
+                self._send_json(200, job)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.server.max_upload_bytes:
+            self._send_json(413, {'error': f"upload larger than {self.server.max_upload_bytes} bytes"})
+            return
+
+        # Refuse early when the queue is already full, before reading an upload
+        service = self.server.service
+        if service.queue.full():
+            self._reject_full()
+            return
+
+        filename = parse_qs(url.query).get('filename', [None])[0]
+        upload_dir = None
+        if filename is not None:
+            video_path, error = self._save_upload(filename, length)
+            upload_dir = os.path.dirname(video_path) if video_path else None
+        else:
+            video_path, error = self._read_path(length)
+        if error:
+            self._send_json(400, {'error': error})
+            return
+
+        job = service.submit(video_path, upload_dir)
+        if job is None:
+            if upload_dir:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+            self._reject_full()
+        else:
+            self._send_json(202, job, {'Location': f"/jobs/{job['id']}"})
+
+    def _read_path(self, length):
+        try:
+            video_path = json.loads(self.rfile.read(length) or b'{}').get('path')
+        except (ValueError, AttributeError):
+            video_path = None
+        if not video_path or not os.path.isfile(video_path):
+            return None, 'expected a JSON body {"path": ...} naming an existing video'
+        if not RAVDESS_NAME.match(os.path.basename(video_path)):
+            return None, 'video name does not follow the RAVDESS naming scheme'
+        return video_path, None
+
+    def _save_upload(self, filename, length):
+        filename = os.path.basename(filename)
+        if not RAVDESS_NAME.match(filename):
+            return None, 'filename does not follow the RAVDESS naming scheme'
+        if length <= 0:
+            return None, 'expected the video bytes as the body, with a Content-Length'
+
+        # Each upload gets its own directory so repeated names do not overwrite queued videos
+        upload_dir = os.path.join(self.server.upload_dir, uuid.uuid4().hex)
+        os.makedirs(upload_dir, exist_ok=True)
+        video_path = os.path.join(upload_dir, filename)
+        remaining = length
+        with open(video_path, 'wb') as video_file:
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                video_file.write(chunk)
+                remaining -= len(chunk)
+        if remaining > 0:
+            # The client disconnected, a partial video is not queued
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return None, f"upload truncated, {remaining} of {length} bytes missing"
+        return video_path, None
+
+    def _reject_full(self):
+        self._send_json(503, {'error': 'queue full', 'queue_capacity': self.server.service.queue.maxsize},
+                        {'Retry-After': str(self.server.retry_after_s)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(service, host='127.0.0.1', port=8765, upload_dir='uploads', max_upload_mb=512,
+                  retry_after_s=5, verbose=False):
+    """
+    Create the HTTP server for an ingestion service.
+
+    Parameters:
+    service (IngestionService): The service handling the jobs.
+    host (str): The address to bind; the default only accepts local connections.
+    port (int): The port to bind.
+    upload_dir (str): The directory uploaded videos are written to.
+    max_upload_mb (float): The largest accepted upload in megabytes.
+    retry_after_s (int): The Retry-After value sent when the queue is full.
+    verbose (bool): Whether to log every request.
+
+    Returns:
+    ThreadingHTTPServer: The server, not yet serving.
+    """
+    server = ThreadingHTTPServer((host, port), IngestionRequestHandler)
+    server.service = service
+    server.upload_dir = upload_dir
+    server.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+    server.retry_after_s = retry_after_s
+    server.verbose = verbose
+    os.makedirs(upload_dir, exist_ok=True)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local ingestion service running video extraction on a worker pool.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help="The number of extraction worker processes.")
+    parser.add_argument('--queue-size', type=int, default=16, help="The number of jobs that may wait before submissions are rejected.")
+    parser.add_argument('--output-dir', default='extracted')
+    parser.add_argument('--upload-dir', default='uploads')
+    parser.add_argument('--max-upload-mb', type=float, default=512)
+    parser.add_argument('--job-retention-s', type=float, default=3600, help="How long finished jobs stay listed.")
+    parser.add_argument('--max-finished-jobs', type=int, default=1000, help="The most finished jobs kept listed.")
+    parser.add_argument('--landmark-model', default='E:/projects/face/spyder_project/face/face_landmarker.task')
+    parser.add_argument('--mfa-model', default='E:/projects/face/MFA/pretrained_models/acoustic/english_mfa.zip')
+    parser.add_argument('--mfa-dictionary', default='E:/projects/face/MFA/pretrained_models/dictionary/english_mfa.dict')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--log-level', default='INFO', help="INFO logs every finished job.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    service = IngestionService(args.output_dir, args.landmark_model, args.mfa_model, args.mfa_dictionary,
+                               workers=args.workers, queue_size=args.queue_size,
+                               job_retention_s=args.job_retention_s, max_finished_jobs=args.max_finished_jobs)
+    server = create_server(service, args.host, args.port, args.upload_dir, args.max_upload_mb, verbose=args.verbose)
+    service.start()
+    print(f"Ingestion service listening on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:14:52 2026
+
+Lightweight in-process instrumentation: named timers and counters aggregated into
+histograms (count, sum, mean, min, max, p50/p95/p99) that can be dumped as JSON or
+Prometheus text at the end of a run.
+
+Usage:
+    from Instrumentation import timer, count, dump
+
+    with timer('find_landmarks'):
+        ...
+
+    @timer('phoneme_lookup')
+    def retrive_phoneme(...):
+        ...
+
+    count('frames_processed')
+    dump('metrics.json')   # or 'metrics.prom' for Prometheus text
+
+Each process keeps its own registry.
+
+@author: Jayyy
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+
+class Histogram:
+    """
+    Aggregates observations exactly for count, sum, min and max, and keeps a bounded
+    reservoir sample of them for the percentiles.
+    """
+    def __init__(self, reservoir_size=10000):
+        """
+        Initialize a Histogram instance.
+
+        Parameters:
+        reservoir_size (int): The number of observations kept for the percentiles.
+        """
+        self.reservoir_size = reservoir_size
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.samples = []
+        self.random = random.Random(0)
+
+    def observe(self, value):
+        """
+        Record an observation.
+
+        Parameters:
+        value (float): The observed value.
+        """
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(value)
+        else:
+            index = self.random.randrange(self.count)
+            if index < self.reservoir_size:
+                self.samples[index] = value
+
+    def summary(self):
+        """
+        Summarise the observations.
+
+        Returns:
+        dict: The count, sum, mean, min, max and p50/p95/p99.
+        """
+        if self.count == 0:
+            return {'count': 0, 'sum': 0.0}
+        p50, p95, p99 = np.percentile(self.samples, [50, 95, 99])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': float(p50),
+            'p95': float(p95),
+            'p99': float(p99),
+        }
+
+
+class Registry:
+    """
+    A thread-safe collection of named timers and counters.
+    """
+    def __init__(self):
+        """
+        Initialize an empty Registry instance.
+        """
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, value):
+        """
+        Record an observation in the named histogram.
+
+        Parameters:
+        name (str): The histogram name, e.g. 'find_landmarks'.
+        value (float): The observed value, in seconds for timers.
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name, value=1):
+        """
+        Increment the named counter.
+
+        Parameters:
+        name (str): The counter name.
+        value (int): The amount to add.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timer(self, name):
+        """
+        Time a block or a function into the named histogram.
+
+        Parameters:
+        name (str): The timer name.
+
+        Returns:
+        Timer: Usable as a context manager or a decorator.
+        """
+        return Timer(self, name)
+
+    def reset(self):
+        """
+        Discard every recorded observation and counter.
+        """
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def snapshot(self):
+        """
+        Return the current timers and counters.
+
+        Returns:
+        dict: 'timers' maps names to histogram summaries in seconds, 'counters' maps names to totals.
+        """
+        with self.lock:
+            return {
+                'timers': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def to_json(self):
+        """
+        Render the snapshot as JSON.
+        """
+        snapshot = self.snapshot()
+        snapshot['pid'] = os.getpid()
+        snapshot['timestamp'] = time.time()
+        return json.dumps(snapshot, indent=2)
+
+    def to_prometheus(self, prefix='emotion'):
+        """
+        Render the snapshot in the Prometheus text exposition format.
+
+        Timers become summaries named <prefix>_<name>_seconds, counters become <prefix>_<name>_total.
+
+        Parameters:
+        prefix (str): The metric name prefix.
+
+        Returns:
+        str: The metrics text.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, summary in snapshot['timers'].items():
+            metric = f"{prefix}_{_metric_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            if summary['count']:
+                for key, quantile in (('p50', '0.5'), ('p95', '0.95'), ('p99', '0.99')):
+                    lines.append(f'{metric}{{quantile="{quantile}"}} {summary[key]:.9g}')
+            lines.append(f"{metric}_sum {summary['sum']:.9g}")
+            lines.append(f"{metric}_count {summary['count']}")
+        for name, value in snapshot['counters'].items():
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Write the metrics to a file, as Prometheus text for .prom/.txt paths and JSON otherwise.
+
+        Parameters:
+        path (str): The output path.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w') as metrics_file:
+            metrics_file.write(text)
+
+
+class Timer:
+    """
+    Times a block (as a context manager) or every call of a function (as a decorator).
+    """
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.local = threading.local()
+
+    def __enter__(self):
+        starts = self.local.__dict__.setdefault('starts', [])
+        starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.local.starts.pop()
+        self.registry.observe(self.name, elapsed)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.registry.observe(self.name, time.perf_counter() - start)
+        return wrapper
+
+
+def _metric_name(name):
+    return ''.join(character if character.isalnum() else '_' for character in name)
+
+
+# The process-wide default registry and shortcuts to it
+registry = Registry()
+timer = registry.timer
+count = registry.count
+observe = registry.observe
+snapshot = registry.snapshot
+dump = registry.dump
+reset = registry.reset
@@ -4,14 +4,19 @@ Created on Wed Jun 12 19:52:22 2024
 
 @author: Jayyy
 """
-from video_controller import VideoController
-from FaceLandmarkGenerator import FaceLandMarkGenerator
-from AudioController import AudioController
-from Aligner import run_mfa_alignment
-from StorageController import HDF5_Container
-from TrainingFrame import Training_Frame
-from TextGridController import Read_Textgrid
+from Video_Controller import VideoController
+from Audio_Controller import AudioController
+from Aligner import run_mfa_alignment, run_stub_alignment
+from Storage_Controller import HDF5_Container
+from Training_Frame import Training_Frame
+from TextGrid_Controller import Read_Textgrid
+from Landmark_Keyframer import add_keyframe_arguments, keyframe_options
+from Mel_Engine import add_mel_arguments, mel_options
+import Instrumentation
+from Instrumentation import timer, count
 
+import argparse
+import logging
 import os
 from pathlib import Path
 import h5py
@@ -75,6 +80,7 @@ def landmarks_to_txt(output_path, timestamp, landmarks):
     with open(output_path, "a") as txt_file:
         txt_file.write(landmark_str)
         
+@timer('phoneme_lookup')
 def retrive_phoneme(timestamp, phones):
     """
     Retrieve the phoneme at a given timestamp.
@@ -135,79 +141,339 @@ def print_training_frames(training_frames):
         print("LandMarks: ", frame.landmarks)
 
 
-# Process each video in the actor directory   
-for video in os.listdir(actor_directory): 
+def create_video_job(video_path, output_path):
+    """
+    Describe the extraction of one RAVDESS video: its ids and the paths of its outputs.
+    
+    The job is a dict passed through the extraction stages, each of which adds its results to it.
+    
+    Parameters:
+    video_path (str): The path to the video.
+    output_path (str): The directory under which a folder is created for the video's outputs.
     
+    Returns:
+    dict: The video's file name, statement and emotion ids, output directory and output paths.
+    """
     # Get emotion ID and spoken statement from video name
-    file_name = Path(video).stem
+    file_name = Path(video_path).stem
     filename_ids = split_file_name(file_name)
-    statement_id = filename_ids[4]
-    emotion_id = filename_ids[2]
+    output_dir = os.path.join(output_path, file_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    return {
+        'video_path': video_path,
+        'file_name': file_name,
+        'statement_id': filename_ids[4],
+        'emotion_id': filename_ids[2],
+        'output_dir': output_dir,
+        'audio_path': os.path.join(output_dir, file_name + '.wav'),
+        'statement_path': os.path.join(output_dir, file_name + '.txt'),
+        'textgrid_path': os.path.join(output_dir, file_name + '.TextGrid'),
+        'hdf5_path': os.path.join(output_dir, file_name + '.hdf5'),
+    }
+
+def run_audio_stage(job, show=False, mel_options=None):
+    """
+    Extract the video's audio, convert it to WAV and compute its mel spectrogram.
     
-    video_path = os.path.join(actor_directory, video)   
+    Parameters:
+    job (dict): The video job from create_video_job.
+    show (bool): Whether to show the mel spectrogram.
+    mel_options (dict): The sample rate and hop length, frame_aligned to fit the hop length
+        to the video's frame rate and stream to compute the mel spectrogram in blocks as the
+        frames are assembled; AudioController's defaults when None.
+    """
+    settings = dict(mel_options or {})
+    if settings.pop('frame_aligned', False):
+        video_controller = VideoController(job['video_path'])
+        settings['fps'] = video_controller.fps
+        video_controller.cap.release()
+    job['audio_controller'] = AudioController(job['video_path'], job['audio_path'], show=show, **settings)
+
+def run_alignment_stage(job, model_directory, dictionary_path, aligner=run_mfa_alignment):
+    """
+    Align the video's statement with its audio and read the phones. Needs the WAV from run_audio_stage.
     
-    # Only process videos with audio
-    if filename_ids[0] == "01":
-        
-        video_path = os.path.join(actor_directory, video)
-        
-        if os.path.isfile(video_path):
-            print(video_path)
+    Parameters:
+    job (dict): The video job from create_video_job.
+    model_directory (str): The path to the MFA acoustic model.
+    dictionary_path (str): The path to the MFA pronunciation dictionary.
+    aligner (callable): The forced aligner writing the TextGrid, run_mfa_alignment or run_stub_alignment.
+    """
+    create_statement_txt(job['statement_id'], job['statement_path'])
+    aligner(job['output_dir'], model_directory, dictionary_path, job['output_dir'])
+    textgrid = Read_Textgrid(job['textgrid_path'])
+    job['phones'] = textgrid.grid['phones']
 
-        output_dir = os.path.join(output_path, file_name)
-        os.makedirs(output_dir, exist_ok=True)
+def iter_frame_landmarks(job, landmark_model_path, show=False, keyframing=None, decode_width=None, crop_face=False):
+    """
+    Decode the video's frames and yield the facial landmarks of each as they are found.
     
-        converted_audio_output_path = os.path.join(output_dir, file_name + '.wav')
-        statement_path = os.path.join(output_dir, file_name + '.txt')
-        textgrid_path = os.path.join(output_dir, file_name + '.TextGrid')        
-        HDF5_file_path = os.path.join(output_dir, file_name + '.hdf5')
-        
-        landmark_gen = FaceLandMarkGenerator(landmark_model_path)  
-        video_controller = VideoController(video_path)
-        audio_controller = AudioController(video_path, converted_audio_output_path)       
-        
-        create_statement_txt(statement_id, statement_path)
-        run_mfa_alignment(output_dir, model_directory, dictionary_path, output_dir)
-        textgrid = Read_Textgrid(textgrid_path)
-        phones = textgrid.grid['phones']       
-        
-        training_frames = []
+    With a decode_width, ffmpeg decodes the frames at that width straight to RGB. The
+    landmarks are normalised to the frame, so they do not depend on its resolution.
     
-        # Process video frames
+    Parameters:
+    job (dict): The video job from create_video_job.
+    landmark_model_path (str): The path to the facial landmark model.
+    show (bool): Whether to draw the landmarks on the frames, when every frame is detected.
+    keyframing (dict): KeyframeSelector arguments to detect keyframes only and interpolate the
+        other frames, None to detect every frame.
+    decode_width (int): The width to decode the frames at, None for the full resolution.
+    crop_face (bool): Whether to find the landmarks in a crop around the previous frame's face.
+    
+    Yields:
+    tuple: (frame_index, timestamp, landmarks, detected) for every frame, in order.
+    """
+    # MediaPipe is only needed here, so the rest of the module works without it
+    from Face_Landmark_Generator import landmarker_pool
+    video_controller = VideoController(job['video_path'], width=decode_width, rgb=decode_width is not None)
+    job['frame_duration_ms'] = video_controller.frame_duration_ms
+
+    # The landmarker is loaded once and reset between videos
+    with landmarker_pool.acquire(landmark_model_path, crop_face=crop_face) as landmark_gen:
+        if keyframing:
+            from Landmark_Keyframer import KeyframeSelector, iter_keyframed_landmarks
+            yield from iter_keyframed_landmarks(landmark_gen, video_controller, KeyframeSelector(**keyframing))
+            return
+
         for frame, timestamp, frame_index in video_controller.process_video():            
+            face_landmarks_list = landmark_gen.find_landmarks(frame, timestamp, rgb=video_controller.rgb)
             
-            face_landmarks_list = landmark_gen.find_landmarks(frame, timestamp)
-            phoneme = retrive_phoneme(timestamp, phones)
-            mel_segment = audio_controller.retrive_mel_segment(timestamp, video_controller.frame_duration_ms)
-            
-            training_frame = Training_Frame(statement_id, frame_index, face_landmarks_list, phoneme, mel_segment) 
-            training_frames.append(training_frame)
-            
-            
-            landmark_gen.draw_landmarks(frame, face_landmarks_list)        
-            #video_controller.show_frame(frame)
+            if show:
+                landmark_gen.draw_landmarks(frame, face_landmarks_list)        
+                #video_controller.show_frame(frame)
+
+            yield frame_index, timestamp, face_landmarks_list, True
+
+def assemble_training_frame(job, frame_index, timestamp, face_landmarks_list, detected):
+    """
+    Combine a frame's landmarks with its phoneme and mel spectrogram segment.
     
-            
-        # Create an instance of HDF5_Container and add data
-        hdf5_container = HDF5_Container(HDF5_file_path)
-        hdf5_container.create_hdf5_file()
-        
-        # Add data to HDF5
-        hdf5_container.add_video_data_batch(file_name, emotion_id, training_frames)
-        hdf5_container.close_hdf5_file()
+    Needs the results of the audio and alignment stages.
+    
+    Parameters:
+    job (dict): The video job from create_video_job.
+    frame_index (int): The frame number.
+    timestamp (float): The frame's time in milliseconds.
+    face_landmarks_list (np.ndarray): The frame's landmarks, None without a face.
+    detected (bool): Whether the landmarks were detected rather than interpolated.
+    
+    Returns:
+    Training_Frame: The frame.
+    """
+    phoneme = retrive_phoneme(timestamp, job['phones'])
+    mel_segment = job['audio_controller'].retrive_mel_segment(timestamp, job['frame_duration_ms'])
+    count('frames_processed')
+    return Training_Frame(job['statement_id'], frame_index, face_landmarks_list, phoneme, mel_segment, detected)
+
+def release_audio(job):
+    """
+    Release the results of the audio and alignment stages once every frame is assembled.
+    
+    Parameters:
+    job (dict): The video job from create_video_job.
+    """
+    audio_controller = job.pop('audio_controller', None)
+    job.pop('phones', None)
+    if audio_controller is not None:
+        # Stops a streamed audio decode that is still running
+        audio_controller.close()
+
+def assemble_training_frames(job, frame_landmarks):
+    """
+    Combine each frame's landmarks with its phoneme and mel spectrogram segment.
+    
+    Needs the results of the audio and alignment stages, and releases them once every
+    frame is built.
+    
+    Parameters:
+    job (dict): The video job from create_video_job.
+    frame_landmarks (iterable): (frame_index, timestamp, landmarks, detected) for every frame, from iter_frame_landmarks.
+    
+    Yields:
+    Training_Frame: Each frame, as soon as its landmarks arrive.
+    """
+    try:
+        for frame in frame_landmarks:
+            yield assemble_training_frame(job, *frame)
+    finally:
+        release_audio(job)
+
+class TrainingFrameWriter:
+    """
+    Writes a video's training frames to its HDF5 file as they are produced.
+    
+    The frames go to <hdf5_path>.tmp, renamed to the video's HDF5 file once every frame
+    is written, so a video that fails partway leaves no file that looks complete.
+    """
+    def __init__(self, job):
+        """
+        Initialize a TrainingFrameWriter instance, creating the temporary file.
         
-        # Read all data from the HDF5 file
-        all_data = hdf5_container.read_video_data(HDF5_file_path)
+        Parameters:
+        job (dict): The video job from create_video_job.
+        """
+        self.job = job
+        self.temporary_path = job['hdf5_path'] + '.tmp'
+        self.hdf5_container = HDF5_Container(self.temporary_path)
+        self.hdf5_container.create_hdf5_file()
+        self.stream = self.hdf5_container.open_frame_stream(job['file_name'], job['emotion_id'])
+
+    def append(self, frame):
+        """
+        Add a frame, written with the rest of its block.
         
-        # Access and process the data
-        #read_video_name = all_data['video_name']
-        read_emotion = all_data['emotion']
-        read_frames = all_data['frames']
+        Parameters:
+        frame (Training_Frame): The frame.
+        """
+        self.stream.append(frame)
+
+    def commit(self):
+        """
+        Write the last frames and move the file to the video's HDF5 path.
         
+        Returns:
+        str: The path to the video's HDF5 file.
+        """
+        self.stream.close()
+        self.hdf5_container.close_hdf5_file()
+        os.replace(self.temporary_path, self.job['hdf5_path'])
+        count('videos_processed')
+        return self.job['hdf5_path']
+
+    def abort(self):
+        """
+        Discard the frames written so far.
+        """
+        self.hdf5_container.close_hdf5_file()
+        if os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+
+def write_training_frames(job, training_frames):
+    """
+    Store the video's training frames in its HDF5 file as they are produced.
+    
+    The frames are appended in blocks, so memory does not grow with the length of the
+    video, and the file only appears once every frame is written, see TrainingFrameWriter.
+    
+    Parameters:
+    job (dict): The video job from create_video_job.
+    training_frames (iterable): The Training_Frame objects.
+    
+    Returns:
+    str: The path to the video's HDF5 file.
+    """
+    writer = TrainingFrameWriter(job)
+    try:
+        for frame in training_frames:
+            writer.append(frame)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+def run_landmark_stage(job, landmark_model_path, show=False, keyframing=None, decode_width=None, crop_face=False):
+    """
+    Find the facial landmarks of each frame, combine them with the phoneme and mel
+    spectrogram segment and write the frame to the video's HDF5 file, one frame at a time.
+    
+    Needs the results of the audio and alignment stages.
+    
+    Parameters:
+    job (dict): The video job from create_video_job.
+    landmark_model_path (str): The path to the facial landmark model.
+    show (bool): Whether to draw the landmarks on the frames, when every frame is detected.
+    keyframing (dict): KeyframeSelector arguments, see iter_frame_landmarks.
+    decode_width (int): The width to decode the frames at, None for the full resolution.
+    crop_face (bool): Whether to find the landmarks in a crop around the previous frame's face.
+    
+    Returns:
+    str: The path to the video's HDF5 file.
+    """
+    frame_landmarks = iter_frame_landmarks(job, landmark_model_path, show=show, keyframing=keyframing,
+                                           decode_width=decode_width, crop_face=crop_face)
+    return write_training_frames(job, assemble_training_frames(job, frame_landmarks))
+
+@timer('process_video')
+def process_video_file(video_path, output_path, landmark_model_path, model_directory, dictionary_path, show=False,
+                       aligner=run_mfa_alignment, keyframing=None, decode_width=None, crop_face=False, mel_options=None):
+    """
+    Extract the landmarks, phonemes and mel spectrogram segments of every frame of a
+    RAVDESS video and store them in the video's HDF5 file.
+    
+    Parameters:
+    video_path (str): The path to the video.
+    output_path (str): The directory under which a folder is created for the video's outputs.
+    landmark_model_path (str): The path to the facial landmark model.
+    model_directory (str): The path to the MFA acoustic model.
+    dictionary_path (str): The path to the MFA pronunciation dictionary.
+    show (bool): Whether to draw the landmarks and show the mel spectrograms.
+    aligner (callable): The forced aligner writing the TextGrid, run_mfa_alignment or run_stub_alignment.
+    keyframing (dict): KeyframeSelector arguments to detect landmarks on keyframes only, None for every frame.
+    decode_width (int): The width to decode the frames at for landmarking, None for the full resolution.
+    crop_face (bool): Whether to find the landmarks in a crop around the previous frame's face.
+    mel_options (dict): The mel spectrogram settings, see run_audio_stage.
+    
+    Returns:
+    str: The path to the video's HDF5 file.
+    """
+    job = create_video_job(video_path, output_path)
+    run_audio_stage(job, show=show, mel_options=mel_options)
+    run_alignment_stage(job, model_directory, dictionary_path, aligner)
+
+    if show:
+        audio_controller = job['audio_controller']
+
+    HDF5_file_path = run_landmark_stage(job, landmark_model_path, show=show, keyframing=keyframing,
+                                        decode_width=decode_width, crop_face=crop_face)
+    
+    if show:
+        # Read all data back from the HDF5 file and show the reconstructed spectrogram
+        all_data = HDF5_Container(HDF5_file_path).read_video_data(HDF5_file_path)
         full_mel = combine_mel_segments_HDF5(all_data)
         audio_controller.show_melspectrogram(full_mel, audio_controller.sr, audio_controller.hop_length)
+
+    return HDF5_file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract training frames from every RAVDESS video of an actor.")
+    parser.add_argument('--actor-directory', default=actor_directory)
+    parser.add_argument('--metrics-out', help="Write per-stage timings to this file, as Prometheus text for .prom/.txt and JSON otherwise.")
+    parser.add_argument('--log-level', default='WARNING', help="DEBUG shows per-frame and per-phone messages.")
+    parser.add_argument('--no-show', action='store_true', help="Do not draw the landmarks or show the mel spectrograms.")
+    parser.add_argument('--stub-aligner', action='store_true', help="Spread the phones evenly instead of running MFA.")
+    add_keyframe_arguments(parser)
+    parser.add_argument('--decode-width', type=int, help="Decode the frames at this width for landmarking, e.g. 640.")
+    parser.add_argument('--crop-face', action='store_true', help="Find the landmarks in a crop around the previous frame's face.")
+    add_mel_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    actor_directory = args.actor_directory
+
+    # Process each video in the actor directory   
+    for video in os.listdir(actor_directory): 
         
+        file_name = Path(video).stem
+        filename_ids = split_file_name(file_name)
         
-    
-        
+        # Only process videos with audio
+        if filename_ids[0] == "01":
+            
+            video_path = os.path.join(actor_directory, video)
+            
+            if os.path.isfile(video_path):
+                print(video_path)
+
+            process_video_file(video_path, output_path, landmark_model_path, model_directory, dictionary_path, show=not args.no_show,
+                               aligner=run_stub_alignment if args.stub_aligner else run_mfa_alignment,
+                               keyframing=keyframe_options(args), decode_width=args.decode_width, crop_face=args.crop_face,
+                               mel_options=mel_options(args))
 
+    from Face_Landmark_Generator import landmarker_pool
+    print(f"Landmarker: {landmarker_pool.loads} loaded, {landmarker_pool.reuses} reused, "
+          f"{landmarker_pool.setup_seconds:.2f} s of setup")
+    landmarker_pool.close()
+    if args.metrics_out:
+        Instrumentation.dump(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
@@ -1,11 +1,19 @@
+import argparse
+import logging
 import numpy as np
 import random
-import tensorflow as tf
 import datetime
 import h5py
+import json
+import os
 import time
-from Storage_Controller import HDF5_Container
-from Emotion_Classifier import create_emotion_classifier
+import Instrumentation
+from Instrumentation import timer
+from Normalization_Stats import (affine_parameters, apply_normalization, load_model_stats, load_or_compute_stats,
+                                 save_model_stats, split_key)
+from Storage_Controller_Model import open_dataset, read_emotion_group
+
+logger = logging.getLogger(__name__)
 
 # Define constants
 sequence_length = 30
@@ -15,16 +23,24 @@ mel_target_time_frames = 64
 num_phonemes = 91
 num_emotions = 8
 
-from tensorflow.python.client import device_lib
-print(device_lib.list_local_devices())
+def list_devices():
+    """
+    List the devices TensorFlow can use.
+    
+    Returns:
+    list: The device descriptions.
+    """
+    from tensorflow.python.client import device_lib
+    return device_lib.list_local_devices()
 
-def pad_mel_segment(mel_segment, target_length):
+def pad_mel_segment(mel_segment, target_length, fill=None):
     """
     Pad or truncate the mel spectrogram segment to the target length.
     
     Parameters:
     mel_segment (np.ndarray): The input mel spectrogram segment.
     target_length (int): The target length for padding or truncation.
+    fill (np.ndarray): The value of each mel bin in the padding, zeros when None.
     
     Returns:
     np.ndarray: The padded or truncated mel spectrogram segment.
@@ -32,7 +48,11 @@ def pad_mel_segment(mel_segment, target_length):
     current_length = mel_segment.shape[1]
     if current_length < target_length:
         padding_amount = target_length - current_length
-        padded_segment = np.pad(mel_segment, ((0, 0), (0, padding_amount)), 'constant')
+        if fill is None:
+            padded_segment = np.pad(mel_segment, ((0, 0), (0, padding_amount)), 'constant')
+        else:
+            padding = np.broadcast_to(np.asarray(fill, dtype=mel_segment.dtype)[:, None], (len(mel_segment), padding_amount))
+            padded_segment = np.concatenate([mel_segment, padding], axis=1)
     else:
         padded_segment = mel_segment[:, :target_length]
     return padded_segment
@@ -53,53 +73,292 @@ def normalize_mel_spectrogram(mel):
         return np.zeros_like(mel)
     return (mel - mel_mean) / mel_std
 
-def pad_or_truncate_sequence(sequence, target_length):
+def pad_or_truncate_sequence(sequence, target_length, fill=None):
     """
     Pad or truncate the sequence to the target length.
     
     Parameters:
     sequence (np.ndarray): The input sequence.
     target_length (int): The target length for padding or truncation.
+    fill (np.ndarray): The value of the padding elements, broadcast to their shape; zeros when None.
     
     Returns:
     np.ndarray: The padded or truncated sequence.
     """
     current_length = len(sequence)
     if current_length < target_length:
-        padding = np.zeros((target_length - current_length, *sequence[0].shape), dtype=sequence[0].dtype)
+        padding_shape = (target_length - current_length, *sequence[0].shape)
+        if fill is None:
+            padding = np.zeros(padding_shape, dtype=sequence[0].dtype)
+        else:
+            padding = np.broadcast_to(np.asarray(fill, dtype=sequence[0].dtype), padding_shape)
         return np.concatenate([sequence, padding], axis=0)
     return sequence[:target_length]
 
-def split_metadata(metadata, test_size=0.2):
+def split_metadata(metadata, test_size=0.2, seed=None):
     """
     Split metadata into training and testing sets.
     
     Parameters:
     metadata (list): The metadata to split.
     test_size (float): The proportion of the dataset to include in the test split.
+    seed (int): Optional seed so the split is identical across runs and workers.
     
     Returns:
     tuple: Training and testing metadata.
     """
-    random.shuffle(metadata)
+    if seed is None:
+        random.shuffle(metadata)
+    else:
+        metadata.sort()
+        random.Random(seed).shuffle(metadata)
     split_index = int(len(metadata) * (1 - test_size))
     train_metadata = metadata[:split_index]
     test_metadata = metadata[split_index:]
     return train_metadata, test_metadata
 
+def dataset_metadata(hdf5_path):
+    """
+    List the samples of a merged HDF5 dataset without reading their frames.
+    
+    Parameters:
+    hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+    
+    Returns:
+    list: The (video_name, emotion) pairs.
+    """
+    with open_dataset(hdf5_path) as reader:
+        return reader.metadata()
+
+def load_emotion_group(emotion_group, stats=None, sequence_lengths=False):
+    """
+    Load and preprocess the frames of a video's emotion group into model inputs.
+    
+    Parameters:
+    emotion_group (h5py.Group): The emotion group holding one group per frame.
+    stats (dict): Dataset normalisation statistics, see preprocess_sample.
+    sequence_lengths (bool): Whether to add the number of frames kept to the inputs, see model_inputs.
+    
+    Returns:
+    tuple: The landmarks, mel spectrograms and phonemes, padded or truncated to sequence_length.
+    """
+    with timer('sample_read'):
+        landmarks, mels, phonemes = read_emotion_group(emotion_group)
+    inputs = preprocess_sample(landmarks, mels, phonemes, stats)
+    if sequence_lengths:
+        inputs += (min(len(landmarks), sequence_length),)
+    return inputs
+
+@timer('sample_preprocess')
+def preprocess_sample(landmarks, mels, phonemes, stats=None, length=None, pad=True):
+    """
+    Preprocess the frames of a sample into model inputs.
+    
+    Without stats, each mel segment is z-scored on its own. With dataset statistics,
+    the mel segments and sequences are padded with the mean instead and left
+    unnormalised: apply_normalization then normalises whole batches and turns the
+    padding into zeros.
+    
+    Parameters:
+    landmarks (np.ndarray): The landmarks of each frame.
+    mels (list): The mel segment of each frame.
+    phonemes (np.ndarray): The phoneme of each frame.
+    stats (dict): Dataset normalisation statistics, see Normalization_Stats.
+    length (int): The number of frames to pad or truncate to, sequence_length when None.
+    pad (bool): Whether to pad short sequences; without, the frames are only truncated, and
+        only when a length is given.
+    
+    Returns:
+    tuple: The landmarks, mel spectrograms and phonemes, padded or truncated to the length.
+    """
+    if not pad:
+        landmarks, mels, phonemes = landmarks[:length], mels[:length], phonemes[:length]
+        length = len(landmarks)
+    length = length or sequence_length
+    if stats is None:
+        mels = [np.expand_dims(normalize_mel_spectrogram(pad_mel_segment(mel, mel_target_time_frames)), axis=-1) for mel in mels]
+        landmarks = pad_or_truncate_sequence(np.array(landmarks), length)
+        mels = pad_or_truncate_sequence(np.array(mels), length)
+    else:
+        mel_mean = stats['mel_mean'].astype(np.float32)
+        mels = [pad_mel_segment(mel.astype(np.float32), mel_target_time_frames, mel_mean)[..., None] for mel in mels]
+        landmarks = pad_or_truncate_sequence(np.array(landmarks, dtype=np.float32), length, stats['landmark_mean'])
+        mels = pad_or_truncate_sequence(np.array(mels), length, mel_mean[:, None, None])
+    phonemes = pad_or_truncate_sequence(np.array(phonemes), length)
+    phonemes = np.expand_dims(phonemes, axis=-1)
+    return landmarks, mels, phonemes
+
+def load_video_sample(hdf5_path, stats=None, sequence_lengths=False):
+    """
+    Load the model inputs from a single video's HDF5 file, as written during extraction.
+    
+    Parameters:
+    hdf5_path (str): The path to the per-video HDF5 file.
+    stats (dict): Dataset normalisation statistics, see load_emotion_group.
+    sequence_lengths (bool): Whether to add the number of frames kept to the inputs, see model_inputs.
+    
+    Returns:
+    tuple: A tuple containing the input data and the zero-based emotion label stored in the file.
+    """
+    with h5py.File(hdf5_path, 'r') as file:
+        emotion = list(file.keys())[0]  # Since there is only one emotion
+        return load_emotion_group(file[emotion], stats, sequence_lengths), int(emotion) - 1
+
+def model_inputs(model, landmarks, mels, phonemes, lengths):
+    """
+    Arrange a batch as the inputs of a model.
+    
+    Parameters:
+    model (tf.keras.Model): The emotion classifier.
+    landmarks (np.ndarray): The batch's landmarks.
+    mels (np.ndarray): The batch's mel spectrograms.
+    phonemes (np.ndarray): The batch's phonemes.
+    lengths (np.ndarray): The number of frames of each sample, which only a model built
+        with sequence_length None takes.
+    
+    Returns:
+    list: The model's inputs.
+    """
+    inputs = [landmarks, mels, phonemes]
+    if len(model.inputs) > len(inputs):
+        inputs.append(np.asarray(lengths, dtype=np.int32))
+    return inputs
+
+def model_architecture_path(checkpoint_dir):
+    """
+    Return where the architecture of the checkpoints in a directory is kept.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    
+    Returns:
+    str: The path of architecture.json.
+    """
+    return os.path.join(checkpoint_dir, 'architecture.json')
+
+def save_model_architecture(checkpoint_dir, model_kwargs):
+    """
+    Record the create_emotion_classifier arguments of the checkpoints in a directory, for load_trained_model.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    model_kwargs (dict): The keyword arguments the model was created with.
+    """
+    with open(model_architecture_path(checkpoint_dir), 'w') as json_file:
+        json.dump(model_kwargs, json_file)
+
+def load_model_architecture(checkpoint_dir):
+    """
+    Read the create_emotion_classifier arguments of the checkpoints in a directory.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    
+    Returns:
+    dict: The keyword arguments, or None for a directory written before they were recorded.
+    """
+    path = model_architecture_path(checkpoint_dir)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)
+
+def split_seed_path(checkpoint_dir):
+    """
+    Return where the seed of the train/test split of the checkpoints in a directory is kept.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    
+    Returns:
+    str: The path of split.json.
+    """
+    return os.path.join(checkpoint_dir, 'split.json')
+
+def save_split_seed(checkpoint_dir, seed):
+    """
+    Record the seed of the train/test split the checkpoints in a directory are trained on.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    seed (int): The seed, see split_metadata.
+    """
+    with open(split_seed_path(checkpoint_dir), 'w') as json_file:
+        json.dump({'seed': seed}, json_file)
+
+def load_split_seed(checkpoint_dir):
+    """
+    Read the seed of the train/test split the checkpoints in a directory are trained on.
+    
+    Parameters:
+    checkpoint_dir (str): The checkpoint directory.
+    
+    Returns:
+    int: The seed, or None for a directory written before it was recorded.
+    """
+    path = split_seed_path(checkpoint_dir)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)['seed']
+
+def load_trained_model(model_path, variable_length=False):
+    """
+    Load a trained emotion classifier.
+    
+    A checkpoint directory is restored into the architecture recorded in it, and every
+    variable of the model has to be found in the checkpoint.
+    
+    Parameters:
+    model_path (str): A saved Keras model file, or a checkpoint directory written by train().
+    variable_length (bool): Whether the checkpoints are of a variable-length model, for a checkpoint
+        directory without a recorded architecture.
+    
+    Returns:
+    tf.keras.Model: The model.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+
+    if not os.path.isdir(model_path):
+        return tf.keras.models.load_model(model_path)
+
+    latest = tf.train.latest_checkpoint(model_path)
+    if latest is None:
+        raise FileNotFoundError(f"No checkpoint found in {model_path}")
+    model_kwargs = load_model_architecture(model_path)
+    if model_kwargs is None:
+        model_kwargs = {'sequence_length': None if variable_length else sequence_length}
+    model = create_emotion_classifier(**model_kwargs)
+    # The optimizer state is in the checkpoint too, but is not needed for inference
+    tf.train.Checkpoint(model=model).restore(latest).expect_partial().assert_existing_objects_matched()
+    return model
+
 class HDF5Dataset:
     """
     A class to handle dataset loading from HDF5 files.
     """
-    def __init__(self, hdf5_path):
+    def __init__(self, hdf5_path, stats=None, variable_length=False, max_length=None, sequence_lengths=False):
         """
         Initialize an HDF5Dataset instance.
         
         Parameters:
-        hdf5_path (str): The path to the HDF5 file.
+        hdf5_path (str): The path to the merged HDF5 file or virtual dataset file.
+        stats (dict): Dataset normalisation statistics, see preprocess_sample.
+        variable_length (bool): Whether to keep each sample's own number of frames rather than padding to sequence_length.
+        max_length (int): The number of frames variable-length samples are truncated to, None to keep every frame.
+        sequence_lengths (bool): Whether to add the number of frames kept to the inputs, as a model
+            built with sequence_length None takes.
         """
         self.hdf5_path = hdf5_path
+        self.stats = stats
+        self.variable_length = variable_length
+        self.max_length = max_length
+        self.sequence_lengths = sequence_lengths
+        # Opened on first use and kept open, so linked and virtual sources stay open between samples
+        self.reader = None
 
+    @timer('sample_load')
     def __call__(self, video_name, emotion):
         """
         Load data for a specific video and emotion from the HDF5 file.
@@ -111,103 +370,282 @@ class HDF5Dataset:
         Returns:
         tuple: A tuple containing the input data and the emotion label.
         """
-        start_time = time.time()
-        with h5py.File(self.hdf5_path, 'r') as file:
-            try:
-                video_group = file[video_name]
-                emotion_str = f"{int(emotion):02d}"
-                if emotion_str not in video_group:
-                    raise KeyError(f"Emotion {emotion_str} not found for video {video_name}")
-
-                emotion_group = video_group[emotion_str]
-                landmarks = []
-                mels = []
-                phonemes = []
-
-                for frame_key in sorted(emotion_group.keys(), key=int):
-                    frame_group = emotion_group[frame_key]
-                    landmarks.append(frame_group['landmarks'][:])
-                    mel = frame_group['mel'][:]
-                    mel = pad_mel_segment(mel, mel_target_time_frames)
-                    mel = normalize_mel_spectrogram(mel)
-                    mel = np.expand_dims(mel, axis=-1)
-                    mels.append(mel)
-                    phonemes.append(frame_group['phoneme'][()])
-
-                landmarks = pad_or_truncate_sequence(np.array(landmarks), sequence_length)
-                mels = pad_or_truncate_sequence(np.array(mels), sequence_length)
-                phonemes = pad_or_truncate_sequence(np.array(phonemes), sequence_length)
-                phonemes = np.expand_dims(phonemes, axis=-1)
-
-                load_time = time.time() - start_time
-                print(f"Time taken to load {video_name}: {load_time:.6f} seconds")
-
-                return (landmarks, mels, phonemes), int(emotion) - 1
-
-            except KeyError as e:
-                print(f"KeyError: {e}")
-                raise
-
-def create_tf_dataset(metadata, batch_size, hdf5_path):
+        if self.reader is None:
+            self.reader = open_dataset(self.hdf5_path)
+        try:
+            with timer('sample_read'):
+                landmarks, mels, phonemes = self.reader.read(video_name, emotion)
+        except KeyError as e:
+            logger.error(f"KeyError: {e}")
+            raise
+        logger.debug(f"Loaded {video_name}/{int(emotion):02d}")
+        if self.variable_length:
+            inputs = preprocess_sample(landmarks, mels, phonemes, self.stats, self.max_length, pad=False)
+        else:
+            inputs = preprocess_sample(landmarks, mels, phonemes, self.stats)
+        if self.sequence_lengths:
+            # Padding is not counted, truncation is
+            inputs += (min(len(landmarks), len(inputs[0])),)
+        return inputs, int(emotion) - 1
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+def create_tf_dataset(metadata, batch_size, hdf5_path, stats=None, soft_targets=None, augmentation=None,
+                      variable_length=False, max_length=None, bucket_width=8, sequence_lengths=None):
     """
     Create a TensorFlow dataset from metadata and HDF5 data.
+
+    Augmentation runs on whole batches after the cache, so every epoch is augmented afresh.
+
+    With variable_length, samples keep their own number of frames and are batched with
+    samples of similar length, in buckets bucket_width frames wide, then padded to the
+    longest of the batch. They are normalised before batching, so the padding is zeros.
+    The inputs then end with each sample's number of frames, from which a model built
+    with sequence_length None masks the padding.
     
     Parameters:
     metadata (list): The metadata for the dataset.
     batch_size (int): The batch size for training.
     hdf5_path (str): The path to the HDF5 file.
+    stats (dict): Dataset normalisation statistics applied to each batch; per-frame normalisation when None.
+    soft_targets (np.ndarray): Optional (len(metadata), num_emotions) per-sample targets, such as a
+        teacher's log probabilities, appended to each one-hot label.
+    augmentation (dict): Optional augmentation settings, see Augmentation.DEFAULT_AUGMENTATION.
+    variable_length (bool): Whether to batch samples of their own length rather than padded to sequence_length.
+    max_length (int): The number of frames variable-length samples are truncated to, None to keep every frame.
+    bucket_width (int): The range of lengths batched together, in frames, with variable_length.
+    sequence_lengths (bool): Whether the inputs end with each sample's number of frames, variable_length when None.
     
     Returns:
     tf.data.Dataset: The TensorFlow dataset.
     """
-    hdf5_dataset = HDF5Dataset(hdf5_path)
+    import tensorflow as tf
+
+    if sequence_lengths is None:
+        sequence_lengths = variable_length
+    hdf5_dataset = HDF5Dataset(hdf5_path, stats, variable_length, max_length, sequence_lengths)
+    parameters = affine_parameters(stats) if stats is not None else None
+    # Variable-length samples are normalised one by one, before they are padded
+    batch_parameters = None if variable_length else parameters
+
+    def load_sample(video_name, emotion):
+        (landmarks, mels, *rest), label = hdf5_dataset(video_name, emotion)
+        if variable_length and parameters is not None:
+            landmarks, mels = apply_normalization(landmarks, mels, parameters)
+        return (landmarks, mels, *rest), label
+
+    def prepare_batch(x, y, *targets):
+        landmarks, mels = tf.convert_to_tensor(x[0]), tf.convert_to_tensor(x[1])
+        if batch_parameters is not None:
+            landmarks, mels = apply_normalization(landmarks, mels, batch_parameters)
+        labels = tf.one_hot(y, num_emotions)
+        if targets:
+            labels = tf.concat([labels, targets[0]], axis=-1)
+        return (landmarks, mels, *(tf.convert_to_tensor(extra) for extra in x[2:])), labels
 
     def generator():
-        for video_name, emotion in metadata:
-            yield hdf5_dataset(video_name, emotion)
-
-    output_signature = (
-        (
-            tf.TensorSpec(shape=(sequence_length, num_landmarks, 3), dtype=tf.float32),
-            tf.TensorSpec(shape=(sequence_length, num_mels, mel_target_time_frames, 1), dtype=tf.float32),
-            tf.TensorSpec(shape=(sequence_length, 1), dtype=tf.int32)
-        ),
-        tf.TensorSpec(shape=(), dtype=tf.int32)
+        for index, (video_name, emotion) in enumerate(metadata):
+            if soft_targets is None:
+                yield load_sample(video_name, emotion)
+            else:
+                yield (*load_sample(video_name, emotion), soft_targets[index])
+
+    length = None if variable_length else sequence_length
+    input_signature = (
+        tf.TensorSpec(shape=(length, num_landmarks, 3), dtype=tf.float32),
+        tf.TensorSpec(shape=(length, num_mels, mel_target_time_frames, 1), dtype=tf.float32),
+        tf.TensorSpec(shape=(length, 1), dtype=tf.int32)
     )
+    if sequence_lengths:
+        input_signature += (tf.TensorSpec(shape=(), dtype=tf.int32),)
+    output_signature = (input_signature, tf.TensorSpec(shape=(), dtype=tf.int32))
+    if soft_targets is not None:
+        output_signature += (tf.TensorSpec(shape=(num_emotions,), dtype=tf.float32),)
 
     dataset = tf.data.Dataset.from_generator(generator, output_signature=output_signature)
     dataset = dataset.shuffle(buffer_size=len(metadata))
-    dataset = dataset.batch(batch_size)
-    dataset = dataset.map(lambda x, y: ((tf.convert_to_tensor(x[0]), tf.convert_to_tensor(x[1]), tf.convert_to_tensor(x[2])), tf.one_hot(y, num_emotions)), num_parallel_calls=tf.data.AUTOTUNE)
+    if variable_length:
+        # Longer samples than the last boundary share the last bucket
+        boundaries = list(range(bucket_width, (max_length or 512) + 1, bucket_width))
+        dataset = dataset.bucket_by_sequence_length(lambda x, *_: tf.shape(x[0])[0], boundaries,
+                                                    [batch_size] * (len(boundaries) + 1))
+    else:
+        dataset = dataset.batch(batch_size)
+    dataset = dataset.map(prepare_batch, num_parallel_calls=tf.data.AUTOTUNE)
     dataset = dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
     dataset = dataset.cache()
     dataset = dataset.repeat()
+    if augmentation is not None:
+        from Augmentation import BatchAugmenter
+
+        # The batch number seeds each batch's draws
+        dataset = dataset.enumerate().map(BatchAugmenter(augmentation, parameters), num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
 
     return dataset
 
-if __name__ == "__main__":
+def train(HDF5_file_path, batch_size=8, epochs=1000, logdir=None, checkpoint_dir=None,
+          distributed=False, seed=None, throughput_report=None, metrics_out=None, normalization='dataset', stats_workers=1,
+          augmentation=None, variable_length=False, max_length=None):
+    """
+    Train the emotion classifier on the merged HDF5 dataset.
+    
+    In distributed mode the cluster is read from TF_CONFIG; batch_size is the per-worker
+    batch size, the metadata is sharded across workers, and only the chief keeps
+    checkpoints and TensorBoard logs.
+    
+    Parameters:
+    HDF5_file_path (str): The path to the merged HDF5 file or virtual dataset file.
+    batch_size (int): The batch size per worker.
+    epochs (int): The number of epochs to train for.
+    logdir (str): The TensorBoard log directory, timestamped under logs/scalars/ when None.
+    checkpoint_dir (str): Optional directory for per-epoch checkpoints, kept with the model's architecture;
+        training resumes from the latest one.
+    distributed (bool): Whether to train with MultiWorkerMirroredStrategy.
+    seed (int): The seed of the train/test split, required to be identical on every worker. It is recorded
+        in the checkpoint directory, whose seed a resumed run keeps; 0 when None with dataset normalisation,
+        distributed training or a checkpoint directory, so the split and its statistics stay the same.
+    throughput_report (str): Optional path of a JSON file receiving this worker's samples/s.
+    metrics_out (str): Optional path the per-stage timings are written to, as Prometheus text for .prom/.txt and JSON otherwise.
+    normalization (str): 'dataset' to normalise with statistics of the training split, stored in the
+        dataset and the checkpoint directory, whose statistics a resumed run keeps; 'per-frame' to
+        z-score each mel segment on its own.
+    stats_workers (int): The worker processes computing the statistics when the dataset has none for this split.
+    augmentation (dict): Optional augmentation settings for the training batches, see Augmentation.DEFAULT_AUGMENTATION.
+    variable_length (bool): Whether to train on sequences of their own length, bucketed by length and
+        masked, rather than padded or truncated to sequence_length.
+    max_length (int): The number of frames variable-length samples are truncated to, None to keep every frame.
+    
+    Returns:
+    tf.keras.Model: The trained model.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+    from Distributed_Training import (create_strategy, get_worker_info, shard_metadata, disable_auto_shard,
+                                      ChiefCheckpoint, ThroughputCallback)
+
+    # The strategy has to be created before any other TensorFlow op runs
+    strategy = create_strategy(distributed)
+    worker_info = get_worker_info() if distributed else get_worker_info({})
+
+    model_kwargs = {'sequence_length': None if variable_length else sequence_length}
+    if checkpoint_dir:
+        recorded = load_model_architecture(checkpoint_dir)
+        if recorded is not None and recorded != model_kwargs:
+            raise ValueError(f"train - the checkpoints in {checkpoint_dir} are of a model created with {recorded}, "
+                             f"not {model_kwargs}")
+        recorded_seed = load_split_seed(checkpoint_dir)
+        if recorded_seed is not None and seed is not None and recorded_seed != seed:
+            raise ValueError(f"train - the checkpoints in {checkpoint_dir} are trained on the split of seed "
+                             f"{recorded_seed}, not {seed}")
+        if recorded_seed is not None:
+            seed = recorded_seed
+    # A fresh split every run would mix test samples into training on resume and recompute the statistics
+    if seed is None and (distributed or normalization == 'dataset' or checkpoint_dir):
+        seed = 0
+    if checkpoint_dir and worker_info['is_chief']:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        save_model_architecture(checkpoint_dir, model_kwargs)
+        save_split_seed(checkpoint_dir, seed)
+
+    metadata = dataset_metadata(HDF5_file_path)
 
-    HDF5_file_path = 'E:/projects/face_model/training_data/merged_data_file.hdf5'
+    train_metadata, test_metadata = split_metadata(metadata, seed=seed)
 
-    data = HDF5_Container(HDF5_file_path)
-    metadata = [(video_data['video_name'], video_data['emotion']) for video_data in data.read_video_data()]
+    stats = None
+    if normalization == 'dataset':
+        # The checkpoints carry on with the statistics they were trained with
+        stats = load_model_stats(checkpoint_dir) if checkpoint_dir else None
+        if stats is not None and stats.get('split') != split_key(train_metadata):
+            logger.warning(f"The normalisation statistics in {checkpoint_dir} are of another training split, "
+                           "training carries on with them")
+        if stats is None:
+            # Every worker reads the dataset, so only a single process may store the statistics in it
+            stats = load_or_compute_stats(HDF5_file_path, train_metadata, stats_workers, store=not distributed)
+            if checkpoint_dir and worker_info['is_chief']:
+                save_model_stats(checkpoint_dir, stats)
 
-    train_metadata, test_metadata = split_metadata(metadata)
+    train_metadata = shard_metadata(train_metadata, worker_info)
+    test_metadata = shard_metadata(test_metadata, worker_info)
 
-    batch_size = 8  # Adjusted batch size for better utilization
-    train_dataset = create_tf_dataset(train_metadata, batch_size, HDF5_file_path)
-    test_dataset = create_tf_dataset(test_metadata, batch_size, HDF5_file_path)
+    # Each worker's pipeline yields global batches that are split evenly across the workers
+    global_batch_size = batch_size * worker_info['num_workers']
+    lengths = {'variable_length': variable_length, 'max_length': max_length}
+    train_dataset = disable_auto_shard(create_tf_dataset(train_metadata, global_batch_size, HDF5_file_path, stats,
+                                                         augmentation=augmentation, **lengths))
+    test_dataset = disable_auto_shard(create_tf_dataset(test_metadata, global_batch_size, HDF5_file_path, stats, **lengths))
 
+    # Every worker has to run the same number of steps, so they are derived from its shard
     train_steps_per_epoch = len(train_metadata) // batch_size
     test_steps_per_epoch = len(test_metadata) // batch_size
 
-    model = create_emotion_classifier()
+    with strategy.scope():
+        model = create_emotion_classifier(**model_kwargs)
 
-    logdir = "logs/scalars/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    tensorboard_callback = tf.keras.callbacks.TensorBoard(log_dir=logdir, profile_batch=0)
+    callbacks = [ThroughputCallback(batch_size, worker_info, throughput_report)]
+    start_epoch = 0
+    if checkpoint_dir:
+        checkpoint_callback = ChiefCheckpoint(checkpoint_dir, worker_info)
+        checkpoint_callback.set_model(model)
+        start_epoch = checkpoint_callback.restore(strategy)
+        callbacks.append(checkpoint_callback)
+    if worker_info['is_chief']:
+        if logdir is None:
+            logdir = "logs/scalars/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        callbacks.append(tf.keras.callbacks.TensorBoard(log_dir=logdir, profile_batch=0))
 
-    for epoch in range(1000):
-        print(f"Epoch {epoch + 1}/{1000}")
+    for epoch in range(start_epoch, epochs):
+        print(f"Epoch {epoch + 1}/{epochs}")
         epoch_start_time = time.time()
-        model.fit(train_dataset, epochs=1, steps_per_epoch=train_steps_per_epoch, validation_data=test_dataset, validation_steps=test_steps_per_epoch, callbacks=[tensorboard_callback])
+        model.fit(train_dataset, initial_epoch=epoch, epochs=epoch + 1, steps_per_epoch=train_steps_per_epoch, validation_data=test_dataset, validation_steps=test_steps_per_epoch, callbacks=callbacks)
         print(f"Time taken for epoch {epoch + 1}: {time.time() - epoch_start_time:.2f} seconds")
+
+    if metrics_out:
+        Instrumentation.dump(metrics_out)
+        print(f"Metrics written to {metrics_out}")
+
+    return model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the emotion classifier.")
+    parser.add_argument('--hdf5', default='E:/projects/face_model/training_data/merged_data_file.hdf5', help="The merged HDF5 dataset.")
+    parser.add_argument('--batch-size', type=int, default=8, help="The batch size per worker.")
+    parser.add_argument('--epochs', type=int, default=1000)
+    parser.add_argument('--logdir', help="The TensorBoard log directory.")
+    parser.add_argument('--checkpoint-dir', help="Directory for per-epoch checkpoints.")
+    parser.add_argument('--distributed', action='store_true', help="Train with MultiWorkerMirroredStrategy using TF_CONFIG.")
+    parser.add_argument('--seed', type=int, help="Seed of the train/test split, 0 by default with dataset normalisation "
+                                                 "or checkpoints; a resumed run keeps the checkpoints' seed.")
+    parser.add_argument('--throughput-report', help="JSON file receiving this worker's samples/s.")
+    parser.add_argument('--metrics-out', help="Write per-stage timings to this file, as Prometheus text for .prom/.txt and JSON otherwise.")
+    parser.add_argument('--log-level', default='WARNING', help="DEBUG shows per-sample messages.")
+    parser.add_argument('--normalization', choices=['dataset', 'per-frame'], default='dataset',
+                        help="Normalise with statistics of the training split, or z-score each mel segment on its own.")
+    parser.add_argument('--stats-workers', type=int, default=1, help="Processes computing the normalisation statistics.")
+    parser.add_argument('--augment', action='store_true', help="Augment the training batches with the default settings.")
+    parser.add_argument('--augmentation-config', help="JSON file overriding some of the augmentation settings, implies --augment.")
+    parser.add_argument('--variable-length', action='store_true',
+                        help="Train on each clip's own frames, bucketed by length and masked, instead of padding to 30.")
+    parser.add_argument('--max-length', type=int, help="Truncate variable-length clips to this many frames.")
+    parser.add_argument('--list-devices', action='store_true', help="List the devices TensorFlow can use and exit.")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    if args.list_devices:
+        # Listing devices initialises TensorFlow, which MultiWorkerMirroredStrategy does not allow before it is created
+        print(list_devices())
+        raise SystemExit(0)
+
+    augmentation = None
+    if args.augment or args.augmentation_config:
+        from Augmentation import load_augmentation_config
+        augmentation = load_augmentation_config(args.augmentation_config)
+
+    train(args.hdf5, batch_size=args.batch_size, epochs=args.epochs, logdir=args.logdir,
+          checkpoint_dir=args.checkpoint_dir, distributed=args.distributed, seed=args.seed,
+          throughput_report=args.throughput_report, metrics_out=args.metrics_out,
+          normalization=args.normalization, stats_workers=args.stats_workers, augmentation=augmentation,
+          variable_length=args.variable_length, max_length=args.max_length)
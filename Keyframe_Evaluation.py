@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:47:50 2026
+
+Measure the speed/quality trade-off of keyframed landmark detection against full
+per-frame detection.
+
+Landmark error: every frame of the given videos is detected once, then each
+keyframing configuration is replayed over those detections and the interpolated
+landmarks are compared with the detected ones. Each configuration is also run for
+real with detect_with_keyframes to measure its speedup.
+
+Downstream accuracy: with --model and --hdf5, the landmarks of every sample of a
+merged dataset (extracted with full detection) are replaced by their keyframed
+interpolation, and the model's accuracy on both versions is compared. Stored files
+have no frames, so the frame-difference criterion is not used there.
+
+Example:
+    python Keyframe_Evaluation.py --videos Actor_03/*.mp4 --landmark-model face_landmarker.task \
+        --configs stride:2 stride:3 adaptive:diff=4,velocity=0.004,max_gap=8 \
+        --model checkpoints --hdf5 merged.hdf5 --output keyframes.json
+
+@author: Jayyy
+"""
+import argparse
+import json
+import time
+
+import h5py
+import numpy as np
+
+from Landmark_Keyframer import (KeyframeSelector, detect_with_keyframes, fill_from_keyframes, frame_thumbnail,
+                                landmarks_to_array, parse_keyframe_config, select_keyframes)
+
+DEFAULT_CONFIGS = ['stride:2', 'stride:3', 'stride:5', 'adaptive:diff=4,velocity=0.004,max_gap=8']
+
+
+def detect_every_frame(video_path, landmark_model_path):
+    """
+    Detect the landmarks of every frame of a video.
+
+    Parameters:
+    video_path (str): The path to the video.
+    landmark_model_path (str): The path to the facial landmark model.
+
+    Returns:
+    dict: The landmarks and thumbnail of every frame, the frame size and the detection time.
+    """
+    from Face_Landmark_Generator import landmarker_pool
+    from Video_Controller import VideoController
+
+    video_controller = VideoController(video_path)
+    landmarks = []
+    thumbnails = []
+    detect_seconds = 0.0
+    frame_size = None
+    with landmarker_pool.acquire(landmark_model_path) as landmark_gen:
+        for frame, timestamp, _ in video_controller.process_video():
+            frame_size = frame.shape[1], frame.shape[0]
+            thumbnails.append(frame_thumbnail(frame))
+            start_time = time.perf_counter()
+            landmarks.append(landmarks_to_array(landmark_gen.find_landmarks(frame, timestamp)))
+            detect_seconds += time.perf_counter() - start_time
+    return {'landmarks': landmarks, 'thumbnails': thumbnails, 'frame_size': frame_size, 'detect_seconds': detect_seconds}
+
+def landmark_error(detections, config):
+    """
+    Compare keyframed landmarks with full detection on one video.
+
+    Parameters:
+    detections (dict): The full detection of the video, from detect_every_frame.
+    config (dict): KeyframeSelector arguments.
+
+    Returns:
+    dict: The number of frames and keyframes, and the per-landmark errors of the interpolated frames.
+    """
+    landmarks = detections['landmarks']
+    num_frames = len(landmarks)
+    keyframes = select_keyframes(KeyframeSelector(**config), num_frames, landmarks, detections['thumbnails'])
+    filled, _ = fill_from_keyframes(num_frames, keyframes, [landmarks[position] for position in keyframes])
+
+    width, height = detections['frame_size']
+    errors = []
+    for position in set(range(num_frames)) - set(keyframes):
+        if landmarks[position] is None or filled[position] is None:
+            continue
+        difference = (filled[position][:, :2] - landmarks[position][:, :2]) * [width, height]
+        errors.append(np.linalg.norm(difference, axis=1))
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    return {'frames': num_frames, 'keyframes': len(keyframes), 'errors_px': errors}
+
+def timed_keyframe_detection(video_path, landmark_model_path, config):
+    """
+    Run keyframed detection for real and time it.
+
+    Parameters:
+    video_path (str): The path to the video.
+    landmark_model_path (str): The path to the facial landmark model.
+    config (dict): KeyframeSelector arguments.
+
+    Returns:
+    float: The seconds taken, decoding included.
+    """
+    from Face_Landmark_Generator import landmarker_pool
+    from Video_Controller import VideoController
+
+    # The model is loaded once for every run, and not timed
+    with landmarker_pool.acquire(landmark_model_path) as landmark_gen:
+        start_time = time.perf_counter()
+        detect_with_keyframes(landmark_gen, VideoController(video_path), KeyframeSelector(**config))
+        return time.perf_counter() - start_time
+
+def evaluate_landmarks(video_paths, landmark_model_path, configs):
+    """
+    Measure the landmark error and speedup of each keyframing configuration.
+
+    Parameters:
+    video_paths (list): The videos.
+    landmark_model_path (str): The path to the facial landmark model.
+    configs (list): Configuration strings, see parse_keyframe_config.
+
+    Returns:
+    dict: Configuration -> keyframe fraction, error statistics in pixels and speedup.
+    """
+    every_frame_config = {'mode': 'every'}
+    detections = [detect_every_frame(video_path, landmark_model_path) for video_path in video_paths]
+    baseline_seconds = sum(timed_keyframe_detection(path, landmark_model_path, every_frame_config) for path in video_paths)
+
+    results = {}
+    for text in configs:
+        config = parse_keyframe_config(text)
+        measured = [landmark_error(video, config) for video in detections]
+        errors = np.concatenate([video['errors_px'] for video in measured])
+        seconds = sum(timed_keyframe_detection(path, landmark_model_path, config) for path in video_paths)
+        results[text] = {
+            'keyframe_fraction': sum(video['keyframes'] for video in measured) / sum(video['frames'] for video in measured),
+            'mean_error_px': float(errors.mean()) if errors.size else 0.0,
+            'p95_error_px': float(np.percentile(errors, 95)) if errors.size else 0.0,
+            'max_error_px': float(errors.max()) if errors.size else 0.0,
+            'seconds': seconds,
+            'speedup': baseline_seconds / seconds if seconds > 0 else None,
+        }
+    return {'videos': len(video_paths), 'every_frame_seconds': baseline_seconds, 'configs': results}
+
+def keyframed_landmarks(landmarks, num_frames, config):
+    """
+    Replace the landmarks of a model input by their keyframed interpolation.
+
+    Parameters:
+    landmarks (np.ndarray): The (sequence_length, 478, 3) landmarks of a sample, padded with zeros.
+    num_frames (int): The number of real frames in the sample.
+    config (dict): KeyframeSelector arguments.
+
+    Returns:
+    tuple: The new landmarks and the number of keyframes.
+    """
+    num_frames = min(num_frames, len(landmarks))
+    frames = [landmarks[position] for position in range(num_frames)]
+    keyframes = select_keyframes(KeyframeSelector(**config), num_frames, frames)
+    filled, _ = fill_from_keyframes(num_frames, keyframes, [frames[position] for position in keyframes])
+    result = landmarks.copy()
+    result[:num_frames] = np.stack(filled)
+    return result, len(keyframes)
+
+def evaluate_accuracy(model_path, hdf5_path, configs, batch_size=8):
+    """
+    Compare the model's accuracy on full and keyframed landmarks.
+
+    Parameters:
+    model_path (str): A saved model or checkpoint directory, see Interface_Model.load_trained_model.
+    hdf5_path (str): A merged HDF5 dataset extracted with full detection.
+    configs (list): Configuration strings, see parse_keyframe_config.
+    batch_size (int): The prediction batch size.
+
+    Returns:
+    dict: The full-detection accuracy, and per configuration the accuracy and agreement with full detection.
+    """
+    from Interface_Model import load_emotion_group, load_trained_model, model_inputs, sequence_length
+    from Normalization_Stats import affine_parameters, apply_normalization, load_model_stats
+
+    # Samples are normalised the way the model was trained
+    stats = load_model_stats(model_path)
+    samples = []
+    with h5py.File(hdf5_path, 'r') as file:
+        for video_name in file.keys():
+            for emotion, emotion_group in file[video_name].items():
+                samples.append((load_emotion_group(emotion_group, stats), len(emotion_group), int(emotion) - 1))
+
+    model = load_trained_model(model_path)
+    labels = np.array([label for _, _, label in samples])
+    mels = np.stack([inputs[1] for inputs, _, _ in samples])
+    phonemes = np.stack([inputs[2] for inputs, _, _ in samples])
+    lengths = np.minimum([num_frames for _, num_frames, _ in samples], sequence_length)
+
+    def predict(landmarks):
+        model_mels = mels
+        if stats is not None:
+            landmarks, model_mels = apply_normalization(landmarks, mels, affine_parameters(stats))
+        inputs = model_inputs(model, landmarks, model_mels, phonemes, lengths)
+        return np.argmax(model.predict(inputs, batch_size=batch_size, verbose=0), axis=1)
+
+    full_predictions = predict(np.stack([inputs[0] for inputs, _, _ in samples]))
+    results = {'samples': len(samples), 'full_accuracy': float(np.mean(full_predictions == labels)), 'configs': {}}
+    for text in configs:
+        config = parse_keyframe_config(text)
+        keyframed = [keyframed_landmarks(inputs[0], num_frames, config) for inputs, num_frames, _ in samples]
+        predictions = predict(np.stack([landmarks for landmarks, _ in keyframed]))
+        results['configs'][text] = {
+            'keyframe_fraction': sum(keyframes for _, keyframes in keyframed) /
+                                 sum(min(num_frames, len(inputs[0])) for inputs, num_frames, _ in samples),
+            'accuracy': float(np.mean(predictions == labels)),
+            'agreement_with_full': float(np.mean(predictions == full_predictions)),
+        }
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the speed/quality trade-off of keyframed landmark detection.")
+    parser.add_argument('--videos', nargs='*', default=[], help="Videos for the landmark error and speedup.")
+    parser.add_argument('--landmark-model', help="The MediaPipe face_landmarker.task model, needed with --videos.")
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS,
+                        help="Keyframing configurations, e.g. stride:3 or adaptive:diff=4,velocity=0.004,max_gap=8.")
+    parser.add_argument('--model', help="A trained model or checkpoint directory, for the downstream accuracy.")
+    parser.add_argument('--hdf5', help="A merged HDF5 dataset extracted with full detection, used with --model.")
+    parser.add_argument('--output', default='keyframe_evaluation.json')
+    args = parser.parse_args()
+
+    report = {'configs': args.configs}
+    if args.videos:
+        if not args.landmark_model:
+            parser.error("--videos needs --landmark-model")
+        report['landmarks'] = evaluate_landmarks(args.videos, args.landmark_model, args.configs)
+        for text, result in report['landmarks']['configs'].items():
+            print(f"{text:>40}: {result['keyframe_fraction']:.0%} keyframes, {result['speedup']:.2f}x faster, "
+                  f"error mean {result['mean_error_px']:.2f} px, p95 {result['p95_error_px']:.2f} px")
+    if args.model and args.hdf5:
+        report['accuracy'] = evaluate_accuracy(args.model, args.hdf5, args.configs)
+        print(f"{'every frame':>40}: accuracy {report['accuracy']['full_accuracy']:.3f}")
+        for text, result in report['accuracy']['configs'].items():
+            print(f"{text:>40}: accuracy {result['accuracy']:.3f}, agrees with full detection on "
+                  f"{result['agreement_with_full']:.0%} of samples")
+
+    with open(args.output, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    print(f"Report written to {args.output}")
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 21:03:25 2026
+
+Keyframed landmark detection: the FaceLandmarker runs only on keyframes and the
+landmarks of the frames in between are filled in by linear interpolation.
+
+Keyframes are chosen either by a fixed stride, or adaptively when the frame has
+changed since the last keyframe (mean absolute difference of small grayscale
+thumbnails), when the landmarks are predicted to have moved more than a threshold
+(landmark velocity between the last two keyframes), or when the gap reaches max_gap.
+The first and last frames are always keyframes.
+
+@author: Jayyy
+"""
+import cv2
+import numpy as np
+
+from Instrumentation import timer, count
+
+KEYFRAME_MODES = ('every', 'stride', 'adaptive')
+THUMBNAIL_SIZE = (64, 36)
+
+
+def frame_thumbnail(frame, rgb=False):
+    """
+    Shrink a frame to a small grayscale thumbnail for frame differencing.
+
+    Parameters:
+    frame (np.ndarray): The video frame.
+    rgb (bool): Whether the frame is RGB rather than BGR.
+
+    Returns:
+    np.ndarray: The float32 thumbnail.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+def landmarks_to_array(face_landmarks_list):
+    """
+    Convert the first face found by the FaceLandmarker to an array.
+
+    Parameters:
+    face_landmarks_list (list): The faces returned by find_landmarks.
+
+    Returns:
+    np.ndarray: The (478, 3) landmarks, or None when no face was found.
+    """
+    if not face_landmarks_list:
+        return None
+    return np.array([[landmark.x, landmark.y, landmark.z] for landmark in face_landmarks_list[0]], dtype=np.float64)
+
+class KeyframeSelector:
+    """
+    Decides, frame by frame, whether the landmarks have to be detected.
+    """
+    def __init__(self, mode='stride', stride=3, diff_threshold=4.0, velocity_threshold=0.004, max_gap=8):
+        """
+        Initialize a KeyframeSelector instance.
+
+        Parameters:
+        mode (str): 'every' frame, a fixed 'stride', or 'adaptive'.
+        stride (int): The distance between keyframes in 'stride' mode.
+        diff_threshold (float): In 'adaptive' mode, the mean absolute grayscale difference (0-255) from the
+            last keyframe above which a frame becomes a keyframe; None to disable.
+        velocity_threshold (float): In 'adaptive' mode, the predicted mean landmark displacement since the
+            last keyframe, in normalised image coordinates, above which a frame becomes a keyframe; None to disable.
+        max_gap (int): In 'adaptive' mode, the largest distance between keyframes.
+        """
+        if mode not in KEYFRAME_MODES:
+            raise ValueError(f"KeyframeSelector - unknown mode {mode}, expected one of {KEYFRAME_MODES}")
+        self.mode = mode
+        self.stride = max(int(stride), 1)
+        self.diff_threshold = diff_threshold
+        self.velocity_threshold = velocity_threshold
+        self.max_gap = max(int(max_gap), 1)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous keyframes, before starting a new video.
+        """
+        self.last_position = None
+        self.last_landmarks = None
+        self.last_thumbnail = None
+        self.velocity = 0.0
+
+    @property
+    def needs_thumbnails(self):
+        return self.mode == 'adaptive' and self.diff_threshold is not None
+
+    def is_keyframe(self, position, thumbnail=None):
+        """
+        Decide whether a frame is a keyframe.
+
+        Parameters:
+        position (int): The zero-based position of the frame in the video.
+        thumbnail (np.ndarray): The frame's thumbnail, used by 'adaptive' mode with a diff_threshold.
+
+        Returns:
+        bool: Whether the landmarks have to be detected on this frame.
+        """
+        if self.mode == 'every' or self.last_position is None:
+            return True
+        gap = position - self.last_position
+        if self.mode == 'stride':
+            return gap >= self.stride
+
+        if gap >= self.max_gap:
+            return True
+        if self.velocity_threshold is not None and self.velocity * gap > self.velocity_threshold:
+            return True
+        if self.needs_thumbnails and thumbnail is not None and self.last_thumbnail is not None:
+            return float(np.mean(np.abs(thumbnail - self.last_thumbnail))) > self.diff_threshold
+        return False
+
+    def add_keyframe(self, position, landmarks, thumbnail=None):
+        """
+        Record the landmarks detected on a keyframe.
+
+        Parameters:
+        position (int): The zero-based position of the frame in the video.
+        landmarks (np.ndarray): The (478, 3) landmarks, or None when no face was found.
+        thumbnail (np.ndarray): The frame's thumbnail.
+        """
+        if landmarks is not None and self.last_landmarks is not None and position > self.last_position:
+            displacement = np.linalg.norm(landmarks[:, :2] - self.last_landmarks[:, :2], axis=1).mean()
+            self.velocity = displacement / (position - self.last_position)
+        if landmarks is not None:
+            self.last_landmarks = landmarks
+        self.last_position = position
+        self.last_thumbnail = thumbnail
+
+def interpolate_landmarks(positions, landmarks, num_frames):
+    """
+    Linearly interpolate the landmarks of every frame from those of the keyframes.
+
+    Frames before the first or after the last keyframe take its landmarks.
+
+    Parameters:
+    positions (np.ndarray): The increasing positions of the keyframes with a face.
+    landmarks (np.ndarray): The (K, 478, 3) landmarks of those keyframes.
+    num_frames (int): The number of frames in the video.
+
+    Returns:
+    np.ndarray: The (num_frames, 478, 3) landmarks.
+    """
+    positions = np.asarray(positions)
+    frames = np.arange(num_frames)
+    previous = np.clip(np.searchsorted(positions, frames, side='right') - 1, 0, len(positions) - 1)
+    following = np.minimum(previous + 1, len(positions) - 1)
+
+    span = positions[following] - positions[previous]
+    weight = np.where(span > 0, (frames - positions[previous]) / np.maximum(span, 1), 0.0)
+    weight = np.clip(weight, 0.0, 1.0)[:, None, None]
+    return landmarks[previous] * (1 - weight) + landmarks[following] * weight
+
+def select_keyframes(selector, num_frames, landmarks, thumbnails=None):
+    """
+    Replay keyframe selection over landmarks already detected on every frame.
+
+    Used to evaluate a keyframing configuration without running the detector again.
+
+    Parameters:
+    selector (KeyframeSelector): The selector, reset before use.
+    num_frames (int): The number of frames.
+    landmarks (list): The (478, 3) landmarks of every frame, None where no face was found.
+    thumbnails (list): The thumbnails of every frame, for 'adaptive' mode with a diff_threshold.
+
+    Returns:
+    list: The keyframe positions.
+    """
+    selector.reset()
+    keyframes = []
+    for position in range(num_frames):
+        thumbnail = thumbnails[position] if thumbnails is not None else None
+        if selector.is_keyframe(position, thumbnail) or position == num_frames - 1:
+            selector.add_keyframe(position, landmarks[position], thumbnail)
+            keyframes.append(position)
+    return keyframes
+
+def fill_from_keyframes(num_frames, keyframes, keyframe_landmarks):
+    """
+    Build the landmarks and detected flags of every frame from the keyframe detections.
+
+    Parameters:
+    num_frames (int): The number of frames.
+    keyframes (list): The keyframe positions.
+    keyframe_landmarks (list): The landmarks detected on each keyframe, None where no face was found.
+
+    Returns:
+    tuple: The list of (478, 3) landmarks per frame (None when no keyframe has a face) and the detected flags.
+    """
+    detected = np.zeros(num_frames, dtype=bool)
+    anchors = [(position, found) for position, found in zip(keyframes, keyframe_landmarks) if found is not None]
+    if not anchors:
+        return [None] * num_frames, detected
+
+    positions = np.array([position for position, _ in anchors])
+    detected[positions] = True
+    filled = interpolate_landmarks(positions, np.stack([found for _, found in anchors]), num_frames)
+    return list(filled), detected
+
+def release_pending(pending, before, after):
+    """
+    Interpolate the landmarks of the frames waiting for the keyframe after them.
+
+    Frames before the first keyframe with a face take its landmarks, and frames after
+    the last one take the landmarks of the last, as in interpolate_landmarks.
+
+    Parameters:
+    pending (list): The (position, frame_index, timestamp) of the waiting frames, in order.
+    before (tuple): The (position, landmarks) of the last keyframe with a face before them, None if there is none.
+    after (tuple): The (position, landmarks) of the keyframe with a face after them, None at the end of the video.
+
+    Yields:
+    tuple: (frame_index, timestamp, landmarks, detected) for each waiting frame, landmarks being None when
+        no keyframe has a face.
+    """
+    for position, frame_index, timestamp in pending:
+        if after is not None and position == after[0]:
+            yield frame_index, timestamp, after[1], True
+        elif before is None or after is None:
+            anchor = before or after
+            yield frame_index, timestamp, anchor[1] if anchor else None, False
+        else:
+            weight = min(max((position - before[0]) / max(after[0] - before[0], 1), 0.0), 1.0)
+            yield frame_index, timestamp, before[1] * (1 - weight) + after[1] * weight, False
+
+def iter_keyframed_landmarks(landmark_gen, video_controller, selector):
+    """
+    Decode a video and detect its landmarks on keyframes only, yielding every frame as soon as it can be interpolated.
+
+    Only the positions of the frames since the last keyframe with a face are held, so
+    memory does not grow with the length of the video.
+
+    Parameters:
+    landmark_gen (FaceLandMarkGenerator): The landmark generator.
+    video_controller (VideoController): The video to read.
+    selector (KeyframeSelector): The keyframe selector.
+
+    Yields:
+    tuple: (frame_index, timestamp, landmarks, detected) for every frame in order, landmarks being a (478, 3)
+        array, or None when no face was found on any keyframe.
+    """
+    selector.reset()
+    pending = []
+    anchor = None
+    num_frames = 0
+    num_keyframes = 0
+    previous_frame = None
+    rgb = video_controller.rgb
+
+    for position, (frame, timestamp, frame_index) in enumerate(video_controller.process_video()):
+        num_frames += 1
+        pending.append((position, frame_index, timestamp))
+        thumbnail = frame_thumbnail(frame, rgb) if selector.needs_thumbnails else None
+        if selector.is_keyframe(position, thumbnail):
+            landmarks = landmarks_to_array(landmark_gen.find_landmarks(frame, timestamp, rgb=rgb))
+            selector.add_keyframe(position, landmarks, thumbnail)
+            num_keyframes += 1
+            previous_frame = None
+            if landmarks is not None:
+                yield from release_pending(pending, anchor, (position, landmarks))
+                anchor = (position, landmarks)
+                pending = []
+        else:
+            # Kept in case it is the last frame, which is always detected
+            previous_frame = frame
+
+    if previous_frame is not None:
+        position, _, timestamp = pending[-1]
+        landmarks = landmarks_to_array(landmark_gen.find_landmarks(previous_frame, timestamp, rgb=rgb))
+        num_keyframes += 1
+        if landmarks is not None:
+            yield from release_pending(pending, anchor, (position, landmarks))
+            anchor = (position, landmarks)
+            pending = []
+    yield from release_pending(pending, anchor, None)
+
+    count('landmark_frames', num_frames)
+    count('landmark_keyframes', num_keyframes)
+
+@timer('keyframed_landmarks')
+def detect_with_keyframes(landmark_gen, video_controller, selector):
+    """
+    Decode a video and detect its landmarks on keyframes only, interpolating the others.
+
+    Parameters:
+    landmark_gen (FaceLandMarkGenerator): The landmark generator.
+    video_controller (VideoController): The video to read.
+    selector (KeyframeSelector): The keyframe selector.
+
+    Returns:
+    list: (frame_index, timestamp, landmarks, detected) for every frame, see iter_keyframed_landmarks.
+    """
+    return list(iter_keyframed_landmarks(landmark_gen, video_controller, selector))
+
+def parse_keyframe_config(text):
+    """
+    Parse a keyframing configuration such as 'stride:3' or 'adaptive:diff=4,velocity=0.004,max_gap=8'.
+
+    Parameters:
+    text (str): The configuration.
+
+    Returns:
+    dict: Keyword arguments for KeyframeSelector.
+    """
+    mode, _, settings = text.partition(':')
+    names = {'stride': 'stride', 'diff': 'diff_threshold', 'velocity': 'velocity_threshold', 'max_gap': 'max_gap'}
+    config = {'mode': mode}
+    if mode == 'stride' and settings and '=' not in settings:
+        settings = 'stride=' + settings
+    for setting in filter(None, settings.split(',')):
+        name, _, value = setting.partition('=')
+        if name not in names:
+            raise ValueError(f"parse_keyframe_config - unknown setting {name} in {text}")
+        config[names[name]] = None if value == 'none' else float(value)
+    return config
+
+def add_keyframe_arguments(parser):
+    """
+    Add the keyframing options to a command line parser.
+
+    Parameters:
+    parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument('--keyframes', metavar='CONFIG',
+                        help="Detect landmarks on keyframes only, e.g. 'stride:3' or "
+                             "'adaptive:diff=4,velocity=0.004,max_gap=8'. Every frame is detected by default.")
+
+def keyframe_options(args):
+    """
+    Read the keyframing options added by add_keyframe_arguments.
+
+    Parameters:
+    args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+    dict: Keyword arguments for KeyframeSelector, or None to detect every frame.
+    """
+    return parse_keyframe_config(args.keyframes) if args.keyframes else None
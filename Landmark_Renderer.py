@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 02:14:40 2026
+
+Draw the face mesh over every frame of a video and write the annotated video, for
+reviewing the extracted landmarks and the model's prediction. MediaPipe's face mesh
+connections are turned into index arrays once; each colour of MediaPipe's default
+style is then drawn with a single cv2.polylines call on the frame's pixel coordinates,
+instead of a protobuf and a Python loop over the connections per frame. The annotated
+frames are encoded through one ffmpeg pipe, with the source video's audio.
+
+The landmarks come from the video's HDF5 file written during extraction, or are found
+with the landmarker when only --landmark-model is given. With --model, the predicted
+emotion of the video is written on every frame.
+
+Example:
+    python Landmark_Renderer.py --video Actor_01/01-01-03-01-01-01-01.mp4 --features training_data/per_video/01-01-03-01-01-01-01/01-01-03-01-01-01-01.hdf5 --model model.keras --output review.mp4
+
+@author: Jayyy
+"""
+import argparse
+import contextlib
+import functools
+import time
+
+import cv2
+import h5py
+import numpy as np
+
+from Instrumentation import timer
+from Storage_Controller_Model import read_frames
+from Training_Frame import landmarks_array
+from Video_Controller import VideoController, VideoWriter
+
+# The MediaPipe connection sets drawn in each (BGR) colour and thickness, in drawing order,
+# as in MediaPipe's default tessellation, contours and irises styles
+MESH_STYLES = [
+    (('FACEMESH_TESSELATION',), (128, 128, 128), 1),
+    (('FACEMESH_FACE_OVAL', 'FACEMESH_LIPS'), (224, 224, 224), 2),
+    (('FACEMESH_LEFT_EYE', 'FACEMESH_LEFT_EYEBROW', 'FACEMESH_LEFT_IRIS'), (48, 255, 48), 2),
+    (('FACEMESH_RIGHT_EYE', 'FACEMESH_RIGHT_EYEBROW', 'FACEMESH_RIGHT_IRIS'), (48, 48, 255), 2),
+]
+# Fractional bits of the pixel coordinates given to OpenCV, so the lines keep sub-pixel positions
+SHIFT = 4
+
+
+@functools.lru_cache(maxsize=None)
+def connection_arrays():
+    """
+    Build the landmark index pairs of each style in MESH_STYLES, once per process.
+
+    Returns:
+    list: A (num_connections, 2) index array per style.
+    """
+    from mediapipe.python.solutions import face_mesh_connections
+
+    arrays = []
+    for names, _, _ in MESH_STYLES:
+        connections = set().union(*(getattr(face_mesh_connections, name) for name in names))
+        arrays.append(np.array(sorted(connections), dtype=np.intp))
+    return arrays
+
+def read_landmarks(features_path):
+    """
+    Read the landmarks of every frame from a video's HDF5 file, as written during extraction.
+
+    Parameters:
+    features_path (str): The per-video HDF5 file.
+
+    Returns:
+    dict: Frame index -> (478, 3) landmarks, for the frames with a face.
+    """
+    with h5py.File(features_path, 'r') as file:
+        emotion = list(file.keys())[0]  # Since there is only one emotion
+        frames = read_frames(file[emotion])
+    # Frames without a face are stored as zeros
+    has_face = frames['landmarks'].any(axis=(1, 2))
+    return {int(frame_index): landmarks for frame_index, landmarks, found
+            in zip(frames['frame_index'], frames['landmarks'], has_face) if found}
+
+class LandmarkRenderer:
+    """
+    Draws face meshes and predictions on frames.
+    """
+    def __init__(self, tessellation=True, line_type=cv2.LINE_8):
+        """
+        Initialize a LandmarkRenderer instance.
+
+        Parameters:
+        tessellation (bool): Whether to draw the full mesh, rather than only the contours and irises.
+        line_type (int): The OpenCV line type, cv2.LINE_AA for anti-aliased lines.
+        """
+        self.styles = [(edges, colour, thickness)
+                       for edges, (_, colour, thickness) in zip(connection_arrays(), MESH_STYLES)]
+        if not tessellation:
+            self.styles = self.styles[1:]
+        self.line_type = line_type
+
+    @timer('render_landmarks')
+    def draw_landmarks(self, frame, landmarks):
+        """
+        Draw face meshes on a frame, in place.
+
+        Parameters:
+        frame (np.ndarray): The frame.
+        landmarks (np.ndarray): A face's (478, 3) landmarks normalised to the frame, or (faces, 478, 3).
+
+        Returns:
+        np.ndarray: The frame.
+        """
+        landmarks = np.asarray(landmarks)
+        if landmarks.ndim == 2:
+            landmarks = landmarks[None]
+        height, width = frame.shape[:2]
+        scale = np.array([width, height]) * (1 << SHIFT)
+        for face in landmarks:
+            points = np.rint(face[:, :2] * scale).astype(np.int32)
+            for edges, colour, thickness in self.styles:
+                # One polyline of two points per connection
+                cv2.polylines(frame, points[edges], False, colour, thickness, self.line_type, SHIFT)
+        return frame
+
+    def draw_prediction(self, frame, prediction):
+        """
+        Write the predicted emotion and its probability in the top-left corner of a frame, in place.
+
+        Parameters:
+        frame (np.ndarray): The frame.
+        prediction (dict): The prediction, see Prediction_Cache.predict_features.
+
+        Returns:
+        np.ndarray: The frame.
+        """
+        name = prediction['emotion_name']
+        text = f"{name} {prediction['probabilities'][name]:.2f}"
+        font_scale = max(frame.shape[0] / 720, 0.4)
+        thickness = max(int(round(2 * font_scale)), 1)
+        margin = int(10 * font_scale)
+        (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        cv2.rectangle(frame, (0, 0), (text_width + 2 * margin, text_height + baseline + 2 * margin), (0, 0, 0), cv2.FILLED)
+        cv2.putText(frame, text, (margin, margin + text_height), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    (255, 255, 255), thickness, cv2.LINE_AA)
+        return frame
+
+def render_video(video_path, output_path, features_path=None, landmark_model_path=None, prediction=None,
+                 tessellation=True, line_type=cv2.LINE_8, width=None, audio=True, crf=23, preset='ultrafast'):
+    """
+    Write a copy of a video with the face mesh drawn on every frame.
+
+    Parameters:
+    video_path (str): The source video.
+    output_path (str): The annotated video to write.
+    features_path (str): The video's HDF5 file to take the landmarks from.
+    landmark_model_path (str): The facial landmark model, to find the landmarks when there is no features_path.
+    prediction (dict): Optional prediction written on every frame, see Prediction_Cache.predict_features.
+    tessellation (bool): Whether to draw the full mesh, rather than only the contours and irises.
+    line_type (int): The OpenCV line type, cv2.LINE_AA for anti-aliased lines.
+    width (int): The width to render at, keeping the aspect ratio; None for the full resolution.
+    audio (bool): Whether to copy the source video's audio.
+    crf (int): The x264 quality, lower is better.
+    preset (str): The x264 speed preset.
+
+    Returns:
+    dict: The frames written, the seconds taken and the rendering speed relative to real time.
+    """
+    if features_path:
+        stored_landmarks = read_landmarks(features_path)
+        landmark_gen = contextlib.nullcontext()
+    elif landmark_model_path:
+        from Face_Landmark_Generator import FaceLandMarkGenerator
+        landmark_gen = FaceLandMarkGenerator(landmark_model_path)
+    else:
+        raise ValueError("render_video - needs either features_path or landmark_model_path")
+
+    renderer = LandmarkRenderer(tessellation, line_type)
+    video_controller = VideoController(video_path, width=width)
+    start_time = time.perf_counter()
+    with landmark_gen, VideoWriter(output_path, video_controller.frame_size, video_controller.fps,
+                                   audio_source=video_path if audio else None, crf=crf, preset=preset) as writer:
+        for frame, timestamp, frame_index in video_controller.process_video():
+            if features_path:
+                landmarks = stored_landmarks.get(frame_index)
+            else:
+                landmarks = landmarks_array(landmark_gen.find_landmarks(frame, timestamp))
+            if landmarks is not None:
+                renderer.draw_landmarks(frame, landmarks)
+            if prediction:
+                renderer.draw_prediction(frame, prediction)
+            writer.write(frame)
+    seconds = time.perf_counter() - start_time
+
+    return {
+        'frames': writer.frames_written,
+        'seconds': seconds,
+        'fps': writer.frames_written / seconds if seconds > 0 else None,
+        'realtime': writer.frames_written / video_controller.fps / seconds if seconds > 0 else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a video with its facial landmarks and predicted emotion drawn on.")
+    parser.add_argument('--video', required=True, help="The source video.")
+    parser.add_argument('--output', required=True, help="The annotated video to write, e.g. review.mp4.")
+    parser.add_argument('--features', help="The video's HDF5 file written during extraction, to take the landmarks from.")
+    parser.add_argument('--landmark-model', help="The MediaPipe face_landmarker.task model, to find the landmarks without --features.")
+    parser.add_argument('--model', help="A saved Keras model file or checkpoint directory; writes its prediction, needs --features.")
+    parser.add_argument('--no-tessellation', action='store_true', help="Only draw the contours and irises.")
+    parser.add_argument('--anti-alias', action='store_true', help="Draw anti-aliased lines, which is slower.")
+    parser.add_argument('--width', type=int, help="Render at this width, e.g. 640.")
+    parser.add_argument('--no-audio', action='store_true')
+    parser.add_argument('--crf', type=int, default=23)
+    parser.add_argument('--preset', default='ultrafast', help="The x264 speed preset; review copies favour speed over size.")
+    args = parser.parse_args()
+
+    if not args.features and not args.landmark_model:
+        parser.error("either --features or --landmark-model is required")
+    prediction = None
+    if args.model:
+        if not args.features:
+            parser.error("--model needs the extracted --features")
+        from Interface_Model import load_trained_model
+        from Normalization_Stats import load_model_stats
+        from Prediction_Cache import predict_features
+        prediction = predict_features(load_trained_model(args.model), args.features, load_model_stats(args.model))
+        print(f"Predicted {prediction['emotion_name']} ({prediction['probabilities'][prediction['emotion_name']]:.2f})")
+
+    result = render_video(args.video, args.output, args.features, args.landmark_model, prediction,
+                          tessellation=not args.no_tessellation, line_type=cv2.LINE_AA if args.anti_alias else cv2.LINE_8,
+                          width=args.width, audio=not args.no_audio,
+                          crf=args.crf, preset=args.preset)
+    print(f"Wrote {result['frames']} frames to {args.output} in {result['seconds']:.2f} s "
+          f"({result['fps']:.1f} fps, {result['realtime']:.1f}x real time)")
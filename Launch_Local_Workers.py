@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:21:48 2026
+
+Launch several multi-worker training processes on one Linux host to test distributed
+training and measure its scaling. For each requested worker count a localhost TF_CONFIG
+cluster is built, one Interface_Model.py --distributed process is started per worker,
+and the per-worker samples/s they report are collected into a scaling report.
+
+Example:
+    python Launch_Local_Workers.py --workers 1 2 4 --pin -- --hdf5 merged.hdf5 --epochs 3
+
+Arguments after -- are passed to every Interface_Model.py process.
+
+@author: Jayyy
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+TRAINING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Interface_Model.py')
+
+
+def find_free_ports(count):
+    """
+    Find free TCP ports on localhost.
+
+    Parameters:
+    count (int): The number of ports to find.
+
+    Returns:
+    list: The port numbers.
+    """
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('localhost', 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+def cpu_partitions(num_workers):
+    """
+    Split the CPUs available to this process evenly between the workers.
+
+    Parameters:
+    num_workers (int): The number of workers.
+
+    Returns:
+    list: A set of CPU ids for each worker.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = max(len(cpus) // num_workers, 1)
+    return [set(cpus[i * per_worker:(i + 1) * per_worker]) or set(cpus) for i in range(num_workers)]
+
+def launch_workers(num_workers, training_args, report_dir, pin=False, threads_per_worker=0):
+    """
+    Run one training process per worker on localhost and wait for them to finish.
+
+    Parameters:
+    num_workers (int): The number of workers.
+    training_args (list): Extra arguments passed to every Interface_Model.py process.
+    report_dir (str): The directory the workers write their throughput reports to.
+    pin (bool): Whether to pin each worker to its own share of the CPUs.
+    threads_per_worker (int): TensorFlow intra/inter op threads per worker, 0 for the default.
+
+    Returns:
+    list: The throughput report of each worker.
+    """
+    addresses = [f"localhost:{port}" for port in find_free_ports(num_workers)]
+    partitions = cpu_partitions(num_workers) if pin else [None] * num_workers
+
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        # Keras 3's fit cannot build models from multi-worker batches, use tf.keras 2 (tf_keras)
+        env.setdefault('TF_USE_LEGACY_KERAS', '1')
+        env['TF_CONFIG'] = json.dumps({
+            'cluster': {'worker': addresses},
+            'task': {'type': 'worker', 'index': index}
+        })
+        if threads_per_worker:
+            env['TF_NUM_INTRAOP_THREADS'] = str(threads_per_worker)
+            env['TF_NUM_INTEROP_THREADS'] = str(threads_per_worker)
+            env['OMP_NUM_THREADS'] = str(threads_per_worker)
+
+        report_path = os.path.join(report_dir, f"worker_{index}.json")
+        command = [sys.executable, TRAINING_SCRIPT, '--distributed', '--throughput-report', report_path] + training_args
+
+        cpus = partitions[index]
+        preexec_fn = (lambda cpus=cpus: os.sched_setaffinity(0, cpus)) if cpus else None
+        print(f"Starting worker {index}/{num_workers} at {addresses[index]}" + (f" on CPUs {sorted(cpus)}" if cpus else ""))
+        processes.append((subprocess.Popen(command, env=env, preexec_fn=preexec_fn), report_path))
+
+    reports = []
+    for index, (process, report_path) in enumerate(processes):
+        returncode = process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"launch_workers - worker {index} exited with code {returncode}")
+        with open(report_path, 'r') as json_file:
+            reports.append(json.load(json_file))
+    return reports
+
+def scaling_report(runs, baseline_samples_per_sec=None):
+    """
+    Summarise the throughput of each run and its scaling efficiency.
+
+    Scaling efficiency is the mean per-worker samples/s divided by the samples/s of a
+    single worker, taken from the one-worker run when present.
+
+    Parameters:
+    runs (dict): Worker count -> list of worker throughput reports.
+    baseline_samples_per_sec (float): Optional single-worker samples/s to compare against.
+
+    Returns:
+    list: A summary for each worker count.
+    """
+    if baseline_samples_per_sec is None and 1 in runs:
+        baseline_samples_per_sec = runs[1][0]['samples_per_sec']
+
+    summary = []
+    for num_workers in sorted(runs):
+        per_worker = [report['samples_per_sec'] for report in runs[num_workers]]
+        mean_per_worker = sum(per_worker) / len(per_worker)
+        entry = {
+            'num_workers': num_workers,
+            'per_worker_samples_per_sec': per_worker,
+            'mean_per_worker_samples_per_sec': mean_per_worker,
+            'total_samples_per_sec': sum(per_worker),
+            'scaling_efficiency': mean_per_worker / baseline_samples_per_sec if baseline_samples_per_sec else None,
+        }
+        summary.append(entry)
+    return summary
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    training_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, training_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Launch local multi-worker training processes and report scaling.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2], help="The worker counts to run, one after another.")
+    parser.add_argument('--pin', action='store_true', help="Pin each worker to its own share of the CPUs.")
+    parser.add_argument('--threads-per-worker', type=int, default=0)
+    parser.add_argument('--baseline', type=float, help="Single-worker samples/s, when --workers does not include 1.")
+    parser.add_argument('--output', default='scaling_report.json')
+    args = parser.parse_args(argv)
+
+    runs = {}
+    for num_workers in args.workers:
+        report_dir = tempfile.mkdtemp(prefix=f"scaling_{num_workers}_")
+        runs[num_workers] = launch_workers(num_workers, training_args, report_dir, args.pin, args.threads_per_worker)
+
+    summary = scaling_report(runs, args.baseline)
+    for entry in summary:
+        efficiency = entry['scaling_efficiency']
+        print(f"{entry['num_workers']} workers: {entry['total_samples_per_sec']:.2f} samples/s total, "
+              f"{entry['mean_per_worker_samples_per_sec']:.2f} per worker"
+              + (f", efficiency {efficiency:.0%}" if efficiency is not None else ""))
+
+    with open(args.output, 'w') as json_file:
+        json.dump({'training_args': training_args, 'runs': summary}, json_file, indent=2)
+    print(f"Scaling report written to {args.output}")
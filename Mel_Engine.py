@@ -0,0 +1,649 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 22:41:17 2026
+
+Log mel spectrograms computed with NumPy, in batches of clips.
+
+The mel filterbank and window are built once per (sr, n_fft, n_mels) and reused by
+every clip, where librosa.feature.melspectrogram rebuilds them on each call. Clips are
+padded to a common length and framed together, so one FFT call covers a whole batch.
+The spectrogram is a power spectrogram, converted with power_to_db (10 log10), matching
+librosa.feature.melspectrogram with its defaults (centred frames, zero padding, periodic
+Hann window, Slaney mel scale and normalisation). The FFT is SciPy's, which is faster
+than NumPy's on float32 and can spread a batch over several cores.
+
+The top_db floor differs from librosa.power_to_db: it is taken top_db below full scale,
+the level a full-scale tone reaches in its strongest band, rather than below the loudest
+column of the clip, so a column does not depend on the rest of the clip.
+
+The hop length can be derived from the video frame rate so that every video frame
+covers the same whole number of mel columns; the hop may then be fractional, with each
+column starting at the nearest sample.
+
+Long recordings can be streamed instead: MelStream takes the audio in blocks and keeps
+only the samples the next column's window still needs, so memory does not grow with the
+recording. Its columns equal the whole-clip ones.
+
+Example:
+    python Mel_Engine.py --check --benchmark --clips 32 --seconds 4 --output mel_engine.json
+
+@author: Jayyy
+"""
+import argparse
+import functools
+import json
+import time
+
+import numpy as np
+
+DEFAULT_SR = 44100
+DEFAULT_N_FFT = 2048
+DEFAULT_N_MELS = 128
+DEFAULT_HOP_LENGTH = 512
+DEFAULT_TOP_DB = 80.0
+
+# The extraction settings mel_options returns when no option is given
+DEFAULT_MEL_OPTIONS = {'sr': DEFAULT_SR, 'hop_length': DEFAULT_HOP_LENGTH, 'frame_aligned': False, 'stream': False}
+
+
+def hz_to_mel(frequencies):
+    """
+    Convert frequencies to the Slaney mel scale: linear below 1 kHz, logarithmic above.
+
+    Parameters:
+    frequencies (np.ndarray): Frequencies in Hz.
+
+    Returns:
+    np.ndarray: The mel values.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    mels = frequencies * 3.0 / 200.0
+    log_region = frequencies >= 1000.0
+    return np.where(log_region, 15.0 + np.log(np.maximum(frequencies, 1e-10) / 1000.0) * 27.0 / np.log(6.4), mels)
+
+def mel_to_hz(mels):
+    """
+    Convert Slaney mel values back to frequencies.
+
+    Parameters:
+    mels (np.ndarray): The mel values.
+
+    Returns:
+    np.ndarray: Frequencies in Hz.
+    """
+    mels = np.asarray(mels, dtype=np.float64)
+    frequencies = mels * 200.0 / 3.0
+    return np.where(mels >= 15.0, 1000.0 * np.exp(np.log(6.4) / 27.0 * (mels - 15.0)), frequencies)
+
+@functools.lru_cache(maxsize=None)
+def mel_filterbank(sr, n_fft, n_mels, fmin=0.0, fmax=None):
+    """
+    Build the triangular mel filterbank, Slaney-normalised, as librosa.filters.mel does.
+
+    Cached, so the returned array is read-only.
+
+    Parameters:
+    sr (int): The sample rate.
+    n_fft (int): The FFT size.
+    n_mels (int): The number of mel bands.
+    fmin (float): The lowest frequency.
+    fmax (float): The highest frequency, sr / 2 when None.
+
+    Returns:
+    np.ndarray: The (n_mels, 1 + n_fft // 2) float32 filterbank.
+    """
+    fmax = sr / 2.0 if fmax is None else fmax
+    fft_frequencies = np.fft.rfftfreq(n_fft, 1.0 / sr)
+    mel_frequencies = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+
+    widths = np.diff(mel_frequencies)
+    ramps = mel_frequencies[:, None] - fft_frequencies[None, :]
+    lower = -ramps[:-2] / widths[:-1, None]
+    upper = ramps[2:] / widths[1:, None]
+    weights = np.maximum(0.0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_frequencies[2:] - mel_frequencies[:-2]))[:, None]
+
+    weights = weights.astype(np.float32)
+    weights.setflags(write=False)
+    return weights
+
+@functools.lru_cache(maxsize=None)
+def hann_window(n_fft):
+    """
+    Build the periodic Hann window used for spectral analysis. Cached and read-only.
+
+    Parameters:
+    n_fft (int): The window length.
+
+    Returns:
+    np.ndarray: The float32 window.
+    """
+    window = (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    window.setflags(write=False)
+    return window
+
+def frame_aligned_hop(sr, fps, target_hop=DEFAULT_HOP_LENGTH):
+    """
+    Choose a hop length giving a whole number of mel columns per video frame.
+
+    Parameters:
+    sr (int): The sample rate.
+    fps (float): The video frame rate.
+    target_hop (int): The hop length to stay close to.
+
+    Returns:
+    tuple: The hop length, an int when it divides the frame exactly and a float otherwise,
+        and the number of columns per frame.
+    """
+    samples_per_frame = sr / fps
+    columns_per_frame = max(int(round(samples_per_frame / target_hop)), 1)
+    hop_length = samples_per_frame / columns_per_frame
+    if abs(hop_length - round(hop_length)) < 1e-6:
+        hop_length = int(round(hop_length))
+    return hop_length, columns_per_frame
+
+def power_to_db(power, ref=1.0, amin=1e-10, top_db=80.0):
+    """
+    Convert a power spectrogram to decibels, as librosa.power_to_db does.
+
+    Parameters:
+    power (np.ndarray): The power spectrogram.
+    ref (float): The reference power for 0 dB.
+    amin (float): The smallest power, to avoid log(0).
+    top_db (float): The dynamic range kept below the peak; None to keep all.
+
+    Returns:
+    np.ndarray: The spectrogram in dB.
+    """
+    db = 10.0 * np.log10(np.maximum(power, amin))
+    db -= 10.0 * np.log10(max(amin, ref))
+    if top_db is not None:
+        db = np.maximum(db, db.max() - top_db)
+    return db
+
+def resample(audio, orig_sr, target_sr):
+    """
+    Resample audio with a polyphase filter.
+
+    Extraction resamples with ffmpeg instead (AudioController's sr); this is for audio
+    already in memory.
+
+    Parameters:
+    audio (np.ndarray): The audio.
+    orig_sr (int): Its sample rate.
+    target_sr (int): The sample rate wanted.
+
+    Returns:
+    np.ndarray: The resampled float32 audio.
+    """
+    if orig_sr == target_sr:
+        return np.asarray(audio, dtype=np.float32)
+    from scipy.signal import resample_poly
+
+    divisor = np.gcd(int(orig_sr), int(target_sr))
+    return resample_poly(audio, int(target_sr) // divisor, int(orig_sr) // divisor).astype(np.float32)
+
+def rfft(frames, workers=1):
+    """
+    Real FFT of each row of frames, with SciPy when it is installed.
+
+    Parameters:
+    frames (np.ndarray): The windowed frames, transformed along the last axis.
+    workers (int): The threads SciPy may use, -1 for every core.
+
+    Returns:
+    np.ndarray: The complex spectrum.
+    """
+    try:
+        from scipy import fft
+    except ImportError:
+        return np.fft.rfft(frames, axis=-1)
+    return fft.rfft(frames, axis=-1, workers=workers)
+
+class MelEngine:
+    """
+    Computes log mel spectrograms of single clips or batches of clips.
+    """
+    def __init__(self, sr=DEFAULT_SR, n_mels=DEFAULT_N_MELS, hop_length=DEFAULT_HOP_LENGTH, n_fft=DEFAULT_N_FFT,
+                 fmin=0.0, fmax=None, fps=None, workers=1):
+        """
+        Initialize a MelEngine instance.
+
+        Parameters:
+        sr (int): The sample rate of the audio the engine is given.
+        n_mels (int): The number of mel bands.
+        hop_length (float): The hop length in samples, may be fractional.
+        n_fft (int): The FFT size.
+        fmin (float): The lowest frequency of the filterbank.
+        fmax (float): The highest frequency of the filterbank, sr / 2 when None.
+        fps (float): When given, the hop length closest to hop_length that gives a whole
+            number of columns per video frame is used instead.
+        workers (int): The threads the FFT may use, -1 for every core.
+        """
+        self.sr = sr
+        self.n_mels = n_mels
+        self.n_fft = n_fft
+        self.fmin = fmin
+        self.fmax = fmax
+        self.fps = fps
+        self.workers = workers
+        self.columns_per_frame = None
+        if fps:
+            hop_length, self.columns_per_frame = frame_aligned_hop(sr, fps, hop_length)
+        self.hop_length = hop_length
+        self.filterbank = mel_filterbank(sr, n_fft, n_mels, fmin, fmax)
+        self.window = hann_window(n_fft)
+        # A full-scale tone centred on a bin has power (window sum / 2)^2 there
+        self.full_scale_db = float(10.0 * np.log10((self.window.sum() / 2.0) ** 2 * self.filterbank.max()))
+
+    def config(self):
+        """
+        Describe the engine, for cache keys and reports.
+
+        Returns:
+        dict: The settings that determine the spectrograms.
+        """
+        return {'sr': self.sr, 'n_fft': self.n_fft, 'n_mels': self.n_mels, 'hop_length': self.hop_length,
+                'fmin': self.fmin, 'fmax': self.fmax, 'columns_per_frame': self.columns_per_frame, 'scale': 'power_db',
+                'top_db': DEFAULT_TOP_DB, 'top_db_reference': 'full_scale'}
+
+    def num_columns(self, num_samples):
+        """
+        Return the number of spectrogram columns of a clip, as librosa's centred STFT gives.
+
+        Parameters:
+        num_samples (int): The length of the clip.
+
+        Returns:
+        int: The number of columns.
+        """
+        return 1 + int(num_samples // self.hop_length)
+
+    def column_starts(self, num_columns):
+        """
+        Return the first sample of each column's window in the centre-padded audio.
+
+        Parameters:
+        num_columns (int): The number of columns.
+
+        Returns:
+        np.ndarray: The int64 start offsets.
+        """
+        return np.round(np.arange(num_columns) * self.hop_length).astype(np.int64)
+
+    def column_range(self, timestamp_ms, duration_ms):
+        """
+        Return the columns covering a video frame.
+
+        Parameters:
+        timestamp_ms (float): The frame's start time in milliseconds.
+        duration_ms (float): The frame's duration in milliseconds.
+
+        Returns:
+        tuple: The first column and the column after the last.
+        """
+        if self.columns_per_frame:
+            # Frame timestamps are rounded down to whole milliseconds, so round to the nearest column
+            start = int(round(timestamp_ms / 1000.0 * self.sr / self.hop_length))
+            return start, start + self.columns_per_frame
+        start = int((timestamp_ms / 1000.0 * self.sr) / self.hop_length)
+        end = int(((timestamp_ms + duration_ms) / 1000.0 * self.sr) / self.hop_length)
+        return start, end
+
+    def mel_power_batch(self, clips):
+        """
+        Compute the mel power spectrograms of clips in one STFT.
+
+        Parameters:
+        clips (list): 1-D audio arrays at the engine's sample rate.
+
+        Returns:
+        list: The (n_mels, columns) float32 mel power spectrogram of each clip.
+        """
+        lengths = [len(clip) for clip in clips]
+        num_columns = [self.num_columns(length) for length in lengths]
+        max_columns = max(num_columns)
+
+        # Centre the frames by padding n_fft // 2 zeros on both sides, and pad the clips to
+        # the longest one so they stack
+        pad = self.n_fft // 2
+        starts = self.column_starts(max_columns)
+        padded = np.zeros((len(clips), int(starts[-1]) + self.n_fft), dtype=np.float32)
+        for row, clip in enumerate(clips):
+            padded[row, pad:pad + len(clip)] = clip
+
+        if isinstance(self.hop_length, int):
+            frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft, axis=-1)[:, ::self.hop_length][:, :max_columns]
+        else:
+            frames = padded[:, starts[:, None] + np.arange(self.n_fft)]
+
+        spectrum = rfft(frames * self.window, self.workers)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        mel_power = np.matmul(power, self.filterbank.T).transpose(0, 2, 1)
+        return [mel_power[row, :, :columns] for row, columns in enumerate(num_columns)]
+
+    def to_db(self, mel_power, top_db=DEFAULT_TOP_DB):
+        """
+        Convert mel power to dB, flooring it top_db below full scale.
+
+        The floor does not depend on the rest of the clip, so any run of columns is
+        converted the same whether the clip is computed whole or streamed.
+
+        Parameters:
+        mel_power (np.ndarray): The mel power spectrogram.
+        top_db (float): The dynamic range kept below full scale; None to keep all.
+
+        Returns:
+        np.ndarray: The spectrogram in dB.
+        """
+        mel_db = power_to_db(mel_power, top_db=None)
+        if top_db is not None:
+            mel_db = np.maximum(mel_db, self.full_scale_db - top_db)
+        return mel_db
+
+    def melspectrogram_batch(self, clips, sr=None, batch_size=16):
+        """
+        Compute the log mel spectrograms of many clips, batch_size clips per STFT.
+
+        Parameters:
+        clips (list): 1-D audio arrays.
+        sr (int): Their sample rate, resampled to the engine's when different; the engine's when None.
+        batch_size (int): The number of clips per STFT, bounding the memory used.
+
+        Returns:
+        list: The (n_mels, columns) log mel spectrogram of each clip, in dB.
+        """
+        if sr is not None and sr != self.sr:
+            clips = [resample(clip, sr, self.sr) for clip in clips]
+        spectrograms = []
+        for start in range(0, len(clips), batch_size):
+            for mel_power in self.mel_power_batch(clips[start:start + batch_size]):
+                spectrograms.append(self.to_db(mel_power))
+        return spectrograms
+
+    def melspectrogram(self, audio, sr=None):
+        """
+        Compute the log mel spectrogram of one clip.
+
+        Parameters:
+        audio (np.ndarray): The 1-D audio.
+        sr (int): Its sample rate, resampled to the engine's when different; the engine's when None.
+
+        Returns:
+        np.ndarray: The (n_mels, columns) log mel spectrogram, in dB.
+        """
+        return self.melspectrogram_batch([audio], sr=sr)[0]
+
+    def melspectrogram_stream(self, blocks, top_db=DEFAULT_TOP_DB):
+        """
+        Compute the log mel spectrogram of audio arriving in blocks, see MelStream.
+
+        Parameters:
+        blocks (iterable): 1-D audio arrays at the engine's sample rate, in order.
+        top_db (float): The dynamic range kept below full scale; None to keep all.
+
+        Yields:
+        np.ndarray: The (n_mels, columns) log mel columns completed by each block, in dB.
+        """
+        stream = MelStream(self, top_db)
+        try:
+            for block in blocks:
+                columns = stream.push(block)
+                if columns.shape[1]:
+                    yield columns
+        finally:
+            # Stop a decoding generator as soon as the columns are no longer wanted
+            if hasattr(blocks, 'close'):
+                blocks.close()
+        columns = stream.finish()
+        if columns.shape[1]:
+            yield columns
+
+class MelStream:
+    """
+    Computes a log mel spectrogram incrementally from audio arriving in blocks.
+
+    The columns overlap by n_fft - hop_length samples, so the samples from the start of
+    the next column's window onwards are kept between blocks. The frames are centred with
+    n_fft // 2 zeros at both ends, as in MelEngine.mel_power_batch, which gives the same
+    columns as computing the whole clip at once.
+    """
+    def __init__(self, engine, top_db=DEFAULT_TOP_DB):
+        """
+        Initialize a MelStream instance.
+
+        Parameters:
+        engine (MelEngine): The engine whose settings, filterbank and window are used.
+        top_db (float): The dynamic range kept below full scale; None to keep all.
+        """
+        self.engine = engine
+        self.top_db = top_db
+        # Starts with the centre padding; buffer_start is the padded-signal offset of buffer[0]
+        self.buffer = np.zeros(engine.n_fft // 2, dtype=np.float32)
+        self.buffer_start = 0
+        self.num_samples = 0
+        self.next_column = 0
+        self.finished = False
+
+    def push(self, audio):
+        """
+        Add a block of audio.
+
+        Parameters:
+        audio (np.ndarray): The next 1-D block, at the engine's sample rate.
+
+        Returns:
+        np.ndarray: The (n_mels, columns) log mel columns whose windows the audio completed, in dB.
+        """
+        if self.finished:
+            raise RuntimeError("MelStream.push - the stream is finished")
+        audio = np.asarray(audio, dtype=np.float32).ravel()
+        self.buffer = np.concatenate([self.buffer, audio])
+        self.num_samples += len(audio)
+
+        # The columns whose windows end within the buffer
+        buffer_end = self.buffer_start + len(self.buffer) - self.engine.n_fft
+        stop = max(int(buffer_end // self.engine.hop_length) + 2, self.next_column)
+        starts = self._starts(stop)
+        stop = self.next_column + int(np.count_nonzero(starts <= buffer_end))
+        return self._columns(stop)
+
+    def finish(self):
+        """
+        Pad the end of the audio and compute the remaining columns.
+
+        Returns:
+        np.ndarray: The (n_mels, columns) last log mel columns, in dB.
+        """
+        if self.finished:
+            return np.zeros((self.engine.n_mels, 0), dtype=np.float32)
+        self.finished = True
+        stop = self.engine.num_columns(self.num_samples)
+        end = int(self._starts(stop)[-1]) + self.engine.n_fft if stop > self.next_column else 0
+        missing = end - (self.buffer_start + len(self.buffer))
+        if missing > 0:
+            self.buffer = np.concatenate([self.buffer, np.zeros(missing, dtype=np.float32)])
+        return self._columns(stop)
+
+    def _starts(self, stop):
+        # Each column's first sample in the padded signal, as MelEngine.column_starts gives
+        return np.round(np.arange(self.next_column, stop) * self.engine.hop_length).astype(np.int64)
+
+    def _columns(self, stop):
+        engine = self.engine
+        if stop <= self.next_column:
+            return np.zeros((engine.n_mels, 0), dtype=np.float32)
+
+        offsets = self._starts(stop) - self.buffer_start
+        frames = self.buffer[offsets[:, None] + np.arange(engine.n_fft)]
+        spectrum = rfft(frames * engine.window, engine.workers)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        mel_db = engine.to_db(np.matmul(power, engine.filterbank.T).T, self.top_db)
+
+        self.next_column = stop
+        # Keep the samples from the start of the next column's window onwards
+        keep_from = int(round(stop * engine.hop_length)) - self.buffer_start
+        self.buffer = self.buffer[keep_from:].copy()
+        self.buffer_start += keep_from
+        return mel_db.astype(np.float32)
+
+@functools.lru_cache(maxsize=None)
+def get_mel_engine(sr=DEFAULT_SR, n_mels=DEFAULT_N_MELS, hop_length=DEFAULT_HOP_LENGTH, n_fft=DEFAULT_N_FFT, fps=None):
+    """
+    Return the shared engine for a configuration. Engines hold no per-clip state.
+
+    Parameters:
+    sr (int): The sample rate.
+    n_mels (int): The number of mel bands.
+    hop_length (float): The hop length.
+    n_fft (int): The FFT size.
+    fps (float): The video frame rate to align the hop length to, None for none.
+
+    Returns:
+    MelEngine: The engine.
+    """
+    return MelEngine(sr=sr, n_mels=n_mels, hop_length=hop_length, n_fft=n_fft, fps=fps)
+
+def add_mel_arguments(parser):
+    """
+    Add the mel spectrogram options to a command line parser.
+
+    Parameters:
+    parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument('--mel-sr', type=int, default=DEFAULT_SR,
+                        help="The sample rate the audio is resampled to for the mel spectrogram, e.g. 16000 for speech.")
+    parser.add_argument('--mel-hop', type=int, default=DEFAULT_HOP_LENGTH, help="The mel hop length in samples.")
+    parser.add_argument('--frame-aligned-mel', action='store_true',
+                        help="Adjust the hop length so every video frame covers a whole number of mel columns.")
+    parser.add_argument('--stream-audio', action='store_true',
+                        help="Decode the audio and compute the mel spectrogram in blocks as the frames need them, for long recordings.")
+
+def mel_options(args):
+    """
+    Read the mel spectrogram options added by add_mel_arguments.
+
+    Parameters:
+    args (argparse.Namespace): The parsed arguments.
+
+    Returns:
+    dict: AudioController settings, with frame_aligned to take the fps from the video.
+    """
+    return {'sr': args.mel_sr, 'hop_length': args.mel_hop, 'frame_aligned': args.frame_aligned_mel,
+            'stream': args.stream_audio}
+
+def test_clips(num_clips, seconds, sr, seed=0):
+    """
+    Make speech-like test clips: harmonic tones with a moving pitch, plus noise.
+
+    Parameters:
+    num_clips (int): The number of clips.
+    seconds (float): The length of the longest clip; the others are up to 20% shorter.
+    sr (int): The sample rate.
+    seed (int): The random seed.
+
+    Returns:
+    list: The float32 clips.
+    """
+    rng = np.random.default_rng(seed)
+    clips = []
+    for _ in range(num_clips):
+        num_samples = int(seconds * sr * rng.uniform(0.8, 1.0))
+        times = np.arange(num_samples) / sr
+        pitch = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2.0) * times))
+        phase = 2 * np.pi * np.cumsum(pitch) / sr
+        clip = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+        clip = 0.2 * clip + 0.01 * rng.standard_normal(num_samples)
+        clips.append(clip.astype(np.float32))
+    return clips
+
+def check_against_librosa(engine, clips):
+    """
+    Compare the engine's spectrograms with librosa's.
+
+    Parameters:
+    engine (MelEngine): The engine, with an integer hop length.
+    clips (list): Test clips at the engine's sample rate.
+
+    Returns:
+    dict: The largest relative error of the mel power and the largest dB difference.
+    """
+    import librosa
+
+    ours = engine.mel_power_batch(clips)
+    power_error = 0.0
+    db_error = 0.0
+    for clip, mel_power in zip(clips, ours):
+        reference = librosa.feature.melspectrogram(y=clip, sr=engine.sr, n_fft=engine.n_fft, hop_length=engine.hop_length,
+                                                   n_mels=engine.n_mels)
+        power_error = max(power_error, float(np.max(np.abs(mel_power - reference)) / np.max(reference)))
+        db_error = max(db_error, float(np.max(np.abs(power_to_db(mel_power) - librosa.power_to_db(reference)))))
+    return {'max_relative_power_error': power_error, 'max_db_error': db_error}
+
+def benchmark(engine, clips, batch_size=16, repeats=3):
+    """
+    Measure the throughput of librosa per clip against the engine per clip and in batches.
+
+    Parameters:
+    engine (MelEngine): The engine.
+    clips (list): Test clips at the engine's sample rate.
+    batch_size (int): The batch size of the batched run.
+    repeats (int): The runs of each method; the fastest is kept.
+
+    Returns:
+    dict: Seconds and clips per second of each method.
+    """
+    import librosa
+
+    def librosa_per_clip():
+        for clip in clips:
+            librosa.power_to_db(librosa.feature.melspectrogram(y=clip, sr=engine.sr, n_fft=engine.n_fft,
+                                                               hop_length=int(round(engine.hop_length)), n_mels=engine.n_mels))
+
+    methods = {
+        'librosa': librosa_per_clip,
+        'engine_per_clip': lambda: [engine.melspectrogram(clip) for clip in clips],
+        'engine_batched': lambda: engine.melspectrogram_batch(clips, batch_size=batch_size),
+    }
+    results = {}
+    for name, method in methods.items():
+        method()
+        seconds = min(_timed(method) for _ in range(repeats))
+        results[name] = {'seconds': seconds, 'clips_per_sec': len(clips) / seconds}
+    return results
+
+def _timed(function):
+    start_time = time.perf_counter()
+    function()
+    return time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the mel engine against librosa and measure its throughput.")
+    parser.add_argument('--check', action='store_true', help="Compare the spectrograms with librosa's.")
+    parser.add_argument('--benchmark', action='store_true', help="Measure the throughput against librosa.")
+    parser.add_argument('--clips', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=4.0, help="The clip length; RAVDESS statements last 3-5 s.")
+    parser.add_argument('--sr', type=int, default=DEFAULT_SR)
+    parser.add_argument('--hop', type=int, default=DEFAULT_HOP_LENGTH)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=1, help="FFT threads, -1 for every core.")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    engine = MelEngine(sr=args.sr, hop_length=args.hop, workers=args.workers)
+    clips = test_clips(args.clips, args.seconds, args.sr)
+    results = {'config': engine.config(), 'clips': args.clips, 'seconds': args.seconds}
+    if args.check or not args.benchmark:
+        results['check'] = check_against_librosa(engine, clips[:4])
+        print(f"Against librosa: mel power within {results['check']['max_relative_power_error']:.2e} of the peak, "
+              f"dB within {results['check']['max_db_error']:.3f} dB")
+    if args.benchmark:
+        results['benchmark'] = benchmark(engine, clips, args.batch_size, args.repeats)
+        for name, result in results['benchmark'].items():
+            print(f"{name:>16}: {result['seconds']:.3f} s, {result['clips_per_sec']:.1f} clips/s")
+
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:41 2026
+
+Benchmark harness for emotion classifier variants. Each variant is built with
+create_emotion_classifier and run on synthetic tensors matching the real input
+signatures, reporting parameter count, FLOPs, training step time, inference latency
+and peak RSS. Results are written as JSON so regressions can be tracked between runs.
+
+Example:
+    python Model_Benchmark.py --output benchmarks/models.json
+    python Model_Benchmark.py --variants my_variants.json --only baseline gru_unidirectional
+
+@author: Jayyy
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Variant name -> keyword arguments for create_emotion_classifier
+DEFAULT_VARIANTS = {
+    'baseline': {},
+    'lstm_unidirectional': {'bidirectional': False},
+    'gru_bidirectional': {'rnn_type': 'gru'},
+    'gru_unidirectional': {'rnn_type': 'gru', 'bidirectional': False},
+    'narrow': {'landmark_units': [64, 32], 'mel_dense_units': 64, 'rnn_units': [64, 64]},
+    'mel_conv1d': {'mel_branch': 'conv1d'},
+    'mel_dense': {'mel_branch': 'dense'},
+}
+
+DEFAULT_LATENCY_BATCH_SIZES = (1, 8, 64)
+
+
+def synthetic_batch(batch_size, seed=0):
+    """
+    Create a synthetic batch matching the output signature of create_tf_dataset.
+
+    Parameters:
+    batch_size (int): The number of samples in the batch.
+    seed (int): The random seed.
+
+    Returns:
+    tuple: ((landmarks, mels, phonemes), one-hot labels) as numpy arrays.
+    """
+    # Emotion_Classifier imports TensorFlow, which only the benchmark workers need
+    from Emotion_Classifier import sequence_length, num_landmarks, num_mels, mel_length, num_phonemes, num_emotions
+
+    rng = np.random.default_rng(seed)
+    landmarks = rng.random((batch_size, sequence_length, num_landmarks, 3), dtype=np.float32)
+    mels = rng.standard_normal((batch_size, sequence_length, num_mels, mel_length, 1), dtype=np.float32)
+    phonemes = rng.integers(0, num_phonemes, size=(batch_size, sequence_length, 1), dtype=np.int32)
+    labels = np.eye(num_emotions, dtype=np.float32)[rng.integers(0, num_emotions, size=batch_size)]
+    return (landmarks, mels, phonemes), labels
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of the current process in megabytes.
+
+    Returns:
+    float: The peak RSS in MB, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if platform.system() == 'Darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def summarise_times(times):
+    """
+    Summarise a list of durations in seconds as milliseconds.
+
+    Parameters:
+    times (list): The measured durations in seconds.
+
+    Returns:
+    dict: The mean, p50, p95, min and max in milliseconds.
+    """
+    times_ms = np.asarray(times) * 1000.0
+    return {
+        'mean_ms': float(np.mean(times_ms)),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'min_ms': float(np.min(times_ms)),
+        'max_ms': float(np.max(times_ms)),
+    }
+
+
+def count_flops(model):
+    """
+    Count the floating point operations of a single-sample forward pass.
+
+    The graph is frozen and run through the TensorFlow profiler. Recurrent layers are
+    lowered to while loops whose body is only counted once, so the figure is a lower
+    bound for the recurrent part and is best used to compare variants with each other.
+
+    Parameters:
+    model (tf.keras.Model): The model to profile.
+
+    Returns:
+    int: The number of floating point operations per sample.
+    """
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    specs = [tf.TensorSpec((1,) + tuple(model_input.shape[1:]), model_input.dtype) for model_input in model.inputs]
+
+    @tf.autograph.experimental.do_not_convert
+    def forward(*inputs):
+        return model(list(inputs), training=False)
+
+    frozen = convert_variables_to_constants_v2(tf.function(forward).get_concrete_function(*specs))
+    options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+    options['output'] = 'none'
+    profile = tf.compat.v1.profiler.profile(graph=frozen.graph, run_meta=tf.compat.v1.RunMetadata(), cmd='op', options=options)
+    return int(profile.total_float_ops)
+
+
+def time_train_step(model, batch_size, steps, warmup):
+    """
+    Time training steps on a synthetic batch.
+
+    Parameters:
+    model (tf.keras.Model): The compiled model.
+    batch_size (int): The training batch size.
+    steps (int): The number of timed steps.
+    warmup (int): The number of untimed warmup steps, which include tracing.
+
+    Returns:
+    dict: The step time summary and samples per second.
+    """
+    inputs, labels = synthetic_batch(batch_size, seed=1)
+    for _ in range(warmup):
+        model.train_on_batch(inputs, labels)
+
+    times = []
+    for _ in range(steps):
+        start_time = time.perf_counter()
+        model.train_on_batch(inputs, labels)
+        times.append(time.perf_counter() - start_time)
+
+    summary = summarise_times(times)
+    summary['batch_size'] = batch_size
+    summary['samples_per_sec'] = batch_size / float(np.mean(times))
+    return summary
+
+
+def time_inference(model, batch_sizes, repeats, warmup):
+    """
+    Time inference latency at each batch size.
+
+    Parameters:
+    model (tf.keras.Model): The model.
+    batch_sizes (list): The batch sizes to measure.
+    repeats (int): The number of timed calls per batch size.
+    warmup (int): The number of untimed warmup calls per batch size.
+
+    Returns:
+    dict: Batch size -> latency summary.
+    """
+    import tensorflow as tf
+
+    @tf.function(reduce_retracing=True)
+    def infer(landmarks, mels, phonemes):
+        return model([landmarks, mels, phonemes], training=False)
+
+    results = {}
+    for batch_size in batch_sizes:
+        inputs, _ = synthetic_batch(batch_size, seed=2)
+        inputs = [tf.constant(x) for x in inputs]
+        for _ in range(warmup):
+            infer(*inputs).numpy()
+
+        times = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            infer(*inputs).numpy()
+            times.append(time.perf_counter() - start_time)
+
+        summary = summarise_times(times)
+        summary['per_sample_ms'] = summary['mean_ms'] / batch_size
+        results[str(batch_size)] = summary
+    return results
+
+
+def benchmark_variant(name, config, options):
+    """
+    Build and benchmark a single model variant in the current process.
+
+    Parameters:
+    name (str): The variant name.
+    config (dict): Keyword arguments for create_emotion_classifier.
+    options (dict): Benchmark options (steps, repeats, batch sizes and thread limits).
+
+    Returns:
+    dict: The benchmark results for the variant.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+
+    if options.get('threads'):
+        tf.config.threading.set_intra_op_parallelism_threads(options['threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(options['threads'])
+
+    baseline_rss = peak_rss_mb()
+    build_start = time.perf_counter()
+    model = create_emotion_classifier(**config)
+    build_time = time.perf_counter() - build_start
+
+    result = {
+        'name': name,
+        'config': config,
+        'params': int(model.count_params()),
+        'build_time_s': build_time,
+        'flops_per_sample': count_flops(model),
+        'train_step': time_train_step(model, options['train_batch_size'], options['train_steps'], options['warmup']),
+        'inference_latency': time_inference(model, options['latency_batch_sizes'], options['latency_repeats'], options['warmup']),
+        'rss_after_import_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    return result
+
+
+def _benchmark_worker(name, config, options, queue):
+    """
+    Process entry point running a single variant and returning its results on a queue.
+    """
+    try:
+        queue.put(benchmark_variant(name, config, options))
+    except Exception as e:
+        queue.put({'name': name, 'config': config, 'error': repr(e)})
+
+
+def _wait_for_result(process, queue, name, config):
+    """
+    Wait for an isolated variant's results, detecting workers that die without reporting (e.g. OOM kills).
+    """
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except queue_module.Empty:
+            if not process.is_alive():
+                return {'name': name, 'config': config, 'error': f"worker exited with code {process.exitcode}"}
+
+
+def run_benchmarks(variants, options, isolate=True):
+    """
+    Benchmark each variant, by default in its own process.
+
+    Parameters:
+    variants (dict): Variant name -> keyword arguments for create_emotion_classifier.
+    options (dict): Benchmark options.
+    isolate (bool): Whether to run each variant in a fresh process so peak RSS is per variant.
+
+    Returns:
+    list: The results for each variant.
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name, config in variants.items():
+        print(f"Benchmarking {name}: {config}")
+        if isolate:
+            queue = context.Queue()
+            process = context.Process(target=_benchmark_worker, args=(name, config, options, queue))
+            process.start()
+            result = _wait_for_result(process, queue, name, config)
+            process.join()
+        else:
+            result = benchmark_variant(name, config, options)
+
+        if 'error' in result:
+            print(f"  Failed: {result['error']}")
+        else:
+            print(f"  params={result['params']} flops={result['flops_per_sample']} "
+                  f"step={result['train_step']['mean_ms']:.1f}ms peak_rss={result['peak_rss_mb']}MB")
+        results.append(result)
+    return results
+
+
+def load_variants(path=None, only=None):
+    """
+    Load the variants to benchmark.
+
+    Parameters:
+    path (str): Optional path to a JSON file mapping variant names to create_emotion_classifier kwargs.
+    only (list): Optional list of variant names to keep.
+
+    Returns:
+    dict: Variant name -> keyword arguments.
+    """
+    if path:
+        with open(path, 'r') as json_file:
+            variants = json.load(json_file)
+    else:
+        variants = dict(DEFAULT_VARIANTS)
+
+    if only:
+        missing = [name for name in only if name not in variants]
+        if missing:
+            raise ValueError(f"Unknown variants: {missing}")
+        variants = {name: variants[name] for name in only}
+    return variants
+
+
+def write_report(results, options, output_path):
+    """
+    Write the benchmark results to a JSON report.
+
+    Parameters:
+    results (list): The results for each variant.
+    options (dict): The benchmark options used.
+    output_path (str): The path of the JSON report.
+    """
+    import tensorflow as tf
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'host': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'tensorflow': tf.__version__,
+        },
+        'options': options,
+        'results': results,
+    }
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    print(f"Benchmark report written to {output_path}")
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark emotion classifier variants on synthetic inputs.")
+    parser.add_argument('--variants', help="JSON file mapping variant names to create_emotion_classifier kwargs.")
+    parser.add_argument('--only', nargs='+', help="Only benchmark the named variants.")
+    parser.add_argument('--output', default='benchmarks/model_benchmark.json', help="Path of the JSON report.")
+    parser.add_argument('--train-batch-size', type=int, default=8)
+    parser.add_argument('--train-steps', type=int, default=20)
+    parser.add_argument('--latency-batch-sizes', type=int, nargs='+', default=list(DEFAULT_LATENCY_BATCH_SIZES))
+    parser.add_argument('--latency-repeats', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help="TensorFlow intra/inter op threads, 0 for the default.")
+    parser.add_argument('--in-process', action='store_true', help="Run all variants in this process (peak RSS is then cumulative).")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    variants = load_variants(args.variants, args.only)
+    options = {
+        'train_batch_size': args.train_batch_size,
+        'train_steps': args.train_steps,
+        'latency_batch_sizes': args.latency_batch_sizes,
+        'latency_repeats': args.latency_repeats,
+        'warmup': args.warmup,
+        'threads': args.threads,
+    }
+    results = run_benchmarks(variants, options, isolate=not args.in_process)
+    write_report(results, options, args.output)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 23:26:02 2026
+
+Dataset-level normalisation statistics for the model inputs.
+
+One streaming pass over the training split of a merged HDF5 dataset computes the mean
+and standard deviation of every mel bin and every landmark coordinate. Moments are
+accumulated per video with Welford's update and combined with Chan's parallel merge,
+so chunks of videos can be summarised by separate worker processes and merged
+exactly. Only real mel columns and frames are counted, never padding.
+
+The statistics are stored as attributes of the dataset's root group (its keys are the
+videos) and next to the trained model. The loaders pad mel segments and sequences with
+the mean, so the per-batch affine transform (x - mean) / std maps padding to zero.
+
+Example:
+    python Normalization_Stats.py --hdf5 merged_data_file.hdf5 --seed 0 --workers 4
+
+@author: Jayyy
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from Instrumentation import timer
+from Storage_Controller_Model import open_dataset
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTE_PREFIX = 'normalization_'
+STATISTICS = ('mel_mean', 'mel_std', 'landmark_mean', 'landmark_std')
+# Features with a smaller standard deviation are only centred
+MIN_STD = 1e-6
+
+
+class RunningMoments:
+    """
+    Streaming count, mean and sum of squared deviations of fixed-shape samples.
+    """
+    def __init__(self, shape):
+        """
+        Initialize a RunningMoments instance.
+
+        Parameters:
+        shape (tuple): The shape of one sample.
+        """
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def update(self, samples):
+        """
+        Add a batch of samples, stacked along the first axis.
+
+        Parameters:
+        samples (np.ndarray): The samples.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return
+        batch = RunningMoments(self.mean.shape)
+        batch.count = len(samples)
+        batch.mean = samples.mean(axis=0)
+        batch.m2 = ((samples - batch.mean) ** 2).sum(axis=0)
+        self.merge(batch)
+
+    def merge(self, other):
+        """
+        Combine the moments of another set of samples into these (Chan et al.).
+
+        Parameters:
+        other (RunningMoments): The other moments.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+
+    @property
+    def std(self):
+        """
+        The population standard deviation.
+        """
+        if self.count == 0:
+            return np.ones_like(self.mean)
+        return np.sqrt(self.m2 / self.count)
+
+def split_key(train_metadata):
+    """
+    Identify a training split, so statistics are only reused for the split they were computed on.
+
+    Parameters:
+    train_metadata (list): The (video_name, emotion) pairs of the training split.
+
+    Returns:
+    str: The hash of the split.
+    """
+    items = sorted([str(video_name), str(emotion)] for video_name, emotion in train_metadata)
+    return hashlib.sha256(json.dumps(items).encode('utf-8')).hexdigest()
+
+def chunk_moments(hdf5_path, metadata):
+    """
+    Accumulate the moments of some videos of a merged dataset.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file or virtual dataset file.
+    metadata (list): The (video_name, emotion) pairs to read.
+
+    Returns:
+    tuple: The mel and landmark RunningMoments.
+    """
+    mel_moments = None
+    landmark_moments = None
+    with open_dataset(hdf5_path) as reader:
+        for video_name, emotion in metadata:
+            landmarks, mels, _ = reader.read(video_name, emotion)
+            if not len(mels):
+                continue
+            # Mel columns are the samples of each bin, so a video's columns are added at once
+            columns = np.concatenate([mel.T for mel in mels], axis=0)
+
+            if mel_moments is None:
+                mel_moments = RunningMoments(columns.shape[1:])
+                landmark_moments = RunningMoments(landmarks.shape[1:])
+            mel_moments.update(columns)
+            landmark_moments.update(landmarks)
+    return mel_moments, landmark_moments
+
+@timer('normalization_stats')
+def compute_normalization_stats(hdf5_path, train_metadata, workers=1, chunks_per_worker=4):
+    """
+    Compute the normalisation statistics of a training split in one pass.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file.
+    train_metadata (list): The (video_name, emotion) pairs of the training split.
+    workers (int): The worker processes reading the videos; 1 reads them in this process.
+    chunks_per_worker (int): The chunks of videos per worker, for load balancing.
+
+    Returns:
+    dict: The per-bin mel and per-coordinate landmark means and standard deviations, the
+        numbers of mel columns and frames counted, and the split they describe.
+    """
+    metadata = list(train_metadata)
+    if not metadata:
+        raise ValueError("compute_normalization_stats - the training split is empty")
+
+    if workers > 1:
+        num_chunks = min(len(metadata), workers * chunks_per_worker)
+        chunks = [metadata[index::num_chunks] for index in range(num_chunks)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(chunk_moments, [hdf5_path] * len(chunks), chunks))
+    else:
+        results = [chunk_moments(hdf5_path, metadata)]
+
+    mel_moments, landmark_moments = None, None
+    for chunk_mel, chunk_landmarks in results:
+        if chunk_mel is None:
+            continue
+        if mel_moments is None:
+            mel_moments, landmark_moments = chunk_mel, chunk_landmarks
+        else:
+            mel_moments.merge(chunk_mel)
+            landmark_moments.merge(chunk_landmarks)
+    if mel_moments is None:
+        raise ValueError("compute_normalization_stats - the training split has no frames")
+
+    return {
+        'mel_mean': mel_moments.mean,
+        'mel_std': mel_moments.std,
+        'landmark_mean': landmark_moments.mean,
+        'landmark_std': landmark_moments.std,
+        'mel_count': int(mel_moments.count),
+        'landmark_count': int(landmark_moments.count),
+        'videos': len(metadata),
+        'split': split_key(metadata),
+    }
+
+def write_normalization_stats(hdf5_path, stats):
+    """
+    Store normalisation statistics as attributes of a dataset's root group.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file.
+    stats (dict): The statistics from compute_normalization_stats.
+    """
+    with h5py.File(hdf5_path, 'a') as file:
+        for name, value in stats.items():
+            file.attrs[ATTRIBUTE_PREFIX + name] = value
+
+def read_normalization_stats(hdf5_path):
+    """
+    Read the normalisation statistics stored in a dataset.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file.
+
+    Returns:
+    dict: The statistics, or None when the dataset has none.
+    """
+    with h5py.File(hdf5_path, 'r') as file:
+        attributes = {name[len(ATTRIBUTE_PREFIX):]: value for name, value in file.attrs.items()
+                      if name.startswith(ATTRIBUTE_PREFIX)}
+    if not all(name in attributes for name in STATISTICS):
+        return None
+    stats = {name: np.asarray(attributes[name], dtype=np.float64) for name in STATISTICS}
+    stats.update({name: value.item() if isinstance(value, np.generic) else value
+                  for name, value in attributes.items() if name not in STATISTICS})
+    return stats
+
+def load_or_compute_stats(hdf5_path, train_metadata, workers=1, store=True):
+    """
+    Reuse the statistics stored in a dataset if they describe this training split, otherwise compute them.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file.
+    train_metadata (list): The (video_name, emotion) pairs of the training split.
+    workers (int): The worker processes used when computing.
+    store (bool): Whether to store newly computed statistics in the dataset.
+
+    Returns:
+    dict: The statistics.
+    """
+    stats = read_normalization_stats(hdf5_path)
+    if stats is not None and stats.get('split') == split_key(train_metadata):
+        return stats
+
+    logger.info(f"Computing normalisation statistics over {len(train_metadata)} training videos")
+    stats = compute_normalization_stats(hdf5_path, train_metadata, workers)
+    if store:
+        try:
+            write_normalization_stats(hdf5_path, stats)
+        except OSError as e:
+            logger.warning(f"Could not store the normalisation statistics in {hdf5_path}: {e}")
+    return stats
+
+def model_stats_path(model_path):
+    """
+    Return where the statistics a model was trained with are kept: normalization.json in a
+    checkpoint directory, or <model file>.normalization.json.
+
+    Parameters:
+    model_path (str): A saved Keras model file, or a checkpoint directory.
+
+    Returns:
+    str: The path of the JSON file.
+    """
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, 'normalization.json')
+    return model_path + '.normalization.json'
+
+def save_model_stats(model_path, stats):
+    """
+    Keep the statistics a model is trained with next to it, for inference.
+
+    Parameters:
+    model_path (str): A saved Keras model file, or a checkpoint directory.
+    stats (dict): The statistics.
+    """
+    serialisable = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in stats.items()}
+    with open(model_stats_path(model_path), 'w') as json_file:
+        json.dump(serialisable, json_file)
+
+def load_model_stats(model_path):
+    """
+    Read the statistics a model was trained with.
+
+    Parameters:
+    model_path (str): A saved Keras model file, or a checkpoint directory.
+
+    Returns:
+    dict: The statistics, or None for a model trained on per-frame normalised mel segments.
+    """
+    path = model_stats_path(model_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as json_file:
+        stats = json.load(json_file)
+    for name in STATISTICS:
+        stats[name] = np.asarray(stats[name], dtype=np.float64)
+    return stats
+
+def affine_parameters(stats):
+    """
+    Turn statistics into the offsets and scales of the per-batch transform.
+
+    Parameters:
+    stats (dict): The statistics.
+
+    Returns:
+    dict: float32 landmark and mel offsets and scales, the mel ones shaped to broadcast
+        over (..., num_mels, mel_length, 1) inputs.
+    """
+    def scale(std):
+        return np.where(std > MIN_STD, 1.0 / np.maximum(std, MIN_STD), 1.0).astype(np.float32)
+
+    return {
+        'landmark_offset': stats['landmark_mean'].astype(np.float32),
+        'landmark_scale': scale(stats['landmark_std']),
+        'mel_offset': stats['mel_mean'].astype(np.float32)[:, None, None],
+        'mel_scale': scale(stats['mel_std'])[:, None, None],
+    }
+
+def apply_normalization(landmarks, mels, parameters):
+    """
+    Normalise a sample or a batch of samples in one affine transform per input.
+
+    Works on NumPy arrays and TensorFlow tensors alike.
+
+    Parameters:
+    landmarks (np.ndarray): Landmarks shaped (..., num_landmarks, 3).
+    mels (np.ndarray): Mel segments shaped (..., num_mels, mel_length, 1).
+    parameters (dict): The transform, from affine_parameters.
+
+    Returns:
+    tuple: The normalised landmarks and mel segments.
+    """
+    return ((landmarks - parameters['landmark_offset']) * parameters['landmark_scale'],
+            (mels - parameters['mel_offset']) * parameters['mel_scale'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the normalisation statistics of a dataset's training split.")
+    parser.add_argument('--hdf5', required=True, help="The merged HDF5 dataset.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the train/test split, as given to Interface_Model.py.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--force', action='store_true', help="Recompute even if the stored statistics match the split.")
+    args = parser.parse_args()
+
+    from Interface_Model import dataset_metadata, split_metadata
+
+    train_metadata, _ = split_metadata(dataset_metadata(args.hdf5), seed=args.seed)
+    start_time = time.perf_counter()
+    if args.force:
+        stats = compute_normalization_stats(args.hdf5, train_metadata, args.workers)
+        write_normalization_stats(args.hdf5, stats)
+    else:
+        stats = load_or_compute_stats(args.hdf5, train_metadata, args.workers)
+    print(f"{stats['videos']} videos, {stats['mel_count']} mel columns and {stats['landmark_count']} frames "
+          f"in {time.perf_counter() - start_time:.2f} s")
+    print(f"Mel mean {stats['mel_mean'].mean():.2f} dB, std {stats['mel_std'].mean():.2f} dB on average over the bins")
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:40:11 2026
+
+End-to-end benchmark of the extraction and training pipeline on a synthetic
+RAVDESS-style dataset (see Synthetic_Data_Generator.py), so it runs without the real
+videos, MediaPipe model or MFA installation. Each stage is timed on its own and the
+results are written to a JSON report that can be compared with an earlier run:
+
+    python Pipeline_Benchmark.py --videos 8 --output bench.json
+    python Pipeline_Benchmark.py --videos 8 --output bench_new.json --compare bench.json
+
+Stages: decode, landmarks (only with --landmark-model and MediaPipe installed), audio,
+alignment (stub aligner unless --aligner mfa), write, merge_link, merge_copy,
+merge_virtual, dataset_load, dataset_load_virtual, input_pipeline, input_pipeline_augmented
+(the cost of Augmentation.py on the cached batches) and train_step.
+
+@author: Jayyy
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import Instrumentation
+import Synthetic_Data_Generator as synthetic
+from Mel_Engine import add_mel_arguments
+
+STAGES = ['decode', 'landmarks', 'audio', 'alignment', 'write', 'merge_link', 'merge_copy', 'merge_virtual',
+          'dataset_load', 'dataset_load_virtual', 'input_pipeline', 'input_pipeline_augmented', 'train_step']
+
+
+class SkipStage(Exception):
+    """
+    Raised by a stage that cannot run in this environment.
+    """
+
+
+def probe_input_pipeline(dataset, num_batches=20):
+    """
+    Measure how fast a tf.data pipeline delivers batches, without running a model.
+
+    Parameters:
+    dataset (tf.data.Dataset): The dataset, repeated if it has fewer than num_batches batches.
+    num_batches (int): The number of batches to draw.
+
+    Returns:
+    dict: The time to the first batch and the steady-state batches per second after it.
+    """
+    iterator = iter(dataset)
+    start_time = time.perf_counter()
+    next(iterator)
+    first_batch_s = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(num_batches - 1):
+        next(iterator)
+    elapsed = time.perf_counter() - start_time
+    return {
+        'first_batch_s': first_batch_s,
+        'batches': num_batches - 1,
+        'seconds': elapsed,
+        'batches_per_sec': (num_batches - 1) / elapsed if elapsed > 0 else None,
+    }
+
+def stage_result(seconds, items, unit, **extra):
+    """
+    Describe the result of a stage.
+
+    Parameters:
+    seconds (float): The time taken by the stage.
+    items (int): The number of items processed.
+    unit (str): What an item is, e.g. 'frames' or 'videos'.
+
+    Returns:
+    dict: The seconds, items, unit, milliseconds per item and items per second, plus any extra fields.
+    """
+    result = {
+        'seconds': seconds,
+        'items': items,
+        'unit': unit,
+        'ms_per_item': 1000 * seconds / items if items else None,
+        'items_per_sec': items / seconds if seconds > 0 else None,
+    }
+    result.update(extra)
+    return result
+
+class PipelineBenchmark:
+    """
+    Runs the benchmark stages over a synthetic dataset in a work directory.
+    """
+    def __init__(self, work_dir, options):
+        """
+        Initialize a PipelineBenchmark instance and generate its synthetic videos.
+
+        Parameters:
+        work_dir (str): The directory the synthetic data and stage outputs are written to.
+        options (argparse.Namespace): The benchmark options.
+        """
+        self.work_dir = work_dir
+        self.options = options
+        self.extract_dir = os.path.join(work_dir, 'extract')
+        self.per_video_dir = os.path.join(work_dir, 'per_video')
+        self.master_path = os.path.join(work_dir, 'master.hdf5')
+        self.merged_path = os.path.join(work_dir, 'merged.hdf5')
+        self.virtual_path = os.path.join(work_dir, 'virtual.hdf5')
+
+        paths = synthetic.generate_dataset(work_dir, options.videos, options.frames, options.fps,
+                                           options.width, options.height, videos=True, hdf5=False, seed=options.seed)
+        self.video_paths = paths['videos']
+
+    def names(self):
+        """
+        Return the RAVDESS file names of the synthetic videos.
+        """
+        return [os.path.splitext(os.path.basename(path))[0] for path in self.video_paths]
+
+    def decode(self):
+        from Video_Controller import VideoController
+
+        frames = 0
+        start_time = time.perf_counter()
+        for video_path in self.video_paths:
+            video_controller = VideoController(video_path, width=self.options.decode_width,
+                                               rgb=self.options.decode_width is not None)
+            for _ in video_controller.process_video():
+                frames += 1
+        return stage_result(time.perf_counter() - start_time, frames, 'frames')
+
+    def landmarks(self):
+        if not self.options.landmark_model:
+            raise SkipStage("no --landmark-model given")
+        try:
+            # Imported before the timing, so it is not counted in the first landmarker's setup
+            import mediapipe
+        except ImportError as e:
+            raise SkipStage(f"MediaPipe is not installed: {e}")
+        from Face_Landmark_Generator import LandmarkerPool
+        from Video_Controller import VideoController
+
+        frames = 0
+        detected = 0
+        # A pool of its own, so the first video loads the model as in a fresh worker
+        pool = LandmarkerPool()
+        start_time = time.perf_counter()
+        for video_path in self.video_paths:
+            with pool.acquire(self.options.landmark_model, crop_face=self.options.crop_face) as landmark_gen:
+                video_controller = VideoController(video_path, width=self.options.decode_width,
+                                                   rgb=self.options.decode_width is not None)
+                for frame, timestamp, _ in video_controller.process_video():
+                    detected += bool(landmark_gen.find_landmarks(frame, timestamp, rgb=video_controller.rgb))
+                    frames += 1
+        seconds = time.perf_counter() - start_time
+        pool.close()
+        return stage_result(seconds, frames, 'frames', setup_seconds=pool.setup_seconds,
+                            landmarker_loads=pool.loads, frames_with_face=detected)
+
+    def audio(self):
+        from Audio_Controller import AudioController
+
+        start_time = time.perf_counter()
+        for name, video_path in zip(self.names(), self.video_paths):
+            output_dir = os.path.join(self.extract_dir, name)
+            os.makedirs(output_dir, exist_ok=True)
+            AudioController(video_path, os.path.join(output_dir, name + '.wav'), show=False, sr=self.options.mel_sr,
+                            hop_length=self.options.mel_hop, fps=self.options.fps if self.options.frame_aligned_mel else None)
+        return stage_result(time.perf_counter() - start_time, len(self.video_paths), 'videos')
+
+    def alignment(self):
+        from Aligner import run_mfa_alignment, run_stub_alignment
+        from Interface import create_statement_txt, retrive_phoneme, split_file_name
+        from TextGrid_Controller import Read_Textgrid
+
+        aligner = run_mfa_alignment if self.options.aligner == 'mfa' else run_stub_alignment
+        frame_duration_ms = 1000 / self.options.fps
+        phonemes = 0
+        start_time = time.perf_counter()
+        for name in self.names():
+            output_dir = os.path.join(self.extract_dir, name)
+            if not os.path.exists(os.path.join(output_dir, name + '.wav')):
+                raise SkipStage("needs the audio stage's .wav files")
+            create_statement_txt(split_file_name(name)[4], os.path.join(output_dir, name + '.txt'))
+            aligner(output_dir, self.options.mfa_model, self.options.mfa_dictionary, output_dir)
+            phones = Read_Textgrid(os.path.join(output_dir, name + '.TextGrid')).grid['phones']
+            for frame_index in range(self.options.frames):
+                retrive_phoneme(int(frame_index * frame_duration_ms), phones)
+                phonemes += 1
+        return stage_result(time.perf_counter() - start_time, len(self.video_paths), 'videos',
+                            aligner=self.options.aligner, phoneme_lookups=phonemes)
+
+    def write(self):
+        seconds = 0.0
+        frames = 0
+        for video_index, name in enumerate(self.names()):
+            ids = name.split("-")
+            training_frames = synthetic.synthetic_training_frames(ids[4], self.options.frames, self.options.fps,
+                                                                  seed=self.options.seed + video_index)
+            start_time = time.perf_counter()
+            synthetic.write_video_hdf5(os.path.join(self.per_video_dir, name, name + '.hdf5'), name, ids[2], training_frames)
+            seconds += time.perf_counter() - start_time
+            frames += len(training_frames)
+        return stage_result(seconds, frames, 'frames', videos=len(self.video_paths))
+
+    def merge_link(self):
+        from HDF5_Merger import create_master_hdf5
+
+        if not os.path.isdir(self.per_video_dir):
+            raise SkipStage("needs the write stage's per-video files")
+        start_time = time.perf_counter()
+        create_master_hdf5(self.per_video_dir, self.master_path)
+        return stage_result(time.perf_counter() - start_time, len(self.video_paths), 'videos')
+
+    def merge_copy(self):
+        from HDF5_Merger import copy_data_to_new_hdf5
+
+        if not os.path.exists(self.master_path):
+            raise SkipStage("needs the merge_link stage's master file")
+        start_time = time.perf_counter()
+        copy_data_to_new_hdf5(self.master_path, self.merged_path)
+        return stage_result(time.perf_counter() - start_time, len(self.video_paths), 'videos',
+                            merged_mb=os.path.getsize(self.merged_path) / 2**20)
+
+    def merge_virtual(self):
+        from HDF5_Merger import create_virtual_hdf5
+
+        if not os.path.isdir(self.per_video_dir):
+            raise SkipStage("needs the write stage's per-video files")
+        start_time = time.perf_counter()
+        create_virtual_hdf5(self.per_video_dir, self.virtual_path)
+        build_s = time.perf_counter() - start_time
+        # Nothing changed, so the rebuild reuses the stored scans
+        start_time = time.perf_counter()
+        create_virtual_hdf5(self.per_video_dir, self.virtual_path)
+        return stage_result(build_s, len(self.video_paths), 'videos', rebuild_s=time.perf_counter() - start_time)
+
+    def metadata(self):
+        if not os.path.exists(self.merged_path):
+            raise SkipStage("needs the merge_copy stage's merged file")
+        return [(name, name.split("-")[2]) for name in self.names()]
+
+    def dataset_load(self, hdf5_path=None):
+        from Interface_Model import HDF5Dataset
+
+        metadata = self.metadata()
+        hdf5_dataset = HDF5Dataset(hdf5_path or self.merged_path)
+        start_time = time.perf_counter()
+        for video_name, emotion in metadata:
+            hdf5_dataset(video_name, emotion)
+        seconds = time.perf_counter() - start_time
+        hdf5_dataset.close()
+        return stage_result(seconds, len(metadata), 'samples')
+
+    def dataset_load_virtual(self):
+        if not os.path.exists(self.virtual_path):
+            raise SkipStage("needs the merge_virtual stage's virtual dataset file")
+        return self.dataset_load(self.virtual_path)
+
+    def input_pipeline(self):
+        from Interface_Model import create_tf_dataset
+
+        metadata = self.metadata()
+        dataset = create_tf_dataset(metadata, self.options.batch_size, self.merged_path)
+        # One epoch: the pipeline caches after the first, and its shuffle buffer holds the whole
+        # epoch, so most of the loading shows up in the first batch
+        num_batches = max(len(metadata) // self.options.batch_size, 2)
+        probe = probe_input_pipeline(dataset, num_batches)
+        return stage_result(probe['first_batch_s'] + probe['seconds'], num_batches, 'batches',
+                            first_batch_s=probe['first_batch_s'], batch_size=self.options.batch_size)
+
+    def input_pipeline_augmented(self):
+        import tensorflow as tf
+        from Augmentation import BatchAugmenter, load_augmentation_config
+        from Interface_Model import create_tf_dataset
+        from Normalization_Stats import affine_parameters, compute_normalization_stats
+
+        metadata = self.metadata()
+        config = load_augmentation_config(self.options.augmentation_config)
+        # Mirroring pairs the landmarks on the mean face, so both pipelines use dataset statistics
+        stats = compute_normalization_stats(self.merged_path, metadata)
+        # Two epochs: augmentation runs after the cache, so its cost shows in the second one
+        num_batches = 2 * max(len(metadata) // self.options.batch_size, 2)
+        plain = probe_input_pipeline(create_tf_dataset(metadata, self.options.batch_size, self.merged_path, stats),
+                                     num_batches)
+        dataset = create_tf_dataset(metadata, self.options.batch_size, self.merged_path, stats, augmentation=config)
+        probe = probe_input_pipeline(dataset, num_batches)
+
+        # The augmentation alone, on one batch
+        augment = tf.function(BatchAugmenter(config, affine_parameters(stats)))
+        batch = next(iter(create_tf_dataset(metadata, self.options.batch_size, self.merged_path, stats)))
+        augment(tf.constant(0, dtype=tf.int64), batch)
+        repeats = 20
+        start_time = time.perf_counter()
+        for step in range(1, repeats + 1):
+            augment(tf.constant(step, dtype=tf.int64), batch)
+        augment_ms = 1000 * (time.perf_counter() - start_time) / repeats
+
+        return stage_result(probe['first_batch_s'] + probe['seconds'], num_batches, 'batches',
+                            first_batch_s=probe['first_batch_s'], batch_size=self.options.batch_size,
+                            batches_per_sec=probe['batches_per_sec'], plain_batches_per_sec=plain['batches_per_sec'],
+                            plain_seconds=plain['first_batch_s'] + plain['seconds'], augment_ms_per_batch=augment_ms)
+
+    def train_step(self):
+        from Interface_Model import create_tf_dataset
+        from Emotion_Classifier import create_emotion_classifier
+
+        dataset = create_tf_dataset(self.metadata(), self.options.batch_size, self.merged_path)
+        batches = iter(dataset)
+        model = create_emotion_classifier()
+
+        # The first step traces the graph and is reported separately
+        inputs, labels = next(batches)
+        start_time = time.perf_counter()
+        model.train_on_batch(inputs, labels)
+        first_step_s = time.perf_counter() - start_time
+
+        batches = [next(batches) for _ in range(self.options.steps)]
+        start_time = time.perf_counter()
+        for inputs, labels in batches:
+            model.train_on_batch(inputs, labels)
+        return stage_result(time.perf_counter() - start_time, self.options.steps, 'steps',
+                            first_step_s=first_step_s, batch_size=self.options.batch_size)
+
+    def run(self, stages):
+        """
+        Run the given stages in pipeline order.
+
+        Parameters:
+        stages (list): The stage names.
+
+        Returns:
+        dict: The result of each stage, or the reason it was skipped.
+        """
+        results = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            print(f"Running stage {stage}")
+            try:
+                results[stage] = getattr(self, stage)()
+            except SkipStage as e:
+                results[stage] = {'skipped': str(e)}
+            print(f"  {format_stage(results[stage])}")
+        return results
+
+def environment():
+    """
+    Describe the machine and code version, so that reports of different runs can be compared.
+
+    Returns:
+    dict: The host, platform, Python and package versions, CPU count and git commit.
+    """
+    import cv2
+    import h5py
+    import librosa
+    import numpy as np
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': commit,
+        'packages': {'numpy': np.__version__, 'opencv': cv2.__version__, 'h5py': h5py.__version__,
+                     'librosa': librosa.__version__},
+    }
+
+def format_stage(result):
+    if 'skipped' in result:
+        return f"skipped: {result['skipped']}"
+    per_item = f", {result['ms_per_item']:.2f} ms each" if result['ms_per_item'] else ""
+    return f"{result['seconds']:.3f} s for {result['items']} {result['unit']}{per_item}"
+
+def compare_reports(baseline, current):
+    """
+    Compare the per-item time of each stage between two reports.
+
+    Parameters:
+    baseline (dict): The earlier report.
+    current (dict): The new report.
+
+    Returns:
+    list: (stage, baseline ms per item, current ms per item, speedup) for the stages run in both.
+    """
+    rows = []
+    for stage in STAGES:
+        before = baseline['stages'].get(stage, {}).get('ms_per_item')
+        after = current['stages'].get(stage, {}).get('ms_per_item')
+        if before and after:
+            rows.append((stage, before, after, before / after))
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on a synthetic RAVDESS-style dataset.")
+    parser.add_argument('--videos', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=90, help="Frames per video.")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=3, help="Timed steps of the train_step stage.")
+    parser.add_argument('--landmark-model', help="The MediaPipe face_landmarker.task model, enables the landmarks stage.")
+    parser.add_argument('--decode-width', type=int, help="Decode the frames at this width in the decode and landmarks stages.")
+    parser.add_argument('--crop-face', action='store_true', help="Crop to the previous frame's face in the landmarks stage.")
+    parser.add_argument('--augmentation-config', help="JSON file overriding some of the augmentation settings, "
+                        "for the input_pipeline_augmented stage.")
+    add_mel_arguments(parser)
+    parser.add_argument('--aligner', choices=['stub', 'mfa'], default='stub')
+    parser.add_argument('--mfa-model', default='', help="The MFA acoustic model, for --aligner mfa.")
+    parser.add_argument('--mfa-dictionary', default='', help="The MFA dictionary, for --aligner mfa.")
+    parser.add_argument('--work-dir', help="Keep the synthetic data and stage outputs here instead of a temporary directory.")
+    parser.add_argument('--output', default='pipeline_benchmark.json')
+    parser.add_argument('--compare', help="An earlier report to compare against.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        Instrumentation.reset()
+        benchmark = PipelineBenchmark(work_dir, args)
+        # Generating the videos is not part of any stage
+        Instrumentation.reset()
+        stages = benchmark.run(args.stages)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    options = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'work_dir')}
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'command': sys.argv,
+        'environment': environment(),
+        'options': options,
+        'stages': stages,
+        'instrumentation': Instrumentation.snapshot(),
+    }
+    with open(args.output, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as json_file:
+            baseline = json.load(json_file)
+        if {k: v for k, v in baseline.get('options', {}).items() if k != 'stages'} != \
+                {k: v for k, v in options.items() if k != 'stages'}:
+            print("Warning: the reports were made with different options")
+        for stage, before, after, speedup in compare_reports(baseline, report):
+            print(f"{stage:>15}: {before:10.3f} -> {after:10.3f} ms per item ({speedup:.2f}x)")
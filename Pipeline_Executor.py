@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 20:12:44 2026
+
+Pipelined extraction: each stage of Interface.py (audio + mel, alignment, landmarks,
+assembly with the phonemes and mel segments, and the HDF5 write) runs in its own group
+of worker threads, connected to the next stage by a bounded queue. The first stages
+pass videos on; landmarks, assembly and write pass blocks of a video's frames, so the
+frames in flight stay bounded whatever the length of the videos. While video N is
+being landmarked, video N+1 is being aligned by MFA and video N-1's last frames are
+written. Each stage reports its utilisation, so the bottleneck is the stage closest
+to 100%.
+
+Example:
+    python Pipeline_Executor.py --videos-dir Actor_03 --output out --landmark-model face_landmarker.task \
+        --mfa-model english_mfa.zip --mfa-dictionary english_mfa.dict --workers landmarks=2 --report pipeline.json
+
+@author: Jayyy
+"""
+import argparse
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import Instrumentation
+from Landmark_Keyframer import add_keyframe_arguments, keyframe_options
+from Mel_Engine import add_mel_arguments, mel_options
+
+logger = logging.getLogger(__name__)
+
+# Passed down the queues once a stage has no more items
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline, run by a group of worker threads.
+    """
+    def __init__(self, name, function, workers=1):
+        """
+        Initialize a Stage instance.
+
+        Parameters:
+        name (str): The stage name used in the report.
+        function (callable): Called with each item; its return value is passed on when not None, otherwise the
+            item is. A generator function passes on every value it yields instead, none or several per item.
+        workers (int): The number of worker threads.
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.items = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.wait_input_seconds = 0.0
+        self.wait_output_seconds = 0.0
+
+    def record(self, busy, wait_input, wait_output, failed=False):
+        with self.lock:
+            self.items += 1
+            self.failures += failed
+            self.busy_seconds += busy
+            self.wait_input_seconds += wait_input
+            self.wait_output_seconds += wait_output
+
+    def summary(self, wall_seconds):
+        """
+        Summarise the stage's work over a run.
+
+        Utilisation is the time spent processing items divided by the time available to
+        the stage's workers. A stage that waits on input is starved by the one before it;
+        one that waits on output is blocked by the one after it.
+
+        Parameters:
+        wall_seconds (float): The duration of the run.
+
+        Returns:
+        dict: The items, failures, busy and waiting seconds, and the utilisation.
+        """
+        available = wall_seconds * self.workers
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'failures': self.failures,
+            'busy_seconds': self.busy_seconds,
+            'seconds_per_item': self.busy_seconds / self.items if self.items else None,
+            'wait_input_seconds': self.wait_input_seconds,
+            'wait_output_seconds': self.wait_output_seconds,
+            'utilisation': self.busy_seconds / available if available > 0 else None,
+        }
+
+class PipelineExecutor:
+    """
+    Runs items through a chain of stages connected by bounded queues.
+    """
+    def __init__(self, stages, queue_size=2):
+        """
+        Initialize a PipelineExecutor instance.
+
+        Parameters:
+        stages (list): The Stage objects, in order.
+        queue_size (int): The capacity of each queue between stages, bounding the items in flight.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall_seconds = None
+
+    def _run_worker(self, stage, input_queue, output_queue, remaining, errors):
+        while True:
+            wait_start = time.perf_counter()
+            item = input_queue.get()
+            wait_input = time.perf_counter() - wait_start
+            if item is _DONE:
+                # The last worker of the stage to finish tells the next stage
+                with stage.lock:
+                    remaining[stage.name] -= 1
+                    last = remaining[stage.name] == 0
+                if last:
+                    output_queue.put(_DONE)
+                else:
+                    input_queue.put(_DONE)
+                return
+
+            busy_start = time.perf_counter()
+            wait_output = 0.0
+            try:
+                result = stage.function(item)
+                outputs = result if inspect.isgenerator(result) else [item if result is None else result]
+                for output in outputs:
+                    wait_start = time.perf_counter()
+                    output_queue.put(output)
+                    wait_output += time.perf_counter() - wait_start
+            except Exception as e:
+                busy = time.perf_counter() - busy_start - wait_output
+                logger.error(f"Stage {stage.name} failed: {e}")
+                errors.append({'stage': stage.name, 'item': _describe_item(item), 'error': repr(e)[:500]})
+                stage.record(busy, wait_input, wait_output, failed=True)
+                continue
+            busy = time.perf_counter() - busy_start - wait_output
+            stage.record(busy, wait_input, wait_output)
+
+    def run(self, items):
+        """
+        Run the items through every stage.
+
+        Parameters:
+        items (iterable): The items for the first stage.
+
+        Returns:
+        tuple: The items that came out of the last stage, in completion order, and the failures.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        errors = []
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self._run_worker, name=f"{stage.name}-{worker}",
+                                          args=(stage, queues[index], queues[index + 1], remaining, errors), daemon=True)
+                threads.append(thread)
+
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        results = []
+        # Drain the last queue while feeding the first, so neither end blocks the other
+        collector = threading.Thread(target=self._collect, args=(queues[-1], results), daemon=True)
+        collector.start()
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_DONE)
+
+        collector.join()
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start_time
+        return results, errors
+
+    def _collect(self, output_queue, results):
+        while True:
+            item = output_queue.get()
+            if item is _DONE:
+                return
+            results.append(item)
+
+    def report(self):
+        """
+        Summarise the last run.
+
+        Returns:
+        dict: The wall time, each stage's summary, and the stage with the highest utilisation.
+        """
+        stages = {stage.name: stage.summary(self.wall_seconds) for stage in self.stages}
+        bottleneck = max(stages, key=lambda name: stages[name]['utilisation'] or 0.0)
+        return {'wall_seconds': self.wall_seconds, 'queue_size': self.queue_size, 'stages': stages, 'bottleneck': bottleneck}
+
+def _describe_item(item):
+    if isinstance(item, dict) and 'job' in item:
+        item = item['job']
+    if isinstance(item, dict) and 'video_path' in item:
+        return item['video_path']
+    return repr(item)[:200]
+
+def frame_blocks(job, frames, block_frames):
+    """
+    Group a video's frames into the blocks passed between the landmarks, assemble and write stages.
+
+    A stage that fails marks the job failed and passes on an empty last block, so the
+    stages after it discard what they hold of the video.
+
+    Parameters:
+    job (dict): The video job from Interface.create_video_job.
+    frames (iterable): The video's frames.
+    block_frames (int): The frames per block.
+
+    Yields:
+    dict: The job, a list of at most block_frames frames, and whether it is the video's last block.
+    """
+    block = []
+    try:
+        for frame in frames:
+            if job.get('failed'):
+                return
+            block.append(frame)
+            if len(block) >= block_frames:
+                yield {'job': job, 'frames': block, 'last': False}
+                block = []
+    except Exception:
+        job['failed'] = True
+        yield {'job': job, 'frames': [], 'last': True}
+        raise
+    yield {'job': job, 'frames': block, 'last': True}
+
+def extraction_stages(output_path, landmark_model_path, model_directory, dictionary_path, aligner=None, workers=None,
+                      keyframing=None, decode_width=None, crop_face=False, mel_options=None, block_frames=None):
+    """
+    Build the stages of the extraction pipeline from the steps of Interface.process_video_file.
+
+    Alignment runs before landmarking, so each frame can be assembled as soon as its
+    landmarks are found, and a video is aligned while the previous one is landmarked.
+    The landmarks stage passes on blocks of block_frames frames, which the assemble
+    stage combines with their phonemes and mel segments and the write stage appends to
+    the video's HDF5 file. Those two stages take each video's blocks in order, so they
+    run with a single worker.
+
+    Parameters:
+    output_path (str): The directory under which a folder is created for each video's outputs.
+    landmark_model_path (str): The path to the facial landmark model.
+    model_directory (str): The path to the MFA acoustic model.
+    dictionary_path (str): The path to the MFA pronunciation dictionary.
+    aligner (callable): The forced aligner, run_mfa_alignment when None.
+    workers (dict): Stage name -> number of workers, 1 for stages not given.
+    keyframing (dict): KeyframeSelector arguments to detect landmarks on keyframes only, None for every frame.
+    decode_width (int): The width to decode the frames at for landmarking, None for the full resolution.
+    crop_face (bool): Whether to find the landmarks in a crop around the previous frame's face.
+    mel_options (dict): The mel spectrogram settings, see Interface.run_audio_stage.
+    block_frames (int): The frames per block, the storage configuration's chunk_frames when None.
+
+    Returns:
+    list: The Stage objects, taking video paths and yielding the per-video HDF5 paths.
+    """
+    import Interface
+    from Storage_Controller import load_storage_config
+
+    aligner = aligner or Interface.run_mfa_alignment
+    workers = workers or {}
+    block_frames = block_frames or load_storage_config()['chunk_frames']
+    ordered = [name for name in ('assemble', 'write') if workers.get(name, 1) != 1]
+    if ordered:
+        raise ValueError(f"extraction_stages - the {' and '.join(ordered)} stage takes each video's blocks in order, "
+                         "so it runs with a single worker")
+    # The write stage's open files, by HDF5 path
+    writers = {}
+
+    def audio(video_path):
+        job = Interface.create_video_job(video_path, output_path)
+        Interface.run_audio_stage(job, mel_options=mel_options)
+        return job
+
+    def landmarks(job):
+        frame_landmarks = Interface.iter_frame_landmarks(job, landmark_model_path, keyframing=keyframing,
+                                                         decode_width=decode_width, crop_face=crop_face)
+        try:
+            yield from frame_blocks(job, frame_landmarks, block_frames)
+        finally:
+            # Hands the landmarker back to the pool when a failed video stops early
+            frame_landmarks.close()
+
+    def assemble(block):
+        job = block['job']
+        try:
+            if job.get('failed'):
+                # The end of a failed video tells the write stage to discard its file
+                if block['last']:
+                    yield {'job': job, 'frames': [], 'last': True}
+                return
+            frames = [Interface.assemble_training_frame(job, *frame) for frame in block['frames']]
+            yield {'job': job, 'frames': frames, 'last': block['last']}
+        except Exception:
+            job['failed'] = True
+            yield {'job': job, 'frames': [], 'last': True}
+            raise
+        finally:
+            if block['last'] or job.get('failed'):
+                Interface.release_audio(job)
+
+    def write(block):
+        job = block['job']
+        path = job['hdf5_path']
+        try:
+            if job.get('failed'):
+                if path in writers:
+                    writers.pop(path).abort()
+                return
+            if path not in writers:
+                writers[path] = Interface.TrainingFrameWriter(job)
+            for frame in block['frames']:
+                writers[path].append(frame)
+            if block['last']:
+                yield writers.pop(path).commit()
+        except Exception:
+            job['failed'] = True
+            if path in writers:
+                writers.pop(path).abort()
+            raise
+
+    stage_functions = [
+        ('audio', audio),
+        ('alignment', lambda job: Interface.run_alignment_stage(job, model_directory, dictionary_path, aligner)),
+        ('landmarks', landmarks),
+        ('assemble', assemble),
+        ('write', write),
+    ]
+    return [Stage(name, function, workers.get(name, 1)) for name, function in stage_functions]
+
+def parse_workers(values):
+    """
+    Parse stage=count worker settings.
+
+    Parameters:
+    values (list): Strings such as 'landmarks=2'.
+
+    Returns:
+    dict: Stage name -> number of workers.
+    """
+    workers = {}
+    for value in values or []:
+        name, _, number = value.partition('=')
+        workers[name] = int(number)
+    return workers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract training frames from RAVDESS videos with a pipelined executor.")
+    parser.add_argument('--videos-dir', required=True, help="The directory holding the videos.")
+    parser.add_argument('--output', required=True, help="The directory the per-video outputs are written to.")
+    parser.add_argument('--landmark-model', required=True, help="The MediaPipe face_landmarker.task model.")
+    parser.add_argument('--mfa-model', default='', help="The MFA acoustic model.")
+    parser.add_argument('--mfa-dictionary', default='', help="The MFA pronunciation dictionary.")
+    parser.add_argument('--stub-aligner', action='store_true', help="Spread the phones evenly instead of running MFA.")
+    parser.add_argument('--workers', nargs='*', help="Workers per stage, e.g. landmarks=2 alignment=2.")
+    parser.add_argument('--queue-size', type=int, default=2, help="The videos or frame blocks each queue between stages holds.")
+    parser.add_argument('--block-frames', type=int, help="The frames per block passed between the landmarks, assemble "
+                                                         "and write stages, the storage chunk_frames by default.")
+    add_keyframe_arguments(parser)
+    parser.add_argument('--decode-width', type=int, help="Decode the frames at this width for landmarking, e.g. 640.")
+    parser.add_argument('--crop-face', action='store_true', help="Find the landmarks in a crop around the previous frame's face.")
+    add_mel_arguments(parser)
+    parser.add_argument('--report', help="Write the utilisation report to this JSON file.")
+    parser.add_argument('--metrics-out', help="Write per-stage timings to this file, as Prometheus text for .prom/.txt and JSON otherwise.")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    from Aligner import run_stub_alignment
+    from Interface import split_file_name
+
+    # Only videos with audio
+    video_paths = [os.path.join(args.videos_dir, video) for video in sorted(os.listdir(args.videos_dir))
+                   if split_file_name(os.path.splitext(video)[0])[0] == "01"]
+
+    stages = extraction_stages(args.output, args.landmark_model, args.mfa_model, args.mfa_dictionary,
+                               aligner=run_stub_alignment if args.stub_aligner else None, workers=parse_workers(args.workers),
+                               keyframing=keyframe_options(args), decode_width=args.decode_width, crop_face=args.crop_face,
+                               mel_options=mel_options(args), block_frames=args.block_frames)
+    executor = PipelineExecutor(stages, args.queue_size)
+    hdf5_paths, errors = executor.run(video_paths)
+
+    from Face_Landmark_Generator import landmarker_pool
+    landmarker_pool.close()
+
+    report = executor.report()
+    report['videos'] = len(video_paths)
+    report['errors'] = errors
+    report['landmarker'] = {'loads': landmarker_pool.loads, 'reuses': landmarker_pool.reuses,
+                            'setup_seconds': landmarker_pool.setup_seconds}
+    print(f"Extracted {len(hdf5_paths)}/{len(video_paths)} videos in {report['wall_seconds']:.1f} s")
+    for name, summary in report['stages'].items():
+        print(f"{name:>10}: {summary['workers']} workers, {summary['items']} items, "
+              f"utilisation {summary['utilisation']:.0%}, waiting {summary['wait_input_seconds']:.1f} s on input "
+              f"and {summary['wait_output_seconds']:.1f} s on output")
+    print(f"Bottleneck: {report['bottleneck']}")
+    print(f"Landmarker: {landmarker_pool.loads} loaded, {landmarker_pool.reuses} reused, "
+          f"{landmarker_pool.setup_seconds:.2f} s of setup")
+
+    if args.report:
+        with open(args.report, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    if args.metrics_out:
+        Instrumentation.dump(args.metrics_out)
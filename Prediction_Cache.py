@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:02:36 2026
+
+A content-addressed cache in front of inference. Extracted features (the per-video
+HDF5 file) are keyed by a hash of the video bytes and the extractor configuration;
+predictions are keyed by the feature key and the model configuration. A model change
+therefore reuses the cached features and skips ffmpeg, MediaPipe, librosa and MFA.
+The cache is bounded in size on local disk with least-recently-used eviction and keeps
+hit-rate statistics.
+
+Example:
+    python Prediction_Cache.py --model model.keras --cache-dir cache/ video1.mp4 video2.mp4
+
+@author: Jayyy
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from Mel_Engine import DEFAULT_MEL_OPTIONS, add_mel_arguments, mel_options
+from Normalization_Stats import affine_parameters, apply_normalization, load_model_stats, model_stats_path
+
+# Bump when a change to the extraction code changes the features it produces
+EXTRACTOR_VERSION = 2
+
+EMOTION_NAMES = {
+    '01': 'neutral', '02': 'calm', '03': 'happy', '04': 'sad',
+    '05': 'angry', '06': 'fearful', '07': 'disgust', '08': 'surprised'
+}
+
+FEATURES = 'features'
+PREDICTIONS = 'predictions'
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 of a file's contents.
+
+    Parameters:
+    path (str): The path to the file.
+    chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+    str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_config(config):
+    """
+    Compute a stable SHA-256 of a JSON-serialisable configuration.
+
+    Parameters:
+    config (dict): The configuration.
+
+    Returns:
+    str: The hex digest.
+    """
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def hash_model(model_path):
+    """
+    Hash a saved model, either a model file or a directory of training checkpoints.
+
+    Parameters:
+    model_path (str): The path to the model file or checkpoint directory.
+
+    Returns:
+    str: The hex digest.
+    """
+    if not os.path.isdir(model_path):
+        return hash_file(model_path)
+
+    import tensorflow as tf
+    latest = tf.train.latest_checkpoint(model_path)
+    if latest is None:
+        raise FileNotFoundError(f"No checkpoint found in {model_path}")
+    digest = hashlib.sha256(os.path.basename(latest).encode('utf-8'))
+    for checkpoint_file in sorted(os.listdir(model_path)):
+        if checkpoint_file.startswith(os.path.basename(latest) + '.'):
+            digest.update(hash_file(os.path.join(model_path, checkpoint_file)).encode('utf-8'))
+    return digest.hexdigest()
+
+def extractor_config(landmark_model_path, model_directory, dictionary_path, mel_options=None):
+    """
+    Describe the feature extractor, so that any change to its models or mel settings invalidates cached features.
+
+    Parameters:
+    landmark_model_path (str): The path to the facial landmark model.
+    model_directory (str): The path to the MFA acoustic model.
+    dictionary_path (str): The path to the MFA pronunciation dictionary.
+    mel_options (dict): The mel spectrogram settings, see Interface.run_audio_stage.
+
+    Returns:
+    dict: The extractor configuration.
+    """
+    return {
+        'extractor_version': EXTRACTOR_VERSION,
+        'landmark_model': hash_file(landmark_model_path),
+        'mfa_acoustic_model': hash_file(model_directory) if os.path.isfile(model_directory) else model_directory,
+        'mfa_dictionary': hash_file(dictionary_path),
+        'mel': {**DEFAULT_MEL_OPTIONS, **(mel_options or {})},
+    }
+
+
+class PredictionCache:
+    """
+    A size-bounded, content-addressed on-disk cache of extracted features and predictions.
+
+    Entries are tracked in an SQLite index holding their size and last access time, so
+    the cache can be shared by several processes on the same machine.
+    """
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        """
+        Initialize a PredictionCache instance.
+
+        Parameters:
+        cache_dir (str): The directory holding the cache.
+        max_bytes (int): The maximum total size of the cached entries in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        for kind in (FEATURES, PREDICTIONS):
+            os.makedirs(os.path.join(cache_dir, kind), exist_ok=True)
+
+        self.index_path = os.path.join(cache_dir, 'index.sqlite')
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, kind TEXT, path TEXT, size INTEGER, last_access REAL)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS stats (kind TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)")
+            for kind in (FEATURES, PREDICTIONS):
+                connection.execute("INSERT OR IGNORE INTO stats VALUES (?, 0, 0)", (kind,))
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    @staticmethod
+    def feature_key(video_hash, extractor_config):
+        """
+        Return the key of a video's features.
+
+        Parameters:
+        video_hash (str): The hash of the video bytes.
+        extractor_config (dict): The extractor configuration.
+
+        Returns:
+        str: The feature key.
+        """
+        return hash_config({'video': video_hash, 'extractor': extractor_config})
+
+    @staticmethod
+    def prediction_key(feature_key, model_config):
+        """
+        Return the key of a prediction made from cached features.
+
+        Parameters:
+        feature_key (str): The key of the features the prediction is made from.
+        model_config (dict): The model configuration, including the hash of its weights.
+
+        Returns:
+        str: The prediction key.
+        """
+        return hash_config({'features': feature_key, 'model': model_config})
+
+    def _lookup(self, kind, key):
+        """
+        Look an entry up, recording a hit or miss and refreshing its last access time.
+
+        Returns:
+        str: The path of the entry, or None on a miss.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT path FROM entries WHERE key = ? AND kind = ?", (key, kind)).fetchone()
+            if row is not None and not os.path.exists(row[0]):
+                # Removed from disk behind the cache's back
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                connection.execute("UPDATE stats SET misses = misses + 1 WHERE kind = ?", (kind,))
+                return None
+
+            connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            connection.execute("UPDATE stats SET hits = hits + 1 WHERE kind = ?", (kind,))
+            return row[0]
+
+    def _store(self, kind, key, path):
+        """
+        Record a newly written entry and evict least recently used entries over the size limit.
+        """
+        size = os.path.getsize(path)
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (key, kind, path, size, time.time()))
+        # The entry just stored is kept even when it alone is over the limit, its path is about to be returned
+        self.evict(keep=key)
+
+    def get_features(self, key):
+        """
+        Get the path of cached features.
+
+        Parameters:
+        key (str): The feature key.
+
+        Returns:
+        str: The path of the cached HDF5 features, or None on a miss.
+        """
+        return self._lookup(FEATURES, key)
+
+    def put_features(self, key, hdf5_path, move=False):
+        """
+        Copy or move extracted features into the cache.
+
+        Parameters:
+        key (str): The feature key.
+        hdf5_path (str): The path of the per-video HDF5 file produced by extraction.
+        move (bool): Whether to move the file rather than copy it.
+
+        Returns:
+        str: The path of the cached file.
+        """
+        path = os.path.join(self.cache_dir, FEATURES, key + '.hdf5')
+        # Copy then rename so readers never see a partially written file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        if move:
+            shutil.move(hdf5_path, temp_path)
+        else:
+            shutil.copyfile(hdf5_path, temp_path)
+        os.replace(temp_path, path)
+        self._store(FEATURES, key, path)
+        return path
+
+    def get_prediction(self, key):
+        """
+        Get a cached prediction.
+
+        Parameters:
+        key (str): The prediction key.
+
+        Returns:
+        dict: The cached prediction, or None on a miss.
+        """
+        path = self._lookup(PREDICTIONS, key)
+        if path is None:
+            return None
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+
+    def put_prediction(self, key, prediction):
+        """
+        Store a prediction in the cache.
+
+        Parameters:
+        key (str): The prediction key.
+        prediction (dict): The JSON-serialisable prediction.
+        """
+        path = os.path.join(self.cache_dir, PREDICTIONS, key + '.json')
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(prediction, json_file)
+        os.replace(temp_path, path)
+        self._store(PREDICTIONS, key, path)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits within max_bytes.
+
+        Parameters:
+        keep (str): The key of an entry never evicted, such as one just stored.
+
+        Returns:
+        int: The number of entries evicted.
+        """
+        evicted = 0
+        with self._connect() as connection:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            for key, path, size in connection.execute("SELECT key, path, size FROM entries ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        return evicted
+
+    def stats(self):
+        """
+        Return the hit-rate statistics and current size of the cache.
+
+        Returns:
+        dict: Hits, misses and hit rate per kind, plus entry count and total bytes.
+        """
+        with self._connect() as connection:
+            stats = {}
+            for kind, hits, misses in connection.execute("SELECT kind, hits, misses FROM stats"):
+                lookups = hits + misses
+                stats[kind] = {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0}
+            entries, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats['entries'] = entries
+        stats['bytes'] = total
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+def predict_features(model, features_path, stats=None):
+    """
+    Predict the emotion of a video from its extracted features.
+
+    Parameters:
+    model (tf.keras.Model): The emotion classifier.
+    features_path (str): The video's HDF5 file, as written during extraction.
+    stats (dict): The normalisation statistics the model was trained with, None for per-frame normalisation.
+
+    Returns:
+    dict: The predicted emotion id and name and the probability of each emotion.
+    """
+    from Interface_Model import load_video_sample, model_inputs
+
+    (landmarks, mels, phonemes, length), _ = load_video_sample(features_path, stats, sequence_lengths=True)
+    if stats is not None:
+        landmarks, mels = apply_normalization(landmarks, mels, affine_parameters(stats))
+    inputs = model_inputs(model, landmarks[None, ...], mels[None, ...], phonemes[None, ...], [length])
+    probabilities = model.predict(inputs, verbose=0)[0]
+
+    emotion = f"{int(probabilities.argmax()) + 1:02d}"
+    return {
+        'emotion': emotion,
+        'emotion_name': EMOTION_NAMES[emotion],
+        'probabilities': {EMOTION_NAMES[f"{i + 1:02d}"]: float(p) for i, p in enumerate(probabilities)},
+    }
+
+
+class CachedPredictor:
+    """
+    Predict the emotion of videos, reusing cached features and predictions where possible.
+    """
+    def __init__(self, cache, model_path, landmark_model_path, model_directory, dictionary_path, work_dir=None,
+                 mel_options=None):
+        """
+        Initialize a CachedPredictor instance.
+
+        Parameters:
+        cache (PredictionCache): The cache.
+        model_path (str): A saved Keras model file, or a directory of training checkpoints.
+        landmark_model_path (str): The path to the facial landmark model.
+        model_directory (str): The path to the MFA acoustic model.
+        dictionary_path (str): The path to the MFA pronunciation dictionary.
+        work_dir (str): The directory each extraction's temporary directory is created in, the system's when None.
+        mel_options (dict): The mel spectrogram settings, see Interface.run_audio_stage.
+        """
+        self.cache = cache
+        self.model_path = model_path
+        self.landmark_model_path = landmark_model_path
+        self.model_directory = model_directory
+        self.dictionary_path = dictionary_path
+        self.work_dir = work_dir
+        if work_dir:
+            os.makedirs(work_dir, exist_ok=True)
+        self.mel_options = mel_options
+        self.extractor_config = extractor_config(landmark_model_path, model_directory, dictionary_path, mel_options)
+        self.model_config = {'model': hash_model(model_path)}
+        # The normalisation statistics the model was trained with, None for per-frame normalisation
+        self.stats = load_model_stats(model_path)
+        if self.stats is not None:
+            self.model_config['normalization'] = hash_file(model_stats_path(model_path))
+        self.model = None
+
+    def _load_model(self):
+        if self.model is None:
+            from Interface_Model import load_trained_model
+            self.model = load_trained_model(self.model_path)
+        return self.model
+
+    def features(self, video_path, video_hash=None):
+        """
+        Get a video's features from the cache, extracting and caching them on a miss.
+
+        Parameters:
+        video_path (str): The path to the video.
+        video_hash (str): The hash of the video bytes, computed when None.
+
+        Returns:
+        tuple: The feature key and the path of the cached HDF5 features.
+        """
+        if video_hash is None:
+            video_hash = hash_file(video_path)
+        key = self.cache.feature_key(video_hash, self.extractor_config)
+        path = self.cache.get_features(key)
+        if path is None:
+            from Interface import process_video_file
+            # The audio, TextGrid and other intermediate outputs are deleted with the directory
+            with tempfile.TemporaryDirectory(prefix='extraction_', dir=self.work_dir) as extraction_dir:
+                hdf5_path = process_video_file(video_path, extraction_dir, self.landmark_model_path,
+                                               self.model_directory, self.dictionary_path, mel_options=self.mel_options)
+                path = self.cache.put_features(key, hdf5_path, move=True)
+        return key, path
+
+    def predict(self, video_path):
+        """
+        Predict the emotion expressed in a video.
+
+        Parameters:
+        video_path (str): The path to the video.
+
+        Returns:
+        dict: The predicted emotion id and name and the probability of each emotion.
+        """
+        video_hash = hash_file(video_path)
+        feature_key = self.cache.feature_key(video_hash, self.extractor_config)
+        prediction_key = self.cache.prediction_key(feature_key, self.model_config)
+
+        prediction = self.cache.get_prediction(prediction_key)
+        if prediction is not None:
+            return prediction
+
+        _, features_path = self.features(video_path, video_hash)
+        prediction = dict(video_hash=video_hash, **predict_features(self._load_model(), features_path, self.stats))
+        self.cache.put_prediction(prediction_key, prediction)
+        return prediction
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict the emotion of videos through the prediction cache.")
+    parser.add_argument('videos', nargs='*', help="The videos to score.")
+    parser.add_argument('--model', help="A saved Keras model file, or a directory of training checkpoints.")
+    parser.add_argument('--cache-dir', default='prediction_cache')
+    parser.add_argument('--max-size-mb', type=float, default=10 * 1024)
+    parser.add_argument('--landmark-model', default='E:/projects/face/spyder_project/face/face_landmarker.task')
+    parser.add_argument('--mfa-model', default='E:/projects/face/MFA/pretrained_models/acoustic/english_mfa.zip')
+    parser.add_argument('--mfa-dictionary', default='E:/projects/face/MFA/pretrained_models/dictionary/english_mfa.dict')
+    parser.add_argument('--stats', action='store_true', help="Print the cache statistics.")
+    add_mel_arguments(parser)
+    args = parser.parse_args()
+
+    cache = PredictionCache(args.cache_dir, int(args.max_size_mb * 1024 * 1024))
+    if args.videos:
+        if not args.model:
+            parser.error("--model is required to score videos")
+        predictor = CachedPredictor(cache, args.model, args.landmark_model, args.mfa_model, args.mfa_dictionary,
+                                    mel_options=mel_options(args))
+        for video_path in args.videos:
+            prediction = predictor.predict(video_path)
+            print(f"{video_path}: {prediction['emotion_name']} ({prediction['probabilities'][prediction['emotion_name']]:.2f})")
+    if args.stats or not args.videos:
+        print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 03:41:12 2026
+
+Compare training on sequences padded or truncated to sequence_length with training on
+variable-length sequences, bucketed by length and masked. Each mode trains the same
+model variant on the same split for the same number of epochs, and the report gives
+the median training step time, the samples per second, the share of the frames fed to
+the model that are padding, the share of the clips' frames lost to truncation, and the
+accuracy and loss on the test split.
+
+The modes:
+    fixed     the original model, every sample padded or truncated to sequence_length
+    padded    the masked model for sequences of any length, on the same fixed-length batches
+    variable  the masked model on samples of their own length, bucketed by length
+
+padded separates the effect of the masked model from that of the bucketing. Batches
+of each new length are traced once, so the first epoch is left out of the timings.
+
+Example:
+    python Sequence_Benchmark.py --hdf5 training_data/merged_data_file.hdf5 --epochs 5 --output benchmarks/sequences.json
+    python Sequence_Benchmark.py --hdf5 merged.hdf5 --variant mel_conv1d --modes fixed variable --max-length 150
+
+@author: Jayyy
+"""
+import argparse
+import time
+
+import numpy as np
+
+from Interface_Model import create_tf_dataset, dataset_metadata, sequence_length, split_metadata
+from Model_Benchmark import load_variants, summarise_times, write_report
+from Normalization_Stats import load_or_compute_stats
+from Storage_Controller_Model import VirtualView, open_dataset
+
+# Mode name -> the model's sequence_length and whether the batches keep the samples' own lengths;
+# the masked model also takes each sample's number of frames
+MODES = {
+    'fixed': {'sequence_length': sequence_length, 'variable_length': False},
+    'padded': {'sequence_length': None, 'variable_length': False},
+    'variable': {'sequence_length': None, 'variable_length': True},
+}
+
+
+def sample_lengths(hdf5_path, metadata):
+    """
+    Count the frames of each sample.
+
+    Parameters:
+    hdf5_path (str): The merged HDF5 file or virtual dataset file.
+    metadata (list): The (video_name, emotion) pairs.
+
+    Returns:
+    np.ndarray: The number of frames of each sample.
+    """
+    with open_dataset(hdf5_path) as reader:
+        if isinstance(reader, VirtualView):
+            # The offsets table already holds the lengths
+            frame_counts = np.diff(reader.frame_offsets)
+            return np.array([frame_counts[reader.index[(video_name, int(emotion))]] for video_name, emotion in metadata])
+        return np.array([len(reader.read(video_name, emotion)[0]) for video_name, emotion in metadata])
+
+def count_batches(dataset, num_samples):
+    """
+    Read one pass over a repeated dataset, filling its cache.
+
+    Padding frames are those past each sample's number of frames, or without it in the
+    inputs, those whose normalised landmarks are all zero.
+
+    Parameters:
+    dataset (tf.data.Dataset): The dataset, from create_tf_dataset.
+    num_samples (int): The number of samples in a pass.
+
+    Returns:
+    dict: The batches, samples, frames, padding frames and distinct batch lengths of a pass.
+    """
+    counts = {'batches': 0, 'samples': 0, 'frames': 0, 'padding_frames': 0}
+    batch_lengths = set()
+    iterator = iter(dataset)
+    while counts['samples'] < num_samples:
+        (landmarks, _, _, *lengths), _ = next(iterator)
+        landmarks = landmarks.numpy()
+        frames = landmarks.shape[0] * landmarks.shape[1]
+        counts['batches'] += 1
+        counts['samples'] += landmarks.shape[0]
+        counts['frames'] += frames
+        if lengths:
+            counts['padding_frames'] += frames - int(lengths[0].numpy().sum())
+        else:
+            counts['padding_frames'] += int(np.sum(~landmarks.any(axis=(2, 3))))
+        batch_lengths.add(landmarks.shape[1])
+    # The cache is only complete once the end of the pass has been read
+    next(iterator)
+    counts['batch_lengths'] = len(batch_lengths)
+    return counts
+
+def train_epochs(model, dataset, batches, epochs):
+    """
+    Train a model for a number of passes over a dataset, timing every step.
+
+    Parameters:
+    model (tf.keras.Model): The compiled model.
+    dataset (tf.data.Dataset): The repeated training dataset.
+    batches (int): The number of batches in a pass.
+    epochs (int): The number of passes.
+
+    Returns:
+    tuple: The step durations of each epoch, in seconds, and the last step's loss and accuracy.
+    """
+    iterator = iter(dataset)
+    epoch_times = []
+    for epoch in range(epochs):
+        times = []
+        for _ in range(batches):
+            inputs, labels = next(iterator)
+            start_time = time.perf_counter()
+            logs = model.train_on_batch(inputs, labels, return_dict=True)
+            times.append(time.perf_counter() - start_time)
+        epoch_times.append(times)
+        print(f"  epoch {epoch + 1}/{epochs}: {sum(times):.2f} s, loss {logs['loss']:.4f}, accuracy {logs['accuracy']:.4f}")
+    return epoch_times, logs
+
+def run_mode(mode, hdf5_path, train_metadata, test_metadata, stats, model_kwargs, options):
+    """
+    Train and evaluate a model in one of MODES.
+
+    Parameters:
+    mode (str): The mode name.
+    hdf5_path (str): The merged HDF5 file or virtual dataset file.
+    train_metadata (list): The training samples.
+    test_metadata (list): The test samples.
+    stats (dict): The normalisation statistics of the training split.
+    model_kwargs (dict): Keyword arguments for create_emotion_classifier.
+    options (dict): The batch_size, epochs, seed, max_length and bucket_width.
+
+    Returns:
+    dict: The mode's measurements.
+    """
+    import tensorflow as tf
+    from Emotion_Classifier import create_emotion_classifier
+
+    settings = MODES[mode]
+    lengths = {'variable_length': settings['variable_length'], 'bucket_width': options['bucket_width'],
+               'max_length': options['max_length'] if settings['variable_length'] else None,
+               'sequence_lengths': settings['sequence_length'] is None}
+    train_dataset = create_tf_dataset(train_metadata, options['batch_size'], hdf5_path, stats, **lengths)
+    test_dataset = create_tf_dataset(test_metadata, options['batch_size'], hdf5_path, stats, **lengths)
+    train_counts = count_batches(train_dataset, len(train_metadata))
+    test_counts = count_batches(test_dataset, len(test_metadata))
+
+    # The same initial weights in every mode
+    tf.keras.utils.set_random_seed(options['seed'])
+    model = create_emotion_classifier(**model_kwargs, sequence_length=settings['sequence_length'])
+    epoch_times, logs = train_epochs(model, train_dataset, train_counts['batches'], options['epochs'])
+    test_loss, test_accuracy = model.evaluate(test_dataset, steps=test_counts['batches'], verbose=0)
+
+    # The first epoch traces every batch length
+    measured = epoch_times[1:] if len(epoch_times) > 1 else epoch_times
+    step_times = [step_time for times in measured for step_time in times]
+    limit = lengths['max_length'] if settings['variable_length'] else sequence_length
+    true_lengths = sample_lengths(hdf5_path, train_metadata)
+    kept_frames = np.minimum(true_lengths, limit).sum() if limit else true_lengths.sum()
+
+    return {
+        'mode': mode,
+        'train_batches': train_counts['batches'],
+        'batch_lengths': train_counts['batch_lengths'],
+        'step': summarise_times(step_times),
+        'samples_per_sec': len(train_metadata) * len(measured) / sum(step_times),
+        'first_epoch_seconds': sum(epoch_times[0]),
+        'padding_fraction': train_counts['padding_frames'] / train_counts['frames'],
+        'truncated_fraction': 1.0 - float(kept_frames) / float(true_lengths.sum()),
+        'train_loss': float(logs['loss']),
+        'train_accuracy': float(logs['accuracy']),
+        'test_loss': float(test_loss),
+        'test_accuracy': float(test_accuracy),
+    }
+
+def print_table(results):
+    """
+    Print the measurements of each mode side by side.
+
+    Parameters:
+    results (list): The run_mode results.
+    """
+    print(f"{'mode':<10}{'step p50 ms':>12}{'samples/s':>11}{'padding':>9}{'truncated':>11}"
+          f"{'lengths':>9}{'test acc':>10}{'test loss':>11}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['step']['p50_ms']:>12.1f}{result['samples_per_sec']:>11.1f}"
+              f"{result['padding_fraction']:>9.1%}{result['truncated_fraction']:>11.1%}{result['batch_lengths']:>9}"
+              f"{result['test_accuracy']:>10.3f}{result['test_loss']:>11.4f}")
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Compare training on fixed-length and variable-length sequences.")
+    parser.add_argument('--hdf5', required=True, help="The merged HDF5 dataset.")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--variant', default='baseline', help="The model variant, see Model_Benchmark.py.")
+    parser.add_argument('--variants', help="JSON file mapping variant names to create_emotion_classifier kwargs.")
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the train/test split and of the weights.")
+    parser.add_argument('--max-length', type=int, help="Truncate variable-length samples to this many frames.")
+    parser.add_argument('--bucket-width', type=int, default=8, help="The range of lengths batched together, in frames.")
+    parser.add_argument('--output', default='benchmarks/sequence_benchmark.json', help="Path of the JSON report.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model_kwargs = load_variants(args.variants, [args.variant])[args.variant]
+    options = {
+        'variant': args.variant,
+        'model': model_kwargs,
+        'batch_size': args.batch_size,
+        'epochs': args.epochs,
+        'seed': args.seed,
+        'max_length': args.max_length,
+        'bucket_width': args.bucket_width,
+    }
+
+    train_metadata, test_metadata = split_metadata(dataset_metadata(args.hdf5), seed=args.seed)
+    stats = load_or_compute_stats(args.hdf5, train_metadata)
+    results = []
+    for mode in args.modes:
+        print(f"Training in {mode} mode")
+        results.append(run_mode(mode, args.hdf5, train_metadata, test_metadata, stats, model_kwargs, options))
+
+    print_table(results)
+    write_report(results, options, args.output)
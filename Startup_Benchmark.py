@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:31:06 2026
+
+Measure the startup time of every entry point: the time to import the module in a fresh
+interpreter, which heavy libraries that import pulls in, and the wall time of
+`python <script> --help`. Heavy libraries (TensorFlow, MediaPipe, librosa, matplotlib)
+should only load once a code path that needs them runs.
+
+Example:
+    python Startup_Benchmark.py --repeats 5 --output startup.json
+
+@author: Jayyy
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+ENTRY_POINTS = ['Interface', 'Interface_Model', 'Model_Benchmark', 'Launch_Local_Workers', 'Prediction_Cache',
+                'Ingestion_Service', 'Pipeline_Benchmark', 'Synthetic_Data_Generator', 'Pipeline_Executor',
+                'Keyframe_Evaluation', 'Mel_Engine', 'Normalization_Stats', 'HDF5_Merger', 'Storage_Tuner',
+                'Hyperparameter_Search', 'Distillation', 'Landmark_Renderer', 'Sequence_Benchmark', 'Startup_Benchmark']
+HEAVY_MODULES = ['tensorflow', 'mediapipe', 'librosa', 'matplotlib', 'scipy', 'numba']
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, heavy_modules=HEAVY_MODULES):
+    """
+    Import a module in a fresh interpreter.
+
+    Parameters:
+    module (str): The module name.
+    heavy_modules (list): The libraries to check for after the import.
+
+    Returns:
+    dict: The import time in seconds and the heavy libraries it loaded.
+    """
+    code = IMPORT_PROBE.format(module=module, heavy=list(heavy_modules))
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"measure_import - importing {module} failed: {result.stderr.strip()[-500:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure_help(module):
+    """
+    Time `python <module>.py --help` in a fresh interpreter, including interpreter startup.
+
+    Parameters:
+    module (str): The module name.
+
+    Returns:
+    float: The wall time in seconds.
+    """
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(ROOT, module + '.py'), '--help'], cwd=ROOT,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f"measure_help - {module}.py --help failed: {result.stderr.strip()[-500:]}")
+    return elapsed
+
+def benchmark_entry_point(module, repeats=3):
+    """
+    Measure the import and --help times of an entry point.
+
+    Parameters:
+    module (str): The module name.
+    repeats (int): The number of fresh interpreters per measurement.
+
+    Returns:
+    dict: The median and minimum import and --help times, and the heavy libraries loaded on import.
+    """
+    imports = [measure_import(module) for _ in range(repeats)]
+    helps = [measure_help(module) for _ in range(repeats)]
+    import_seconds = [result['seconds'] for result in imports]
+    return {
+        'import_median_s': statistics.median(import_seconds),
+        'import_min_s': min(import_seconds),
+        'help_median_s': statistics.median(helps),
+        'help_min_s': min(helps),
+        'heavy_modules_loaded': imports[-1]['loaded'],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the startup time of every entry point.")
+    parser.add_argument('--modules', nargs='+', default=ENTRY_POINTS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    # The bare interpreter startup, for reference
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    results = {'interpreter_s': time.perf_counter() - start_time}
+    print(f"{'interpreter':>25}: {results['interpreter_s']:.3f} s")
+
+    for module in args.modules:
+        results[module] = benchmark_entry_point(module, args.repeats)
+        entry = results[module]
+        loaded = ", ".join(entry['heavy_modules_loaded']) or "none"
+        print(f"{module:>25}: import {entry['import_median_s']:.3f} s, --help {entry['help_median_s']:.3f} s, heavy modules: {loaded}")
+
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        print(f"Results written to {args.output}")
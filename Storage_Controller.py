@@ -1,5 +1,19 @@
 import h5py
+import json
 import numpy as np
+import logging
+import os
+from Instrumentation import timer, count
+from Storage_Controller_Model import STREAM_LAYOUT, read_frames
+
+logger = logging.getLogger(__name__)
+
+# Written by Storage_Tuner.py; without it datasets are stored contiguous and uncompressed
+STORAGE_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage_config.json')
+DEFAULT_STORAGE_CONFIG = {'compression': None, 'compression_opts': None, 'shuffle': False, 'libver': 'earliest',
+                          'chunk_frames': 64}
+# Frames without a face are stored as zeros with detected False
+NUM_LANDMARKS = 478
 
 phoneme_to_int = {
     "a": 0, "aj": 1, "aw": 2, "aː": 3, "b": 4, "bʲ": 5, "c": 6, "cʰ": 7, "cʷ": 8,
@@ -15,25 +29,218 @@ phoneme_to_int = {
 }
 int_to_phoneme = {v: k for k, v in phoneme_to_int.items()}
 
+def load_storage_config(path=None):
+    """
+    Load the storage settings of the HDF5 datasets.
+    
+    Parameters:
+    path (str): The storage configuration file, STORAGE_CONFIG_PATH when None.
+    
+    Returns:
+    dict: The compression filter, its level, whether to apply the shuffle filter, the oldest
+        file format version (libver) objects are written with, and the frames per chunk
+        (chunk_frames) of the stream datasets, which is also the block the writer appends. With
+        'latest', a dataset stored as a single chunk needs no chunk B-tree, which otherwise
+        outweighs what compression saves on small datasets.
+    """
+    path = path or STORAGE_CONFIG_PATH
+    config = dict(DEFAULT_STORAGE_CONFIG)
+    if os.path.exists(path):
+        with open(path, 'r') as json_file:
+            stored = json.load(json_file)
+        config.update({key: stored[key] for key in DEFAULT_STORAGE_CONFIG if key in stored})
+    return config
+
+def save_storage_config(config, path=None, **extra):
+    """
+    Save the storage settings of the HDF5 datasets.
+    
+    Parameters:
+    config (dict): The storage settings, see load_storage_config.
+    path (str): The storage configuration file, STORAGE_CONFIG_PATH when None.
+    **extra: Other entries to record alongside the settings, such as how they were chosen.
+    """
+    path = path or STORAGE_CONFIG_PATH
+    stored = {key: config.get(key, DEFAULT_STORAGE_CONFIG[key]) for key in DEFAULT_STORAGE_CONFIG}
+    stored.update(extra)
+    with open(path, 'w') as json_file:
+        json.dump(stored, json_file, indent=2)
+
+def dataset_options(config):
+    """
+    Turn storage settings into create_dataset arguments for the array datasets.
+    
+    These are only passed for landmarks and mel, the other datasets being scalars or a few bytes per frame.
+    
+    Parameters:
+    config (dict): The storage settings, see load_storage_config.
+    
+    Returns:
+    dict: The compression, compression_opts and shuffle arguments, empty for uncompressed storage.
+    """
+    options = {}
+    if config.get('compression'):
+        options['compression'] = config['compression']
+        if config.get('compression_opts') is not None:
+            options['compression_opts'] = config['compression_opts']
+    if config.get('shuffle'):
+        options['shuffle'] = True
+    return options
+
+def stream_chunks(shape, axis, length):
+    """
+    Choose the chunk shape of a dataset holding frames along one axis.
+    
+    Parameters:
+    shape (tuple): The dataset shape, 0 along axis for a dataset that is appended to.
+    axis (int): The axis frames are appended along.
+    length (int): The chunk length along that axis.
+    
+    Returns:
+    tuple: The whole dataset along the other axes and length along axis, within the dataset when it has a size.
+    """
+    chunks = list(shape)
+    chunks[axis] = max(min(int(length), shape[axis]) if shape[axis] else int(length), 1)
+    return tuple(chunks)
+
+class FrameStream:
+    """
+    Appends a video's frames to resizable, chunked datasets in fixed-size blocks.
+    
+    Only the frames of the current block are held, so memory does not grow with the
+    length of the video. The emotion group holds one dataset per stream: frame_index,
+    landmarks (frames, 478, 3), phonemes and detected (frames,), mel (128, columns) and
+    mel_offsets (frames + 1,), frame i spanning mel columns mel_offsets[i]:mel_offsets[i + 1].
+    """
+    def __init__(self, emotion_group, block_frames=64, options=None):
+        """
+        Initialize a FrameStream instance.
+        
+        Parameters:
+        emotion_group (h5py.Group): The empty emotion group to write to.
+        block_frames (int): The frames appended at once, and the chunk length of the datasets.
+        options (dict): The compression arguments of the landmarks and mel datasets, see dataset_options.
+        """
+        self.group = emotion_group
+        self.block_frames = max(int(block_frames), 1)
+        self.options = options or {}
+        self.block = []
+        self.num_frames = 0
+        self.num_columns = 0
+        self.group.attrs['layout'] = STREAM_LAYOUT
+
+    def append(self, frame):
+        """
+        Add a frame, writing the block once it is full.
+        
+        Parameters:
+        frame (Training_Frame): The frame.
+        """
+        self.block.append(frame)
+        if len(self.block) >= self.block_frames:
+            self.flush()
+
+    def _create_datasets(self, landmark_shape, num_mels, columns_per_frame):
+        group = self.group
+        group.create_dataset('frame_index', shape=(0,), maxshape=(None,), dtype='int32', chunks=(self.block_frames,))
+        group.create_dataset('landmarks', shape=(0,) + landmark_shape, maxshape=(None,) + landmark_shape, dtype='float64',
+                             chunks=stream_chunks((0,) + landmark_shape, 0, self.block_frames), **self.options)
+        group.create_dataset('phonemes', shape=(0,), maxshape=(None,), dtype='int32', chunks=(self.block_frames,))
+        group.create_dataset('detected', shape=(0,), maxshape=(None,), dtype='bool', chunks=(self.block_frames,))
+        group.create_dataset('mel', shape=(num_mels, 0), maxshape=(num_mels, None), dtype='float64',
+                             chunks=stream_chunks((num_mels, 0), 1, self.block_frames * columns_per_frame), **self.options)
+        group.create_dataset('mel_offsets', data=np.zeros(1, dtype=np.int64), maxshape=(None,), chunks=(self.block_frames,))
+
+    @timer('hdf5_write')
+    def flush(self):
+        """
+        Append the frames of the current block to the datasets.
+        """
+        block, self.block = self.block, []
+        if 'landmarks' not in self.group:
+            found = [frame.landmarks for frame in block if frame.landmarks is not None]
+            landmark_shape = found[0].shape if found else (NUM_LANDMARKS, 3)
+            num_mels = block[0].mel_segment.shape[0] if block else 128
+            columns_per_frame = int(np.ceil(np.mean([frame.mel_segment.shape[1] for frame in block]))) if block else 1
+            self._create_datasets(landmark_shape, num_mels, max(columns_per_frame, 1))
+        if not block:
+            return
+
+        landmark_shape = self.group['landmarks'].shape[1:]
+        landmarks = np.zeros((len(block),) + landmark_shape, dtype=np.float64)
+        without_face = [frame.frame_index for frame in block if frame.landmarks is None]
+        if without_face:
+            count('frames_without_face', len(without_face))
+            logger.warning(f"No face found on frames {without_face} of {self.group.file.filename}, storing zeros")
+        for position, frame in enumerate(block):
+            if frame.landmarks is None:
+                continue
+            if frame.landmarks.shape != landmark_shape:
+                raise ValueError(f"FrameStream - frame {frame.frame_index} has landmarks of shape {frame.landmarks.shape}, "
+                                 f"expected {landmark_shape}")
+            landmarks[position] = frame.landmarks
+        mel = np.concatenate([frame.mel_segment for frame in block], axis=1)
+        widths = np.array([frame.mel_segment.shape[1] for frame in block], dtype=np.int64)
+        detected = np.array([frame.detected and frame.landmarks is not None for frame in block], dtype=bool)
+
+        start, stop = self.num_frames, self.num_frames + len(block)
+        last_offset = self.num_columns
+        self._append(self.group['frame_index'], np.array([frame.frame_index for frame in block], dtype=np.int32), 0, start)
+        self._append(self.group['landmarks'], landmarks, 0, start)
+        # Use -1 for unknown phonemes
+        self._append(self.group['phonemes'], np.array([phoneme_to_int.get(frame.phoneme, -1) for frame in block], dtype=np.int32), 0, start)
+        self._append(self.group['detected'], detected, 0, start)
+        self._append(self.group['mel'], mel, 1, last_offset)
+        self._append(self.group['mel_offsets'], last_offset + np.cumsum(widths), 0, start + 1)
+        self.num_frames = stop
+        self.num_columns = last_offset + int(widths.sum())
+        logger.debug(f"Wrote frames {start} to {stop - 1} of {self.group.name}")
+
+    @staticmethod
+    def _append(dataset, data, axis, start):
+        shape = list(dataset.shape)
+        shape[axis] = start + data.shape[axis]
+        dataset.resize(tuple(shape))
+        index = [slice(None)] * dataset.ndim
+        index[axis] = slice(start, shape[axis])
+        dataset[tuple(index)] = data
+
+    def close(self):
+        """
+        Write the last, partial block.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The frames of a failed video are not flushed, the file is discarded
+        if exc_type is None:
+            self.close()
+
 
 class HDF5_Container:
     """
     A class to handle HDF5 file creation, data storage, and retrieval.
     """
-    def __init__(self, path):
+    def __init__(self, path, storage_config=None):
         """
         Initialize an HDF5_Container instance.
         
         Parameters:
         path (str): The path to the HDF5 file.
+        storage_config (dict): The compression settings and file format of the datasets, read from STORAGE_CONFIG_PATH when None.
         """
         self.path = path
+        self.storage_config = storage_config if storage_config is not None else load_storage_config()
+        self.dataset_options = dataset_options(self.storage_config)
 
     def create_hdf5_file(self):
         """
          Create a new HDF5 file.
          """
-        self.file = h5py.File(self.path, 'w')
+        self.file = h5py.File(self.path, 'w', libver=self.storage_config['libver'])
 
     def close_hdf5_file(self):
         """
@@ -41,6 +248,24 @@ class HDF5_Container:
         """
         self.file.close()
 
+    def open_frame_stream(self, video_name, emotion, block_frames=None):
+        """
+        Start streaming a video's frames to the HDF5 file.
+        
+        Parameters:
+        video_name (str): The name of the video.
+        emotion (str): The emotion label for the video.
+        block_frames (int): The frames written at once, the storage configuration's chunk_frames when None.
+        
+        Returns:
+        FrameStream: The stream, closed to write the last frames.
+        """
+        if emotion in self.file:
+            raise ValueError(f"open_frame_stream - {video_name} already has frames for emotion {emotion}")
+        logger.debug(f"Streaming frames of {video_name}/{emotion}")
+        return FrameStream(self.file.create_group(emotion), block_frames or self.storage_config['chunk_frames'],
+                           self.dataset_options)
+
     def add_video_data_batch(self, video_name, emotion, training_frames):
         """
         Add a batch of video data to the HDF5 file.
@@ -48,31 +273,11 @@ class HDF5_Container:
         Parameters:
         video_name (str): The name of the video.
         emotion (str): The emotion label for the video.
-        training_frames (list): A list of Training_Frame objects containing the data to add.
-        """
-        if emotion not in self.file:
-            emotion_group = self.file.create_group(emotion)
-        else:
-            emotion_group = self.file[emotion]
-
-        for frame in training_frames:
-            frame_index = frame.frame_index
-            if str(frame_index) in emotion_group:
-                frame_group = emotion_group[str(frame_index)]
-            else:
-                frame_group = emotion_group.create_group(str(frame_index))
-
-            if isinstance(frame.landmarks[0], list):
-                # Flatten the list of landmarks
-                landmarks_array = np.array([[lm.x, lm.y, lm.z] for sublist in frame.landmarks for lm in sublist], dtype=np.float64)
-            else:
-                landmarks_array = np.array([[lm.x, lm.y, lm.z] for lm in frame.landmarks], dtype=np.float64)
-
-            frame_group.create_dataset('landmarks', data=landmarks_array, dtype='float64')
-            frame_group.create_dataset('mel', data=frame.mel_segment, dtype='float64')
-            translated_phoneme = phoneme_to_int.get(frame.phoneme, -1)  # Use -1 for unknown phonemes
-            frame_group.create_dataset('phoneme', data=translated_phoneme, dtype='int32')
-            print(f"Created datasets for {video_name}/{emotion}/{frame_index}")
+        training_frames (iterable): The Training_Frame objects containing the data to add.
+        """
+        with self.open_frame_stream(video_name, emotion) as stream:
+            for frame in training_frames:
+                stream.append(frame)
 
     def read_video_data(self, path):
         """
@@ -90,18 +295,14 @@ class HDF5_Container:
             emotion = list(file.keys())[0]  # Since there is only one emotion
             emotion_group = file[emotion]
             
+            frames = read_frames(emotion_group)
             emotion_data = {}
-            for frame_index in sorted(emotion_group, key=lambda x: int(x)):
-                frame_group = emotion_group[frame_index]
-
-                landmarks = frame_group['landmarks'][:]
-                mel = frame_group['mel'][:]
-                phoneme = int(frame_group['phoneme'][()])
-
+            for position, frame_index in enumerate(frames['frame_index']):
                 emotion_data[int(frame_index)] = {
-                    'landmarks': landmarks,
-                    'mel': mel,
-                    'phoneme': phoneme
+                    'landmarks': frames['landmarks'][position],
+                    'mel': frames['mels'][position],
+                    'phoneme': int(frames['phonemes'][position]),
+                    'detected': bool(frames['detected'][position])
                 }
 
             all_data = {                
@@ -5,6 +5,13 @@ Created on Sun Jul 28 18:35:55 2024
 @author: Jayyy
 """
 import h5py
+import numpy as np
+
+# The root 'layout' attribute of a file built by HDF5_Merger.create_virtual_hdf5
+VIRTUAL_LAYOUT = 'virtual'
+# The 'layout' attribute of an emotion group written by Storage_Controller.FrameStream, holding one
+# dataset per stream (frame_index, landmarks, mel, mel_offsets, phonemes, detected) rather than a group per frame
+STREAM_LAYOUT = 'stream'
 
 class HDF5_Container:
     """
@@ -32,18 +39,13 @@ class HDF5_Container:
                 video_group = file[video_name]
                 for emotion in video_group.keys():
                     emotion_group = video_group[emotion]
+                    frames = read_frames(emotion_group)
                     emotion_data = {}
-                    for frame_index in sorted(emotion_group, key=lambda x: int(x)):
-                        frame_group = emotion_group[frame_index]
-
-                        landmarks = frame_group['landmarks'][:]
-                        mel = frame_group['mel'][:]
-                        phoneme = frame_group['phoneme'][()]
-
+                    for position, frame_index in enumerate(frames['frame_index']):
                         emotion_data[int(frame_index)] = {
-                            'landmarks': landmarks,
-                            'mel': mel,
-                            'phoneme': phoneme
+                            'landmarks': frames['landmarks'][position],
+                            'mel': frames['mels'][position],
+                            'phoneme': frames['phonemes'][position]
                         }
 
                     all_data = {
@@ -53,3 +55,223 @@ class HDF5_Container:
                     }
 
                     yield all_data
+
+def is_frame_stream(emotion_group):
+    """
+    Check whether an emotion group holds one dataset per stream rather than a group per frame.
+    
+    Parameters:
+    emotion_group (h5py.Group): The emotion group.
+    
+    Returns:
+    bool: Whether it was written by Storage_Controller.FrameStream.
+    """
+    return emotion_group.attrs.get('layout') == STREAM_LAYOUT
+
+def read_frames(emotion_group):
+    """
+    Read every frame of a video's emotion group, in either layout.
+    
+    Parameters:
+    emotion_group (h5py.Group): The emotion group.
+    
+    Returns:
+    dict: The frame indices, landmarks (frames, 478, 3), list of mel segments, phonemes and detected flags.
+    """
+    if is_frame_stream(emotion_group):
+        mel_offsets = emotion_group['mel_offsets'][:]
+        return {
+            'frame_index': emotion_group['frame_index'][:],
+            'landmarks': emotion_group['landmarks'][:],
+            'mels': np.split(emotion_group['mel'][:], mel_offsets[1:-1], axis=1),
+            'phonemes': emotion_group['phonemes'][:],
+            'detected': emotion_group['detected'][:],
+        }
+
+    frame_keys = sorted(emotion_group.keys(), key=int)
+    frame_groups = [emotion_group[frame_key] for frame_key in frame_keys]
+    return {
+        'frame_index': np.array([int(frame_key) for frame_key in frame_keys]),
+        'landmarks': np.array([frame_group['landmarks'][:] for frame_group in frame_groups]),
+        'mels': [frame_group['mel'][:] for frame_group in frame_groups],
+        'phonemes': np.array([frame_group['phoneme'][()] for frame_group in frame_groups]),
+        # Files written before keyframing have no flag, every frame was detected
+        'detected': np.array([bool(frame_group['detected'][()]) if 'detected' in frame_group else True
+                              for frame_group in frame_groups], dtype=bool),
+    }
+
+def read_emotion_group(emotion_group):
+    """
+    Read the frames of a video's emotion group in frame order.
+    
+    Parameters:
+    emotion_group (h5py.Group): The emotion group, in either layout.
+    
+    Returns:
+    tuple: The landmarks (frames, 478, 3), the list of mel segments and the phonemes (frames,).
+    """
+    frames = read_frames(emotion_group)
+    return frames['landmarks'], frames['mels'], frames['phonemes']
+
+class GroupReader:
+    """
+    Reads samples from a merged HDF5 file holding a group per video, copied or linked.
+    """
+    def __init__(self, path):
+        """
+        Initialize a GroupReader instance.
+        
+        Parameters:
+        path (str): The path to the HDF5 file.
+        """
+        self.path = path
+        self.file = h5py.File(path, 'r')
+
+    def metadata(self):
+        """
+        List the samples without reading their frames.
+        
+        Returns:
+        list: The (video_name, emotion) pairs.
+        """
+        return [(video_name, emotion) for video_name in self.file.keys() for emotion in self.file[video_name].keys()]
+
+    def read(self, video_name, emotion):
+        """
+        Read the frames of a sample.
+        
+        Parameters:
+        video_name (str): The name of the video.
+        emotion (int): The emotion label.
+        
+        Returns:
+        tuple: The landmarks, the list of mel segments and the phonemes, see read_emotion_group.
+        """
+        video_group = self.file[video_name]
+        emotion_str = f"{int(emotion):02d}"
+        if emotion_str not in video_group:
+            raise KeyError(f"Emotion {emotion_str} not found for video {video_name}")
+        return read_emotion_group(video_group[emotion_str])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class VirtualView:
+    """
+    Reads samples from a virtual dataset file built by HDF5_Merger.create_virtual_hdf5.
+    
+    The offsets tables are loaded once, so reading a sample is one slice of each
+    concatenated dataset, and frames of consecutive videos can be read together.
+    """
+    def __init__(self, path):
+        """
+        Initialize a VirtualView instance.
+        
+        Parameters:
+        path (str): The path to the virtual dataset file.
+        """
+        self.path = path
+        self.file = h5py.File(path, 'r')
+        if self.file.attrs.get('layout') != VIRTUAL_LAYOUT:
+            self.file.close()
+            raise ValueError(f"VirtualView - {path} is not a virtual dataset file")
+        self.video_names = [name.decode() if isinstance(name, bytes) else name for name in self.file['video_names'][:]]
+        self.emotions = [emotion.decode() if isinstance(emotion, bytes) else emotion for emotion in self.file['emotions'][:]]
+        self.frame_offsets = self.file['frame_offsets'][:]
+        self.mel_offsets = self.file['mel_offsets'][:]
+        self.index = {(video_name, int(emotion)): i for i, (video_name, emotion) in enumerate(zip(self.video_names, self.emotions))}
+        self.landmarks = self.file['landmarks']
+        self.mel = self.file['mel']
+        self.phonemes = self.file['phonemes']
+        self.detected = self.file['detected']
+
+    def __len__(self):
+        return len(self.video_names)
+
+    def metadata(self):
+        """
+        List the samples without reading their frames.
+        
+        Returns:
+        list: The (video_name, emotion) pairs.
+        """
+        return list(zip(self.video_names, self.emotions))
+
+    def read_frames(self, start, stop):
+        """
+        Read a range of frames, which may span several videos.
+        
+        Parameters:
+        start (int): The first frame.
+        stop (int): The frame after the last.
+        
+        Returns:
+        dict: The landmarks, the mel columns of the frames, each frame's column offsets into them, the phonemes and detection flags.
+        """
+        mel_start, mel_stop = self.mel_offsets[start], self.mel_offsets[stop]
+        return {
+            'landmarks': self.landmarks[start:stop],
+            'mel': self.mel[:, mel_start:mel_stop],
+            'mel_offsets': self.mel_offsets[start:stop + 1] - mel_start,
+            'phonemes': self.phonemes[start:stop],
+            'detected': self.detected[start:stop],
+        }
+
+    def read_sample(self, index):
+        """
+        Read the frames of the sample at an index of metadata().
+        
+        Parameters:
+        index (int): The sample index.
+        
+        Returns:
+        tuple: The landmarks, the list of mel segments and the phonemes, see read_emotion_group.
+        """
+        frames = self.read_frames(self.frame_offsets[index], self.frame_offsets[index + 1])
+        mels = np.split(frames['mel'], frames['mel_offsets'][1:-1], axis=1)
+        return frames['landmarks'], mels, frames['phonemes']
+
+    def read(self, video_name, emotion):
+        """
+        Read the frames of a sample.
+        
+        Parameters:
+        video_name (str): The name of the video.
+        emotion (int): The emotion label.
+        
+        Returns:
+        tuple: The landmarks, the list of mel segments and the phonemes, see read_emotion_group.
+        """
+        index = self.index.get((video_name, int(emotion)))
+        if index is None:
+            raise KeyError(f"Emotion {int(emotion):02d} not found for video {video_name}")
+        return self.read_sample(index)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_dataset(path):
+    """
+    Open a merged dataset with the reader matching its layout.
+    
+    Parameters:
+    path (str): A virtual dataset file, or a merged HDF5 file holding a group per video.
+    
+    Returns:
+    VirtualView or GroupReader: The reader.
+    """
+    with h5py.File(path, 'r') as file:
+        virtual = file.attrs.get('layout') == VIRTUAL_LAYOUT
+    return VirtualView(path) if virtual else GroupReader(path)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 22:05:37 2026
+
+Tune the compression of the HDF5 feature store. Each candidate setting (no filter,
+lzf, gzip levels, with and without the shuffle filter, in the oldest and latest file
+formats, then chunk lengths with the best of them) is used to write a sample of
+extracted videos as the writer does and merge them as the merger does. The file size,
+write throughput, sequential read throughput and the latency of reading samples in
+random order, as training does, are measured. The smallest setting whose read latency
+stays close to the fastest one is written to storage_config.json, which
+Storage_Controller.HDF5_Container and HDF5_Merger.copy_data_to_new_hdf5 read.
+
+The files are read back right after being written, so they come from the page cache;
+the latencies measure decompression and HDF5 overhead rather than the disk.
+
+Example:
+    python Storage_Tuner.py --per-video-dir training_data/per_video --videos 24 --report storage_tuning.json
+
+@author: Jayyy
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from HDF5_Merger import create_master_hdf5, copy_data_to_new_hdf5
+from Storage_Controller import (DEFAULT_STORAGE_CONFIG, HDF5_Container, STORAGE_CONFIG_PATH, int_to_phoneme,
+                                save_storage_config)
+from Storage_Controller_Model import open_dataset
+from Training_Frame import Training_Frame
+
+FILTERS = [
+    {'compression': None, 'compression_opts': None, 'shuffle': False},
+    {'compression': 'lzf', 'compression_opts': None, 'shuffle': False},
+    {'compression': 'lzf', 'compression_opts': None, 'shuffle': True},
+    {'compression': 'gzip', 'compression_opts': 1, 'shuffle': False},
+    {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True},
+    {'compression': 'gzip', 'compression_opts': 4, 'shuffle': False},
+    {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+    {'compression': 'gzip', 'compression_opts': 9, 'shuffle': True},
+]
+# Every filter with both file formats, see Storage_Controller.load_storage_config
+CANDIDATES = [dict(filters, libver=libver, chunk_frames=DEFAULT_STORAGE_CONFIG['chunk_frames'])
+              for libver in ('earliest', 'latest') for filters in FILTERS]
+# Tried with the best filter and file format
+CHUNK_FRAMES = [16, 64, 256]
+
+
+def config_name(config):
+    """
+    Name a storage setting for the report.
+
+    Parameters:
+    config (dict): The storage settings.
+
+    Returns:
+    str: For example 'gzip4+shuffle+latest@64', 64 being the frames per chunk.
+    """
+    name = config['compression'] or 'none'
+    if config.get('compression_opts') is not None:
+        name += str(config['compression_opts'])
+    if config.get('shuffle'):
+        name += '+shuffle'
+    if config.get('libver', 'earliest') != 'earliest':
+        name += '+' + config['libver']
+    return f"{name}@{config['chunk_frames']}"
+
+def load_sample_videos(per_video_dir, num_videos, seed=0):
+    """
+    Read a random sample of extracted videos back into Training_Frame objects.
+
+    Parameters:
+    per_video_dir (str): The directory holding one subdirectory per video, as written by Interface.py.
+    num_videos (int): The number of videos to sample.
+    seed (int): The seed of the sample.
+
+    Returns:
+    tuple: The (video_name, emotion, training_frames) of each video and their uncompressed size in bytes.
+    """
+    paths = sorted(glob.glob(os.path.join(per_video_dir, '*', '*.hdf5')))
+    if not paths:
+        raise FileNotFoundError(f"load_sample_videos - no per-video HDF5 files under {per_video_dir}")
+    paths = random.Random(seed).sample(paths, min(num_videos, len(paths)))
+
+    videos = []
+    raw_bytes = 0
+    for path in paths:
+        video_data = HDF5_Container(path).read_video_data(path)
+        training_frames = []
+        for frame_index, frame in video_data['frames'].items():
+            training_frames.append(Training_Frame(video_data['emotion'], frame_index, frame['landmarks'],
+                                                  int_to_phoneme.get(frame['phoneme']), frame['mel'], frame['detected']))
+            raw_bytes += frame['landmarks'].nbytes + frame['mel'].nbytes + 5
+        videos.append((os.path.splitext(os.path.basename(path))[0], video_data['emotion'], training_frames))
+    return videos, raw_bytes
+
+def benchmark_config(config, videos, raw_bytes, work_dir, repeats=3, seed=0):
+    """
+    Write, merge and read the sample videos with one storage setting.
+
+    Parameters:
+    config (dict): The storage settings.
+    videos (list): The sample videos, see load_sample_videos.
+    raw_bytes (int): The uncompressed size of the sample.
+    work_dir (str): An empty directory for the files.
+    repeats (int): The passes of random-order sample reads.
+    seed (int): The seed of the read order.
+
+    Returns:
+    dict: The file sizes, write and merge throughput, sequential read throughput and random sample-read latencies.
+    """
+    per_video_dir = os.path.join(work_dir, 'per_video')
+    start_time = time.perf_counter()
+    for video_name, emotion, training_frames in videos:
+        os.makedirs(os.path.join(per_video_dir, video_name))
+        hdf5_container = HDF5_Container(os.path.join(per_video_dir, video_name, video_name + '.hdf5'), config)
+        hdf5_container.create_hdf5_file()
+        hdf5_container.add_video_data_batch(video_name, emotion, training_frames)
+        hdf5_container.close_hdf5_file()
+    write_s = time.perf_counter() - start_time
+    per_video_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(per_video_dir, '*', '*.hdf5')))
+
+    master_path = os.path.join(work_dir, 'master.hdf5')
+    merged_path = os.path.join(work_dir, 'merged.hdf5')
+    create_master_hdf5(per_video_dir, master_path)
+    start_time = time.perf_counter()
+    copy_data_to_new_hdf5(master_path, merged_path, config)
+    merge_s = time.perf_counter() - start_time
+
+    with open_dataset(merged_path) as reader:
+        metadata = reader.metadata()
+        start_time = time.perf_counter()
+        for video_name, emotion in metadata:
+            reader.read(video_name, emotion)
+        sequential_s = time.perf_counter() - start_time
+
+    # Training opens the file once and reads whole samples in shuffled order
+    latencies = []
+    order = random.Random(seed)
+    for _ in range(repeats):
+        order.shuffle(metadata)
+        with open_dataset(merged_path) as reader:
+            for video_name, emotion in metadata:
+                start_time = time.perf_counter()
+                reader.read(video_name, emotion)
+                latencies.append(time.perf_counter() - start_time)
+    latencies.sort()
+
+    return {
+        'config': config,
+        'per_video_mb': per_video_bytes / 2**20,
+        'merged_mb': os.path.getsize(merged_path) / 2**20,
+        'ratio': raw_bytes / os.path.getsize(merged_path),
+        'write_mb_s': raw_bytes / 2**20 / write_s,
+        'merge_mb_s': raw_bytes / 2**20 / merge_s,
+        'sequential_read_mb_s': raw_bytes / 2**20 / sequential_s,
+        'read_p50_ms': statistics.median(latencies) * 1e3,
+        'read_p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1e3,
+    }
+
+def recommend(results, latency_tolerance=1.25):
+    """
+    Choose the smallest setting whose median sample-read latency is close to the fastest.
+
+    Reads sit on the training input path and run every epoch, while a file is written
+    once, so write throughput only breaks ties.
+
+    Parameters:
+    results (dict): Setting name -> benchmark_config result.
+    latency_tolerance (float): How many times the fastest median latency a setting may take.
+
+    Returns:
+    str: The name of the recommended setting.
+    """
+    fastest = min(result['read_p50_ms'] for result in results.values())
+    eligible = [name for name, result in results.items() if result['read_p50_ms'] <= fastest * latency_tolerance]
+    return min(eligible, key=lambda name: (results[name]['merged_mb'], -results[name]['write_mb_s']))
+
+def _tune_one(config, videos, raw_bytes, results, repeats, seed):
+    name = config_name(config)
+    if name not in results:
+        work_dir = tempfile.mkdtemp(prefix='storage_tuner_')
+        try:
+            results[name] = benchmark_config(config, videos, raw_bytes, work_dir, repeats, seed)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        result = results[name]
+        print(f"{name:>25}: {result['merged_mb']:7.1f} MB ({result['ratio']:.2f}x), write {result['write_mb_s']:6.1f} MB/s, "
+              f"sequential read {result['sequential_read_mb_s']:6.1f} MB/s, sample read p50 {result['read_p50_ms']:.2f} ms "
+              f"p95 {result['read_p95_ms']:.2f} ms")
+
+def tune_storage(per_video_dir, num_videos=16, candidates=CANDIDATES, chunk_frames=CHUNK_FRAMES, repeats=3,
+                 latency_tolerance=1.25, seed=0):
+    """
+    Benchmark every candidate storage setting on a sample of extracted videos, then the
+    chunk lengths with the best of them.
+
+    Parameters:
+    per_video_dir (str): The directory holding one subdirectory per video.
+    num_videos (int): The number of videos to sample.
+    candidates (list): The storage settings to try.
+    chunk_frames (list): The frames per chunk to try with the best setting.
+    repeats (int): The passes of random-order sample reads per setting.
+    latency_tolerance (float): See recommend.
+    seed (int): The seed of the sample and the read order.
+
+    Returns:
+    dict: The sample size, each setting's results and the recommended setting.
+    """
+    videos, raw_bytes = load_sample_videos(per_video_dir, num_videos, seed)
+    results = {}
+    for config in candidates:
+        _tune_one(config, videos, raw_bytes, results, repeats, seed)
+    best = results[recommend(results, latency_tolerance)]['config']
+    # The merged copy only chunks compressed datasets
+    for length in chunk_frames if best['compression'] else []:
+        _tune_one(dict(best, chunk_frames=length), videos, raw_bytes, results, repeats, seed)
+
+    return {
+        'videos': len(videos),
+        'frames': sum(len(training_frames) for _, _, training_frames in videos),
+        'raw_mb': raw_bytes / 2**20,
+        'results': results,
+        'recommended': recommend(results, latency_tolerance),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Choose the compression of the HDF5 feature store.")
+    parser.add_argument('--per-video-dir', required=True, help="The directory holding one subdirectory per extracted video.")
+    parser.add_argument('--videos', type=int, default=16, help="The number of videos to sample.")
+    parser.add_argument('--repeats', type=int, default=3, help="Passes of random-order sample reads per setting.")
+    parser.add_argument('--latency-tolerance', type=float, default=1.25,
+                        help="How many times the fastest median sample-read latency the chosen setting may take.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config-out', default=STORAGE_CONFIG_PATH, help="The storage configuration to write.")
+    parser.add_argument('--no-write', action='store_true', help="Only report, leave the storage configuration unchanged.")
+    parser.add_argument('--report', help="Write every setting's results to this JSON file.")
+    args = parser.parse_args()
+
+    report = tune_storage(args.per_video_dir, args.videos, repeats=args.repeats,
+                          latency_tolerance=args.latency_tolerance, seed=args.seed)
+    recommended = report['results'][report['recommended']]
+    print(f"Recommended: {report['recommended']}, {recommended['merged_mb']:.1f} MB for {report['raw_mb']:.1f} MB of "
+          f"features over {report['videos']} videos")
+
+    if not args.no_write:
+        save_storage_config(recommended['config'], args.config_out,
+                            tuned={'date': datetime.datetime.now().isoformat(timespec='seconds'), 'videos': report['videos'],
+                                   'name': report['recommended'], 'result': recommended})
+        print(f"Storage configuration written to {args.config_out}")
+    if args.report:
+        with open(args.report, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:02:37 2026
+
+Generate a synthetic RAVDESS-style dataset so the pipeline can be run and benchmarked
+without the real videos: RAVDESS-named .mp4 files with a moving test pattern and tone
+audio, the matching per-video HDF5 files in the layout written by Interface.py, and the
+merged HDF5 file read by Interface_Model.py.
+
+Example:
+    python Synthetic_Data_Generator.py --output synthetic --videos 48 --frames 90
+
+Output layout:
+    <output>/videos/01-01-03-02-01-01-01.mp4
+    <output>/per_video/01-01-03-02-01-01-01/01-01-03-02-01-01-01.hdf5
+    <output>/master.hdf5, <output>/merged.hdf5
+
+@author: Jayyy
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import tempfile
+import wave
+from collections import namedtuple
+
+import cv2
+import imageio_ffmpeg as ffmpeg
+import numpy as np
+
+from Aligner import stub_pronunciations
+from Storage_Controller import HDF5_Container
+from Training_Frame import Training_Frame
+from HDF5_Merger import create_master_hdf5, copy_data_to_new_hdf5
+
+# Stands in for MediaPipe's NormalizedLandmark when writing synthetic frames
+Landmark = namedtuple('Landmark', ['x', 'y', 'z'])
+
+num_landmarks = 478
+statements = {
+    "01": "kids are talking by the door",
+    "02": "dogs are sitting by the door",
+}
+# A tone per emotion, 01 neutral to 08 surprised
+emotion_tones_hz = {f"{emotion:02d}": 180 + 40 * emotion for emotion in range(1, 9)}
+
+
+def ravdess_file_name(emotion, intensity, statement, repetition, actor, modality="01", vocal_channel="01"):
+    """
+    Build a RAVDESS file name (without extension).
+
+    Parameters:
+    emotion (str): The emotion id, 01 to 08.
+    intensity (str): The emotional intensity, 01 normal or 02 strong.
+    statement (str): The statement id, 01 or 02.
+    repetition (str): The repetition, 01 or 02.
+    actor (str): The actor id, 01 to 24.
+    modality (str): 01 audio-video, 02 video-only, 03 audio-only.
+    vocal_channel (str): 01 speech or 02 song.
+
+    Returns:
+    str: The file name, e.g. 01-01-03-02-01-01-07.
+    """
+    return "-".join([modality, vocal_channel, emotion, intensity, statement, repetition, actor])
+
+def ravdess_file_names(num_videos):
+    """
+    Enumerate distinct audio-video speech file names, cycling through the emotions first
+    so that small datasets cover every class.
+
+    Neutral (01) has no strong intensity, as in the real dataset.
+
+    Parameters:
+    num_videos (int): The number of names, at most 24 actors x 60 recordings.
+
+    Returns:
+    list: The file names.
+    """
+    names = []
+    for actor in range(1, 25):
+        for statement, repetition, intensity, emotion in itertools.product((1, 2), (1, 2), (1, 2), range(1, 9)):
+            if emotion == 1 and intensity == 2:
+                continue
+            names.append(ravdess_file_name(f"{emotion:02d}", f"{intensity:02d}", f"{statement:02d}",
+                                           f"{repetition:02d}", f"{actor:02d}"))
+            if len(names) == num_videos:
+                return names
+    raise ValueError(f"ravdess_file_names - at most {len(names)} distinct names, asked for {num_videos}")
+
+def write_tone_wav(path, duration_s, frequency, sample_rate=48000, syllables_per_sec=4.0):
+    """
+    Write a mono 16-bit WAV file holding a tone modulated like syllables of speech.
+
+    Parameters:
+    path (str): The output path.
+    duration_s (float): The duration in seconds.
+    frequency (float): The tone frequency in Hz.
+    sample_rate (int): The sample rate.
+    syllables_per_sec (float): The rate of the amplitude envelope.
+    """
+    t = np.arange(int(duration_s * sample_rate)) / sample_rate
+    envelope = 0.5 * (1 - np.cos(2 * np.pi * syllables_per_sec * t))
+    signal = envelope * (0.6 * np.sin(2 * np.pi * frequency * t) + 0.2 * np.sin(4 * np.pi * frequency * t))
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((signal * 32767 * 0.8).astype('<i2').tobytes())
+
+def test_pattern_frame(frame_index, width, height, seed=0):
+    """
+    Draw one BGR frame of a moving test pattern: a scrolling gradient with a face-like ellipse.
+
+    Parameters:
+    frame_index (int): The index of the frame.
+    width (int): The frame width.
+    height (int): The frame height.
+    seed (int): Varies the motion between videos.
+
+    Returns:
+    np.ndarray: The frame, uint8 of shape (height, width, 3).
+    """
+    x = np.arange(width, dtype=np.float32)
+    y = np.arange(height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = ((x + 4 * frame_index) % 256).astype(np.uint8)
+    frame[..., 1] = ((y + 2 * frame_index) % 256).astype(np.uint8)
+    frame[..., 2] = 96
+
+    phase = frame_index / 15.0 + seed
+    centre = (int(width * (0.5 + 0.1 * np.sin(phase))), int(height * (0.5 + 0.05 * np.cos(phase))))
+    axes = (width // 6, height // 3)
+    cv2.ellipse(frame, centre, axes, 0, 0, 360, (150, 180, 220), -1)
+    for side in (-1, 1):
+        cv2.circle(frame, (centre[0] + side * axes[0] // 2, centre[1] - axes[1] // 4), max(axes[0] // 8, 1), (40, 40, 40), -1)
+    mouth_open = int(axes[1] * 0.1 * (1 + np.sin(frame_index / 2.0)))
+    cv2.ellipse(frame, (centre[0], centre[1] + axes[1] // 2), (axes[0] // 3, mouth_open + 1), 0, 0, 360, (60, 40, 120), -1)
+    return frame
+
+def write_synthetic_video(path, num_frames=90, fps=30, width=640, height=360, tone_hz=220.0, seed=0):
+    """
+    Write an .mp4 video with a moving test pattern and a tone audio track.
+
+    Parameters:
+    path (str): The output path.
+    num_frames (int): The number of video frames.
+    fps (int): The frame rate.
+    width (int): The frame width.
+    height (int): The frame height.
+    tone_hz (float): The frequency of the audio tone.
+    seed (int): Varies the motion between videos.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        video_path = os.path.join(temp_dir, 'video.mp4')
+        audio_path = os.path.join(temp_dir, 'audio.wav')
+
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        for frame_index in range(num_frames):
+            writer.write(test_pattern_frame(frame_index, width, height, seed))
+        writer.release()
+        write_tone_wav(audio_path, num_frames / fps, tone_hz)
+
+        command = [ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+                   '-c:v', 'copy', '-c:a', 'aac', '-shortest', path]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"write_synthetic_video - ffmpeg command failed with error: {result.stderr}")
+
+def synthetic_training_frames(statement_id, num_frames=90, fps=30, sr=44100, hop_length=512, n_mels=128, seed=0):
+    """
+    Create Training_Frame objects shaped like those extracted from a real video.
+
+    Landmarks drift smoothly around a fixed face shape, mel segments have the widths
+    AudioController.retrive_mel_segment produces at the given rates, and the phonemes
+    walk through the statement's phones.
+
+    Parameters:
+    statement_id (str): The statement id, 01 or 02.
+    num_frames (int): The number of frames.
+    fps (int): The video frame rate.
+    sr (int): The audio sample rate of the mel spectrogram.
+    hop_length (int): The hop length of the mel spectrogram.
+    n_mels (int): The number of mel bands.
+    seed (int): The random seed.
+
+    Returns:
+    list: The Training_Frame objects.
+    """
+    rng = np.random.default_rng(seed)
+    face = rng.uniform([0.35, 0.25, -0.05], [0.65, 0.75, 0.05], size=(num_landmarks, 3))
+    phones = [phone for word in statements[statement_id].split() for phone in stub_pronunciations[word]]
+    frame_duration_ms = 1000 / fps
+
+    training_frames = []
+    for frame_index in range(num_frames):
+        drift = 0.01 * np.sin(frame_index / 10.0 + np.arange(3))
+        points = face + drift + rng.normal(0, 0.001, size=face.shape)
+        landmarks = [[Landmark(*point) for point in points.tolist()]]
+
+        timestamp_ms = int(frame_index * frame_duration_ms)
+        mel_start = int((timestamp_ms / 1000.0 * sr) / hop_length)
+        mel_end = int(((timestamp_ms + frame_duration_ms) / 1000.0 * sr) / hop_length)
+        mel_segment = rng.uniform(-80.0, 0.0, size=(n_mels, mel_end - mel_start))
+
+        phoneme = phones[frame_index * len(phones) // num_frames]
+        # Frame indices start at 1, as yielded by VideoController.process_video
+        training_frames.append(Training_Frame(statement_id, frame_index + 1, landmarks, phoneme, mel_segment))
+    return training_frames
+
+def write_video_hdf5(hdf5_path, video_name, emotion_id, training_frames):
+    """
+    Write a video's training frames to its own HDF5 file, as Interface.process_video_file does.
+
+    Parameters:
+    hdf5_path (str): The output path.
+    video_name (str): The RAVDESS file name of the video.
+    emotion_id (str): The emotion id, 01 to 08.
+    training_frames (list): The Training_Frame objects.
+    """
+    os.makedirs(os.path.dirname(hdf5_path), exist_ok=True)
+    hdf5_container = HDF5_Container(hdf5_path)
+    hdf5_container.create_hdf5_file()
+    hdf5_container.add_video_data_batch(video_name, emotion_id, training_frames)
+    hdf5_container.close_hdf5_file()
+
+def generate_dataset(output_dir, num_videos=24, num_frames=90, fps=30, width=640, height=360,
+                     videos=True, hdf5=True, seed=0, min_frames=None):
+    """
+    Generate a synthetic RAVDESS-style dataset.
+
+    Parameters:
+    output_dir (str): The directory the dataset is written to.
+    num_videos (int): The number of videos.
+    num_frames (int): The number of frames per video, the most frames with min_frames.
+    fps (int): The frame rate.
+    width (int): The video frame width.
+    height (int): The video frame height.
+    videos (bool): Whether to write the .mp4 videos.
+    hdf5 (bool): Whether to write the per-video and merged HDF5 files.
+    seed (int): The random seed.
+    min_frames (int): With a value, each video has a random number of frames from min_frames to num_frames, like real clips.
+
+    Returns:
+    dict: The video paths, per-video HDF5 paths, and the master and merged HDF5 paths.
+    """
+    video_dir = os.path.join(output_dir, 'videos')
+    per_video_dir = os.path.join(output_dir, 'per_video')
+    paths = {'videos': [], 'per_video': [], 'master': None, 'merged': None}
+    lengths = np.full(num_videos, num_frames)
+    if min_frames is not None:
+        lengths = np.random.default_rng(seed).integers(min_frames, num_frames + 1, size=num_videos)
+
+    for video_index, file_name in enumerate(ravdess_file_names(num_videos)):
+        emotion_id = file_name.split("-")[2]
+        statement_id = file_name.split("-")[4]
+        video_frames = int(lengths[video_index])
+
+        if videos:
+            os.makedirs(video_dir, exist_ok=True)
+            video_path = os.path.join(video_dir, file_name + '.mp4')
+            write_synthetic_video(video_path, video_frames, fps, width, height, emotion_tones_hz[emotion_id], seed + video_index)
+            paths['videos'].append(video_path)
+
+        if hdf5:
+            hdf5_path = os.path.join(per_video_dir, file_name, file_name + '.hdf5')
+            training_frames = synthetic_training_frames(statement_id, video_frames, fps, seed=seed + video_index)
+            write_video_hdf5(hdf5_path, file_name, emotion_id, training_frames)
+            paths['per_video'].append(hdf5_path)
+
+    if hdf5:
+        paths['master'] = os.path.join(output_dir, 'master.hdf5')
+        paths['merged'] = os.path.join(output_dir, 'merged.hdf5')
+        create_master_hdf5(per_video_dir, paths['master'])
+        copy_data_to_new_hdf5(paths['master'], paths['merged'])
+
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic RAVDESS-style dataset.")
+    parser.add_argument('--output', default='synthetic_data')
+    parser.add_argument('--videos', type=int, default=24, help="The number of videos.")
+    parser.add_argument('--frames', type=int, default=90, help="The number of frames per video.")
+    parser.add_argument('--min-frames', type=int, help="Draw each video's number of frames between this and --frames.")
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--no-videos', action='store_true', help="Only write the HDF5 files.")
+    parser.add_argument('--no-hdf5', action='store_true', help="Only write the videos.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.output, args.videos, args.frames, args.fps, args.width, args.height,
+                             videos=not args.no_videos, hdf5=not args.no_hdf5, seed=args.seed,
+                             min_frames=args.min_frames)
+    print(f"Wrote {len(paths['videos'])} videos and {len(paths['per_video'])} per-video HDF5 files to {args.output}")
+    if paths['merged']:
+        print(f"Merged HDF5: {paths['merged']}")
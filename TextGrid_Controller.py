@@ -7,7 +7,9 @@ Created on Thu Jun 20 17:58:58 2024
 
 import pathlib
 import textgrids
-import sys
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Read_Textgrid:
     """
@@ -25,23 +27,23 @@ class Read_Textgrid:
         try:
             self.grid = textgrids.TextGrid(self.pathname)
             # Print a success message
-            print(f'Successfully loaded: {self.pathname.stem}')       
+            logger.info(f'Successfully loaded: {self.pathname.stem}')       
             
             for phone in self.grid['phones']:
                 # Convert Praat to Unicode in the label
                 label = phone.text.transcode()
                 # Print label and phoneme timing, CSV-like
-                print('"{}";{}, {}'.format(label, phone.xmin, phone.xmax))
+                logger.debug('"{}";{}, {}'.format(label, phone.xmin, phone.xmax))
                 
         except FileNotFoundError:
-            print(f'File not found: {self.pathname.stem}', file=sys.stderr)
+            logger.error(f'File not found: {self.pathname.stem}')
         
         except PermissionError:
-            print(f'Cannot read: {self.pathname.stem}', file=sys.stderr)
+            logger.error(f'Cannot read: {self.pathname.stem}')
         
         except (textgrids.ParseError, textgrids.BinaryError):
-            print(f'Invalid file format: {self.pathname.stem}', file=sys.stderr)
+            logger.error(f'Invalid file format: {self.pathname.stem}')
         
         except Exception as e:
-            print(f'An unexpected error occurred: {e}', file=sys.stderr)
+            logger.error(f'An unexpected error occurred: {e}')
 
@@ -4,15 +4,40 @@ Created on Fri Jun 21 15:10:24 2024
 
 @author: Jayyy
 """
+import numpy as np
 
 
+def landmarks_array(landmarks):
+    """
+    Convert a frame's landmarks to a compact array.
+    
+    Parameters:
+    landmarks: The faces returned by find_landmarks, a single face's landmarks, or an array interpolated by Landmark_Keyframer.
+    
+    Returns:
+    np.ndarray: The (478, 3) float64 landmarks of the first face, or None when no face was found.
+    """
+    if isinstance(landmarks, np.ndarray):
+        return landmarks.astype(np.float64, copy=False) if landmarks.size else None
+    if not landmarks:
+        return None
+    if isinstance(landmarks[0], list):
+        # Only the first face is stored
+        landmarks = landmarks[0]
+    return np.array([[lm.x, lm.y, lm.z] for lm in landmarks], dtype=np.float64)
+
 class Training_Frame:
     """
     A class to represent a training frame with emotion label, frame index,
     facial landmarks, phoneme, and mel spectrogram segment.
+    
+    Frames are streamed to the HDF5 file as they are built, so a frame only holds arrays:
+    the MediaPipe landmark objects are converted on construction and the class has no
+    per-instance __dict__.
     """
+    __slots__ = ('emo_label', 'frame_index', 'landmarks', 'phoneme', 'mel_segment', 'detected')
     
-    def __init__(self, emo_label, frame_index, landmarks, phoneme, mel_segment):
+    def __init__(self, emo_label, frame_index, landmarks, phoneme, mel_segment, detected=True):
         
         """
         Initialize a Training_Frame instance.
@@ -20,15 +45,16 @@ class Training_Frame:
         Parameters:
         emo_label (str): The emotion label for the frame.
         frame_index (int): The index of the frame.
-        landmarks (list): The facial landmarks for the frame.
+        landmarks: The facial landmarks for the frame, see landmarks_array.
         phoneme (str): The phoneme associated with the frame.
         mel_segment (np.ndarray): The mel spectrogram segment for the frame.
+        detected (bool): Whether the landmarks were detected on this frame, rather than interpolated.
         """
         
         self.emo_label = emo_label
         self.frame_index = frame_index
-        self.landmarks = landmarks
+        self.landmarks = landmarks_array(landmarks)
         self.phoneme = phoneme
         self.mel_segment = mel_segment
+        self.detected = detected
 
-        
\ No newline at end of file
@@ -4,8 +4,12 @@ Created on Wed Jun 12 19:53:13 2024
 
 @author: Jayyy
 """
+import subprocess
+import tempfile
 import cv2
+import imageio_ffmpeg as ffmpeg
 import numpy as np
+from Instrumentation import timer
 
 
 class VideoController:
@@ -13,18 +17,33 @@ class VideoController:
     A class to handle video processing tasks such as reading frames
     and retrieving frame timestamps.
     """
-    def __init__(self, video_path):
+    def __init__(self, video_path, width=None, rgb=False):
         """
         Initialize a VideoController instance.
         
+        Frames are decoded with OpenCV as full-resolution BGR by default. With a width or
+        rgb, ffmpeg decodes them instead, scaling and converting the colours as part of
+        the decode rather than frame by frame in Python.
+        
         Parameters:
         video_path (str): The path to the video file.
+        width (int): The width to decode frames at, keeping the aspect ratio; None for the full resolution.
+        rgb (bool): Whether to yield RGB frames rather than BGR.
         """
         self.video_path = video_path
         self.cap = cv2.VideoCapture(video_path)
         self.fps = self.cap.get(cv2.CAP_PROP_FPS)
         self.frame_duration_ms = 1000 / self.fps # Duration of each frame in milliseconds
         self.frame_index = 0
+        self.rgb = rgb
+
+        self.source_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.frame_size = self.source_size
+        if width and width < self.source_size[0]:
+            # Even dimensions, as most pixel formats need
+            height = int(round(self.source_size[1] * width / self.source_size[0] / 2)) * 2
+            self.frame_size = (int(width) // 2 * 2, height)
+        self.use_ffmpeg = rgb or self.frame_size != self.source_size
     
     def process_video(self):
         """
@@ -33,8 +52,13 @@ class VideoController:
         Yields:
         tuple: A tuple containing the frame, frame timestamp in milliseconds, and frame index.
         """
+        if self.use_ffmpeg:
+            yield from self.process_video_ffmpeg()
+            return
+
         while self.cap.isOpened():
-            ret, frame = self.cap.read()
+            with timer('video_decode'):
+                ret, frame = self.cap.read()
             if not ret:
                 break
             
@@ -44,6 +68,45 @@ class VideoController:
         
         self.cap.release()
         cv2.destroyAllWindows()
+
+    def process_video_ffmpeg(self):
+        """
+        Generator function reading frames through an ffmpeg pipe at frame_size, in RGB or BGR.
+        
+        Yields:
+        tuple: A tuple containing the frame, frame timestamp in milliseconds, and frame index.
+        """
+        self.cap.release()
+        width, height = self.frame_size
+        frame_bytes = width * height * 3
+        command = [ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error', '-i', self.video_path]
+        if self.frame_size != self.source_size:
+            command += ['-vf', f'scale={width}:{height}:flags=area']
+        command += ['-f', 'rawvideo', '-pix_fmt', 'rgb24' if self.rgb else 'bgr24', '-']
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+        try:
+            while True:
+                with timer('video_decode'):
+                    buffer = read_exactly(process.stdout, frame_bytes)
+                if buffer is None:
+                    break
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+
+                frame_timestamp_ms = int(self.frame_index * self.frame_duration_ms)
+                self.frame_index += 1
+                yield frame, frame_timestamp_ms, self.frame_index
+        finally:
+            # The consumer may stop early, leaving ffmpeg blocked on a full pipe
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            stderr = process.stderr.read().decode('utf-8', 'replace')
+            process.stderr.close()
+            process.wait()
+
+        if self.frame_index == 0:
+            raise RuntimeError(f"process_video_ffmpeg - ffmpeg decoded no frames: {stderr.strip()}")
     
     def show_frame(self, frame):
         """
@@ -56,3 +119,105 @@ class VideoController:
         if cv2.waitKey(1) == ord('q'):
             cv2.destroyAllWindows()
 
+class VideoWriter:
+    """
+    Encodes BGR frames to a video file through a single ffmpeg pipe.
+    """
+    def __init__(self, output_path, frame_size, fps, audio_source=None, crf=23, preset='veryfast'):
+        """
+        Initialize a VideoWriter instance and start ffmpeg.
+        
+        Parameters:
+        output_path (str): The video file to write.
+        frame_size (tuple): The (width, height) of the frames; odd sizes are padded by a pixel for yuv420p.
+        fps (float): The frame rate.
+        audio_source (str): Optional file whose audio track, if any, is copied into the output.
+        crf (int): The x264 quality, lower is better.
+        preset (str): The x264 speed preset.
+        """
+        self.output_path = output_path
+        self.frame_size = frame_size
+        self.frame_bytes = frame_size[0] * frame_size[1] * 3
+        self.frames_written = 0
+
+        command = [ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{frame_size[0]}x{frame_size[1]}', '-r', str(fps), '-i', '-']
+        if frame_size[0] % 2 or frame_size[1] % 2:
+            command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        if audio_source:
+            command += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', 'aac', '-shortest']
+        command += ['-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p', output_path]
+        # stderr goes to a file rather than a pipe, which ffmpeg could fill while we only write
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr, bufsize=self.frame_bytes)
+
+    def write(self, frame):
+        """
+        Write a frame.
+        
+        Parameters:
+        frame (np.ndarray): A (height, width, 3) uint8 BGR frame of frame_size.
+        """
+        if frame.shape != (self.frame_size[1], self.frame_size[0], 3) or frame.dtype != np.uint8:
+            raise ValueError(f"VideoWriter.write - expected a {self.frame_size} uint8 BGR frame, got {frame.shape} {frame.dtype}")
+        with timer('video_encode'):
+            try:
+                self.process.stdin.write(np.ascontiguousarray(frame).data)
+            except BrokenPipeError:
+                self.close()
+        self.frames_written += 1
+
+    def close(self):
+        """
+        Finish the video and wait for ffmpeg.
+        
+        Returns:
+        str: The path to the video.
+        """
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        if not self.stderr.closed:
+            self.stderr.seek(0)
+            stderr = self.stderr.read().decode('utf-8', 'replace')
+            self.stderr.close()
+            if returncode != 0:
+                raise RuntimeError(f"VideoWriter.close - ffmpeg failed writing {self.output_path}: {stderr.strip()}")
+        return self.output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.close()
+        except RuntimeError:
+            # The exception that stopped the writing is the one to report
+            if exc_type is None:
+                raise
+
+def read_exactly(stream, size):
+    """
+    Read exactly size bytes from a stream into a new writable buffer.
+    
+    Parameters:
+    stream (io.BufferedReader): The stream to read.
+    size (int): The number of bytes.
+    
+    Returns:
+    bytearray: The bytes, or None when the stream ends first.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        read = stream.readinto(view[received:])
+        if not read:
+            return None
+        received += read
+    return buffer